@@ -0,0 +1,18 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+from django.apps import AppConfig
+
+
+class SmugglerConfig(AppConfig):
+    name = 'smuggler'
+    verbose_name = 'Smuggler'
+
+    def ready(self):
+        # Make smuggler's formats available to dumpdata and loaddata too
+        from smuggler.serializers import register_serializers
+        register_serializers()
@@ -0,0 +1,168 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+import bz2
+import io
+import os.path
+import zipfile
+import zlib
+from django.core.management import CommandError
+from django.core.serializers.base import DeserializationError
+from django.utils.encoding import force_bytes
+
+try:
+    import lzma
+except ImportError:  # before python 3.3
+    try:
+        from backports import lzma
+    except ImportError:  # xz support is optional
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+# Number of compressed bytes read from a fixture at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def gzip_compressor(level=None):
+    if level is None:
+        level = zlib.Z_DEFAULT_COMPRESSION
+    # A window size of 16 + MAX_WBITS makes zlib write a gzip container
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def zstd_compressor(level=None):
+    if level is None:
+        level = 3
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+# Maps compression names to (file extension, content type, compressor)
+COMPRESSIONS = {
+    'gzip': ('gz', 'application/gzip', gzip_compressor),
+}
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = ('zst', 'application/zstd', zstd_compressor)
+
+
+def get_compression(name):
+    """Returns the (file extension, content type, compressor) of a
+    compression.
+
+    Raises CommandError for unknown or unavailable compressions.
+    """
+    try:
+        return COMPRESSIONS[name]
+    except KeyError:
+        raise CommandError('Unknown compression: %s' % name)
+
+
+def iter_compressed(chunks, compression, level=None):
+    """Compresses an iterable of chunks, yielding compressed data as soon as
+    the compressor produces it.
+    """
+    compressor = get_compression(compression)[2](level)
+    for chunk in chunks:
+        data = compressor.compress(force_bytes(chunk))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Maps file extensions of compressed fixtures to decompressor factories,
+# zip archives are handled separately by open_compressed.
+DECOMPRESSIONS = {
+    'gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'bz2': bz2.BZ2Decompressor,
+    'zip': None,
+}
+if lzma is not None:
+    DECOMPRESSIONS['xz'] = lzma.LZMADecompressor
+if zstandard is not None:
+    DECOMPRESSIONS['zst'] = lambda: zstandard.ZstdDecompressor(
+        ).decompressobj()
+
+
+class DecompressingReader(io.RawIOBase):
+    """A read-only file object that decompresses another file object while
+    it is being read.
+
+    Only ``READ_CHUNK_SIZE`` compressed bytes and their decompressed output
+    are held in memory at a time.
+    """
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.pending = b''
+        self.offset = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.pending) and not self.eof:
+            data = self.fileobj.read(READ_CHUNK_SIZE)
+            try:
+                if data:
+                    self.pending = self.decompressor.decompress(data)
+                else:
+                    self.eof = True
+                    self.pending = b''
+                    if hasattr(self.decompressor, 'flush'):
+                        # zstandard before 0.15 returns None
+                        self.pending = self.decompressor.flush() or b''
+            except Exception as e:
+                raise DeserializationError(
+                    'Invalid compressed data: %s' % e)
+            self.offset = 0
+        size = min(len(b), len(self.pending) - self.offset)
+        b[:size] = self.pending[self.offset:self.offset + size]
+        self.offset += size
+        return size
+
+    def close(self):
+        self.fileobj.close()
+        super(DecompressingReader, self).close()
+
+
+def split_compression(name):
+    """Splits a file name in the name of the file it compresses and its
+    compression, e.g. 'dump.json.gz' becomes ('dump.json', 'gz').
+
+    The compression is None for uncompressed files.
+    """
+    base, extension = os.path.splitext(name)
+    extension = extension[1:].lower()
+    if extension in DECOMPRESSIONS:
+        return base, extension
+    return name, None
+
+
+def open_compressed(fileobj, compression):
+    """Returns a file object that reads decompressed data from ``fileobj``.
+
+    Zip archives must contain exactly one file.
+    """
+    if compression is None:
+        return fileobj
+    if compression == 'zip':
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipfile as e:
+            raise DeserializationError('Invalid zip archive: %s' % e)
+        if len(archive.namelist()) != 1:
+            raise DeserializationError(
+                'Zip-compressed fixtures must contain one file.')
+        return archive.open(archive.namelist()[0])
+    if compression not in DECOMPRESSIONS:
+        raise CommandError('Unknown compression: %s' % compression)
+    return io.BufferedReader(
+        DecompressingReader(fileobj, DECOMPRESSIONS[compression]()))
@@ -0,0 +1,446 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""Dry runs that check whether fixtures can be loaded without keeping them.
+
+In ``parse`` mode fixtures are only read and deserialized, the database is
+not written to. In ``rollback`` mode the objects are also saved, the way
+load_fixtures saves them, in a transaction that is rolled back at the end.
+Either way every object is read, the objects of each model are counted and
+the first errors are collected with the position of the object they are
+about, along with the time spent parsing and inserting.
+
+In ``rollback`` mode each batch of objects is saved before an object of
+another model is deserialized, like load_fixtures does, so natural keys of
+objects of the batch can be looked up. In ``parse`` mode the natural keys
+of the objects read earlier are taken out of the objects that refer to
+them, which can't find them in the database. Fixtures of formats smuggler
+doesn't deserialize itself can't be checked past such a reference, the
+rest of the fixture is reported as a warning.
+
+Smuggler archives are read part by part. In ``parse`` mode the rows of
+copied tables are counted from the description of the table, they are only
+read in ``rollback`` mode, where the archive is loaded with load_archive
+and its loading time is counted as inserting.
+"""
+from contextlib import contextmanager
+from timeit import default_timer
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import CommandError
+from django.core.serializers.base import DeserializationError
+from django.db import DatabaseError, IntegrityError, models, transaction
+from django.db.models.fields import FieldDoesNotExist
+from django.utils.encoding import force_text
+from smuggler import settings
+from smuggler.compression import open_compressed
+from smuggler.native import ARCHIVE_FORMAT
+from smuggler.utils import (atomic_databases, bulk_save_objects,
+                            check_constraints, constraint_checks_disabled,
+                            deserialize_archive_objects, deserialize_fixture,
+                            get_fixture_name, get_model, get_table_target,
+                            get_write_databases, has_natural_key,
+                            iter_archive_parts, load_archive, on_databases,
+                            open_fixture,
+                            parse_fixture_name, save_object, save_objects)
+
+PARSE = 'parse'
+ROLLBACK = 'rollback'
+DRY_RUN_MODES = (PARSE, ROLLBACK)
+
+try:
+    savepoint = transaction.atomic
+except AttributeError:  # before django 1.6
+    @contextmanager
+    def savepoint(using=None):
+        sid = transaction.savepoint(using=using)
+        try:
+            yield
+        except Exception:
+            transaction.savepoint_rollback(sid, using=using)
+            raise
+        transaction.savepoint_commit(sid, using=using)
+
+
+def is_missing_object(error):
+    """Tells whether a deserializer failed to find an object, the target of
+    a natural key.
+    """
+    if isinstance(error, DeserializationError) and error.args:
+        error = error.args[0]
+    return isinstance(error, ObjectDoesNotExist)
+
+
+class Rollback(Exception):
+    """Raised to roll back the transaction of a dry run.
+    """
+
+
+class DryRunReport(object):
+    """What a dry run found.
+
+    ``errors`` holds the first ``max_errors`` errors, each with the name of
+    the fixture and the ``position`` of the object it is about, counting the
+    objects to be loaded from 1. Its position is None for errors about a
+    whole fixture. ``warnings`` holds the objects that could not be checked
+    the same way.
+    """
+    def __init__(self, mode, max_errors=settings.SMUGGLER_DRY_RUN_MAX_ERRORS):
+        self.mode = mode
+        self.max_errors = max_errors
+        self.fixture_count = 0
+        self.models = {}
+        self.errors = []
+        self.error_count = 0
+        self.warnings = []
+        self.bytes_read = 0
+        self.parse_time = 0.0
+        self.insert_time = 0.0
+        self.inserted = 0
+
+    @property
+    def object_count(self):
+        return sum(self.models.values())
+
+    @property
+    def is_valid(self):
+        return not self.error_count
+
+    def count(self, label, count=1):
+        self.models[label] = self.models.get(label, 0) + count
+
+    def add_error(self, name, position, error):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({
+                'name': name,
+                'position': position,
+                'error': force_text(error),
+            })
+
+    def add_warning(self, name, position, message):
+        if len(self.warnings) < self.max_errors:
+            self.warnings.append({
+                'name': name,
+                'position': position,
+                'error': message,
+            })
+
+    @property
+    def parse_rate(self):
+        """Objects deserialized per second.
+        """
+        if not self.parse_time:
+            return None
+        return self.object_count / self.parse_time
+
+    @property
+    def insert_rate(self):
+        """Objects saved per second.
+        """
+        if not self.insert_time:
+            return None
+        return self.inserted / self.insert_time
+
+    def as_dict(self):
+        return {
+            'dry_run': self.mode,
+            'fixture_count': self.fixture_count,
+            'object_count': self.object_count,
+            'models': self.models,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'bytes_read': self.bytes_read,
+            'parse_seconds': self.parse_time,
+            'insert_seconds': self.insert_time,
+            'parse_rate': self.parse_rate,
+            'insert_rate': self.insert_rate,
+        }
+
+
+class DryRun(object):
+    """Reads fixtures, and saves their objects in ``rollback`` mode, into a
+    DryRunReport.
+
+    Objects are saved in batches of ``SMUGGLER_CHUNK_SIZE`` objects, each in
+    a savepoint. When a batch fails it is rolled back and its objects are
+    saved again one by one, to find those that can't be saved.
+    """
+    def __init__(self, mode=PARSE, using=None,
+                 bulk=settings.SMUGGLER_BULK_LOAD,
+                 on_conflict=settings.SMUGGLER_ON_CONFLICT, progress=None,
+                 model_filter=None,
+                 max_errors=settings.SMUGGLER_DRY_RUN_MAX_ERRORS,
+                 batch_size=settings.SMUGGLER_CHUNK_SIZE):
+        if mode not in DRY_RUN_MODES:
+            raise ValueError('Invalid dry run mode: %s' % mode)
+        self.mode = mode
+        self.using = using
+        self.bulk = bulk
+        self.on_conflict = on_conflict
+        self.progress = progress
+        self.model_filter = model_filter
+        self.batch_size = batch_size
+        self.report = DryRunReport(mode, max_errors)
+        self.saved_models = set()
+        # The natural keys of the objects read in parse mode
+        self.fixture_keys = set()
+        self.name = None
+        self.batch = []
+        self.announced = False
+        self.aliases = get_write_databases(using)
+
+    def run(self, fixtures):
+        self.report.fixture_count = len(fixtures)
+        if self.mode == PARSE:
+            for index, fixture in enumerate(fixtures):
+                self.check_fixture(index, fixture)
+            return self.report
+        try:
+            with atomic_databases(self.aliases):
+                with constraint_checks_disabled(self.aliases):
+                    for index, fixture in enumerate(fixtures):
+                        self.check_fixture(index, fixture)
+                try:
+                    check_constraints(self.saved_models, self.using)
+                except IntegrityError as e:
+                    self.report.add_error(None, None, e)
+                raise Rollback
+        except Rollback:
+            pass
+        return self.report
+
+    def check_fixture(self, index, fixture):
+        """Reads a fixture and saves its objects in ``rollback`` mode.
+        """
+        name = get_fixture_name(fixture)
+        if parse_fixture_name(name)[0] == ARCHIVE_FORMAT:
+            return self.check_archive(index, fixture)
+        position = bytes_read = 0
+        self.name = name
+        self.batch = []
+        self.announced = False
+        try:
+            name, fp = open_fixture(fixture)
+        except (IOError, OSError) as e:
+            self.report.add_error(name, None, e)
+            return
+        try:
+            try:
+                objects = deserialize_fixture(fixture, fp, self.using,
+                                              self.model_filter,
+                                              self.before_object)
+            except CommandError as e:
+                self.report.add_error(name, None, e)
+                return
+            while True:
+                if self.mode == ROLLBACK and self.batch and \
+                        not self.announced and has_natural_key(
+                            self.batch[-1][1].object.__class__):
+                    # The next object may refer to the batch by natural key
+                    self.save_batch()
+                start = default_timer()
+                insert_time = self.report.insert_time
+                try:
+                    obj = next(objects, None)
+                except Exception as e:
+                    # The rest of a fixture can't be read after an error
+                    if self.mode == PARSE and not self.announced and \
+                            is_missing_object(e):
+                        self.report.add_warning(
+                            name, position + 1,
+                            'Not checked further, natural keys of objects '
+                            'of the same fixture are only found in rollback '
+                            'mode: %s' % force_text(e))
+                    else:
+                        self.report.add_error(name, position + 1, e)
+                    break
+                finally:
+                    # Batches saved before the object was read are inserting
+                    self.report.parse_time += default_timer() - start - (
+                        self.report.insert_time - insert_time)
+                if obj is None:
+                    break
+                position += 1
+                bytes_read = fp.tell()
+                self.report.count(force_text(obj.object._meta))
+                if self.progress is not None:
+                    self.progress(index, obj.object.__class__, bytes_read)
+                if self.mode == ROLLBACK:
+                    self.batch.append((position, obj))
+                    if len(self.batch) >= self.batch_size:
+                        self.save_batch()
+                else:
+                    self.add_fixture_key(obj)
+            self.save_batch()
+            self.report.bytes_read += bytes_read
+        finally:
+            fp.close()
+
+    def before_object(self, data):
+        """Called by smuggler's deserializers before an object is
+        deserialized: saves the batch in ``rollback`` mode when the object
+        is of another model, so it can refer to the batch by natural key.
+        """
+        self.announced = True
+        if self.mode == PARSE:
+            self.forget_fixture_keys(data)
+        elif self.batch and force_text(data.get('model')).lower() != \
+                force_text(self.batch[-1][1].object._meta):
+            self.save_batch()
+
+    def add_fixture_key(self, obj):
+        """Remembers the natural key of an object read in ``parse`` mode.
+        """
+        if not hasattr(obj.object, 'natural_key'):
+            return
+        try:
+            key = obj.object.natural_key()
+        except Exception:  # Its own natural keys may not be found either
+            return
+        self.fixture_keys.add((force_text(obj.object._meta), tuple(key)))
+
+    def forget_fixture_keys(self, data):
+        """Takes the natural keys of objects read earlier out of the raw data
+        of an object. ``parse`` mode doesn't save objects, the deserializer
+        would not find them.
+        """
+        try:
+            model = get_model(*data['model'].split('.', 1))
+            fields = data['fields'].items()
+        except (AttributeError, KeyError, LookupError, TypeError,
+                ValueError):
+            return  # For the deserializer to report
+        for field_name, value in list(fields):
+            try:
+                field = model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                continue
+            if field.rel is None or not has_natural_key(field.rel.to):
+                continue
+            label = force_text(field.rel.to._meta)
+            if isinstance(field.rel, models.ManyToManyRel) and \
+                    isinstance(value, list):
+                data['fields'][field_name] = [
+                    key for key in value
+                    if not self.is_fixture_key(label, key)]
+            elif self.is_fixture_key(label, value):
+                data['fields'][field_name] = None
+
+    def is_fixture_key(self, label, value):
+        return isinstance(value, (list, tuple)) and \
+            (label, tuple(value)) in self.fixture_keys
+
+    def check_archive(self, index, fixture):
+        """Reads a smuggler archive and loads it in ``rollback`` mode.
+        """
+        name = get_fixture_name(fixture)
+        position = 0
+        try:
+            name, fp = open_fixture(fixture)
+        except (IOError, OSError) as e:
+            self.report.add_error(name, None, e)
+            return
+        try:
+            stream = open_compressed(fp, parse_fixture_name(name)[1])
+            start = default_timer()
+            try:
+                if self.mode == ROLLBACK:
+                    with self.savepoint():
+                        for model in load_archive(
+                                stream, self.using, self.bulk,
+                                self.on_conflict, self.model_filter):
+                            position += 1
+                            self.saved_models.add(model)
+                            self.count(index, model, 1, fp.tell())
+                    self.report.inserted += position
+                else:
+                    for model, count in self.read_archive(stream):
+                        position += count
+                        self.count(index, model, count, fp.tell())
+            except Exception as e:
+                # The rest of an archive can't be read after an error
+                self.report.add_error(name, position + 1, e)
+            finally:
+                if self.mode == ROLLBACK:
+                    self.report.insert_time += default_timer() - start
+                else:
+                    self.report.parse_time += default_timer() - start
+            self.report.bytes_read += fp.tell()
+        finally:
+            fp.close()
+
+    def read_archive(self, fp):
+        """Yields the models of the objects and copied rows of a smuggler
+        archive that would be loaded, with their number.
+        """
+        for table, data in iter_archive_parts(fp):
+            if table is None:
+                for obj in deserialize_archive_objects(
+                        data, self.using, self.model_filter,
+                        self.forget_fixture_keys):
+                    self.add_fixture_key(obj)
+                    yield obj.object.__class__, 1
+                continue
+            target = get_table_target(table, self.using, self.model_filter)
+            if target is not None:
+                yield target[0], table['rows']
+
+    def count(self, index, model, count, bytes_read):
+        self.report.count(force_text(model._meta), count)
+        if self.progress is not None:
+            self.progress(index, model, bytes_read)
+
+    def savepoint(self):
+        return on_databases(lambda using: savepoint(using=using),
+                            self.aliases)
+
+    def save_batch(self):
+        name, batch, self.batch = self.name, self.batch, []
+        if not batch:
+            return
+        start = default_timer()
+        objects = [obj for position, obj in batch]
+        self.saved_models.update(obj.object.__class__ for obj in objects)
+        try:
+            with self.savepoint():
+                if self.bulk:
+                    models = bulk_save_objects(objects, self.using,
+                                               self.on_conflict)
+                else:
+                    models = save_objects(objects, self.using)
+                for model in models:
+                    pass
+        except (DatabaseError, IntegrityError):
+            self.save_one_by_one(name, batch)
+        else:
+            self.report.inserted += len(batch)
+        self.report.insert_time += default_timer() - start
+
+    def save_one_by_one(self, name, batch):
+        for position, obj in batch:
+            try:
+                with self.savepoint():
+                    save_object(obj, self.using)
+            except (DatabaseError, IntegrityError) as e:
+                self.report.add_error(name, position, e)
+            else:
+                self.report.inserted += 1
+
+
+def dry_run_fixtures(fixtures, mode=PARSE, using=None,
+                     bulk=settings.SMUGGLER_BULK_LOAD,
+                     on_conflict=settings.SMUGGLER_ON_CONFLICT, progress=None,
+                     model_filter=None,
+                     max_errors=settings.SMUGGLER_DRY_RUN_MAX_ERRORS):
+    """Checks whether fixtures can be loaded, without loading them. Returns
+    a DryRunReport.
+
+    The other arguments are used like by load_fixtures.
+    """
+    return DryRun(mode, using, bulk, on_conflict, progress, model_filter,
+                  max_errors).run(fixtures)
@@ -0,0 +1,257 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""An index of the fixtures in ``SMUGGLER_FIXTURE_DIR``.
+
+Listing a large fixture directory is slow, on network storage in
+particular, so the listing is kept in memory until the mtime of the
+directory changes. The number of objects per model of a fixture is taken
+from its manifest, or read from the fixture in a background thread, the
+first time it is shown. It is kept in the ``.smuggler_index`` directory,
+with the size and mtime of the file it was read from, as is the failure to
+count the objects of fixtures that can't be read. Saving it there doesn't
+change the mtime of the fixture directory. Fixtures that are shown are
+checked for changes on their own, files overwritten in place don't change
+the mtime of the directory.
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from django.core.serializers.base import DeserializationError
+from django.utils.encoding import force_bytes, force_text
+from smuggler.compression import DECOMPRESSIONS
+from smuggler.manifest import read_manifest
+from smuggler.utils import (get_fixture_formats, get_fixture_model_counts,
+                            parse_fixture_name)
+
+INDEX_DIRNAME = '.smuggler_index'
+INDEX_FILENAME = 'fixtures.json'
+
+# Directory mtimes are trusted only if they are older than this many seconds
+# when the directory is listed, file systems with a coarse mtime resolution
+# would otherwise hide files added right after a listing.
+MTIME_RESOLUTION = 2
+
+# Object counts are only read from fixtures without a manifest up to this
+# size in bytes
+MAX_COUNT_SIZE = 16 * 1024 * 1024
+
+
+def get_fixture_pattern():
+    """Returns a regex that matches the names of fixtures, like
+    ``(?i)^.+(\\.xml|\\.json)(\\.gz|\\.zip)?$``.
+    """
+    return '(?i)^.+(%s)(%s)?$' % (
+        '|'.join([r'\.%s' % ext for ext in get_fixture_formats()]),
+        '|'.join([r'\.%s' % ext for ext in DECOMPRESSIONS]))
+
+
+class FixtureEntry(object):
+    """A fixture in the index.
+
+    ``model_counts`` maps model labels to numbers of objects, it is None
+    until the fixture was read, or if it can't be read. ``counted`` is True
+    once the fixture was read, or failed to be.
+    """
+    def __init__(self, path, size, mtime, model_counts=None, counted=False):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.mtime = mtime
+        self.format, self.compression = parse_fixture_name(self.name)
+        self.model_counts = model_counts
+        self.counted = counted
+
+    def update(self):
+        """Forgets the object counts if the file changed since it was listed.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:  # Removed, it is dropped with the next listing
+            return
+        if (stat.st_size, stat.st_mtime) != (self.size, self.mtime):
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+            self.model_counts = None
+            self.counted = False
+
+    @property
+    def modified(self):
+        return datetime.fromtimestamp(self.mtime)
+
+    @property
+    def object_count(self):
+        if self.model_counts is None:
+            return None
+        return sum(self.model_counts.values())
+
+    @property
+    def models(self):
+        return sorted((self.model_counts or {}).items())
+
+
+class FixtureIndex(object):
+    """The fixtures of a directory, sorted by name.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.match = re.compile(get_fixture_pattern())
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.listed = 0
+        self.entries = []
+        self.entries_by_path = {}
+        self.counting = False
+
+    def is_stale(self):
+        mtime = os.stat(self.path).st_mtime
+        return mtime != self.mtime or self.listed - mtime < MTIME_RESOLUTION
+
+    def refresh(self):
+        """Lists the directory again if it changed since it was listed.
+        """
+        with self.lock:
+            if self.is_stale():
+                self.list_fixtures()
+
+    def list_fixtures(self):
+        self.listed = time.time()
+        self.mtime = os.stat(self.path).st_mtime
+        saved = self.load()
+        entries = []
+        for name in sorted(os.listdir(self.path)):
+            # Skips the index and other files smuggler keeps in the directory
+            if name.startswith('.') or not self.match.search(name):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # Removed while the directory was listed
+                continue
+            if not os.path.isfile(path):
+                continue
+            entry = FixtureEntry(path, stat.st_size, stat.st_mtime)
+            if name in saved and saved[name]['size'] == stat.st_size and \
+                    saved[name]['mtime'] == stat.st_mtime:
+                entry.model_counts = saved[name]['models']
+                entry.counted = True
+            entries.append(entry)
+        self.entries = entries
+        self.entries_by_path = dict((entry.path, entry) for entry in entries)
+
+    def get_index_path(self):
+        return os.path.join(self.path, INDEX_DIRNAME, INDEX_FILENAME)
+
+    def load(self):
+        try:
+            with open(self.get_index_path(), 'rb') as fp:
+                return json.loads(force_text(fp.read()))
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self):
+        data = dict((entry.name, {
+            'size': entry.size,
+            'mtime': entry.mtime,
+            'models': entry.model_counts,
+        }) for entry in self.entries if entry.counted)
+        tmp_path = '%s.tmp' % self.get_index_path()
+        try:
+            # Only creating the directory changes the mtime of the fixture
+            # directory, and lists it again
+            if not os.path.isdir(os.path.dirname(tmp_path)):
+                os.makedirs(os.path.dirname(tmp_path))
+            with open(tmp_path, 'wb') as fp:
+                fp.write(force_bytes(json.dumps(data)))
+            os.rename(tmp_path, self.get_index_path())
+        except (IOError, OSError):  # The index is only a cache
+            pass
+
+    def search(self, query=''):
+        """Returns the fixtures whose names contain every word of
+        ``query``, ignoring case.
+        """
+        self.refresh()
+        words = query.lower().split()
+        return [entry for entry in self.entries
+                if all(word in entry.name.lower() for word in words)]
+
+    def get(self, path):
+        """Returns the fixture at ``path``, or None if it is not indexed.
+        """
+        self.refresh()
+        return self.entries_by_path.get(path)
+
+    def count_models(self, entries):
+        """Reads the number of objects per model of fixtures that were not
+        read yet, or changed since, and saves them in the index.
+        """
+        counted = False
+        for entry in entries:
+            entry.update()
+            if entry.counted:
+                continue
+            manifest = read_manifest(entry.path)
+            if manifest is not None and manifest.get('size') == entry.size:
+                entry.model_counts = dict(
+                    (model['model'], model['count'])
+                    for model in manifest['models'])
+            elif entry.size <= MAX_COUNT_SIZE:
+                try:
+                    entry.model_counts = get_fixture_model_counts(entry.path)
+                except (DeserializationError, IOError, OSError):
+                    pass
+            # Fixtures that can't be counted are not read again until they
+            # change
+            entry.counted = counted = True
+        if counted:
+            with self.lock:
+                self.save()
+
+    def count_models_in_background(self, entries):
+        """Like count_models, in a thread of its own. Only the changes of
+        the fixtures are checked right away, the counts are shown once they
+        are read.
+
+        Entries are skipped while another thread counts, they are counted
+        the next time they are shown.
+        """
+        for entry in entries:
+            entry.update()
+        entries = [entry for entry in entries if not entry.counted]
+        with self.lock:
+            if not entries or self.counting:
+                return
+            self.counting = True
+        thread = threading.Thread(target=self.count_models_and_finish,
+                                  args=(entries,),
+                                  name='smuggler-fixture-index')
+        thread.daemon = True
+        thread.start()
+
+    def count_models_and_finish(self, entries):
+        try:
+            self.count_models(entries)
+        finally:
+            self.counting = False
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_fixture_index(path):
+    """Returns the index of the fixtures in ``path``, which is shared by the
+    threads of a process.
+    """
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = FixtureIndex(path)
+        return _indexes[path]
@@ -5,12 +5,18 @@
 # Django Smuggler is free software under terms of the GNU Lesser
 # General Public License version 3 (LGPLv3) as published by the Free
 # Software Foundation. See the file README for copying conditions.
-import os.path
 from django import forms
 from django.contrib.admin.widgets import FilteredSelectMultiple
-from django.core.serializers import get_serializer_formats
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.urlresolvers import reverse
+from django.template.loader import render_to_string
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 from smuggler import settings
+from smuggler.fixture_index import get_fixture_index, get_fixture_pattern
+from smuggler.uploads import Upload
+from smuggler.utils import (get_app_labels, get_app_models,
+                            get_fixture_formats, parse_fixture_name)
 
 
 class MultiFileInput(forms.FileInput):
@@ -39,8 +45,8 @@ class MultiFixtureField(forms.FileField):
     def validate(self, data):
         super(MultiFixtureField, self).validate(data)
         for upload in data:
-            file_format = os.path.splitext(upload.name)[1][1:].lower()
-            if file_format not in get_serializer_formats():
+            file_format = parse_fixture_name(upload.name)[0]
+            if file_format not in get_fixture_formats():
                 raise forms.ValidationError(
                     _('Invalid file extension: .%(extension)s.') % {
                         'extension': file_format
@@ -48,28 +54,150 @@ class MultiFixtureField(forms.FileField):
         return data
 
 
+class ChunkedUploadsInput(forms.HiddenInput):
+    def render(self, name, value, attrs=None):
+        attrs = attrs or {}
+        attrs['data-part-size'] = settings.SMUGGLER_UPLOAD_PART_SIZE
+        attrs['data-url'] = reverse('start-upload')
+        return super(ChunkedUploadsInput, self).render(name, value, attrs)
+
+
+class ChunkedUploadsField(forms.CharField):
+    """The comma separated ids of fixtures uploaded in parts, the load form
+    script fills it in after uploading the selected files.
+    """
+    widget = ChunkedUploadsInput
+
+    def to_python(self, value):
+        uploads = []
+        for upload_id in super(ChunkedUploadsField, self).to_python(
+                value).split(','):
+            if not upload_id.strip():
+                continue
+            try:
+                upload = Upload.get(upload_id.strip())
+            except Upload.DoesNotExist:
+                raise forms.ValidationError(_('Unknown upload.'))
+            if not upload.is_complete:
+                raise forms.ValidationError(
+                    _('The upload of %(filename)s is not complete.') % {
+                        'filename': upload.filename
+                    })
+            uploads.append(upload)
+        return uploads
+
+
 class FixturePathField(forms.MultipleChoiceField, forms.FilePathField):
     widget = FilteredSelectMultiple(_('files'), False)
 
     def __init__(self, path, match=None, **kwargs):
-        match = match or (
-            '(?i)^.+(%s)$' % '|'.join(
-                ['\.%s' % ext for ext in get_serializer_formats()])
-        )  # Generate a regex string like: (?i)^.+(\.xml|\.json)$
+        match = match or get_fixture_pattern()
         super(FixturePathField, self).__init__(path, match=match, **kwargs)
         if not self.required:
             del self.choices[0]  # Remove the empty option
 
 
+class FixtureIndexWidget(forms.SelectMultiple):
+    """A table of fixtures with a checkbox, size, date, format and number of
+    objects each, a search box and links to the other pages of fixtures.
+    """
+    def __init__(self, attrs=None):
+        super(FixtureIndexWidget, self).__init__(attrs)
+        self.page = None
+        self.query = ''
+
+    def render(self, name, value, attrs=None, choices=()):
+        return render_to_string('smuggler/fixture_index_widget.html', {
+            'name': name,
+            'selected': [force_text(path) for path in value or []],
+            'page': self.page,
+            'query': self.query,
+        })
+
+
+class FixtureIndexField(forms.MultipleChoiceField):
+    """Picks fixtures from the index of a directory.
+
+    Only one page of the fixtures that match a search is offered, but any
+    fixture in the index is a valid choice.
+    """
+    widget = FixtureIndexWidget
+
+    def __init__(self, path, query='', page=1, per_page=50, **kwargs):
+        super(FixtureIndexField, self).__init__(**kwargs)
+        self.index = get_fixture_index(path)
+        paginator = Paginator(self.index.search(query), per_page)
+        try:
+            page = paginator.page(page)
+        except (EmptyPage, PageNotAnInteger):
+            page = paginator.page(1)
+        self.index.count_models_in_background(page.object_list)
+        self.choices = [(entry.path, entry.name)
+                        for entry in page.object_list]
+        self.widget.page = page
+        self.widget.query = query
+
+    def valid_value(self, value):
+        return self.index.get(value) is not None
+
+
+def get_model_choices():
+    """Returns the labels of the installed apps, each followed by the labels
+    of its models.
+    """
+    choices = []
+    for app_label in sorted(get_app_labels()):
+        choices.append((app_label, app_label))
+        for label in sorted(force_text(model._meta)
+                            for model in get_app_models(app_label)):
+            choices.append((label, label))
+    return choices
+
+
 class ImportForm(forms.Form):
     uploads = MultiFixtureField(
         label=_('Upload'),
         required=False
     )
+    include_models = forms.MultipleChoiceField(
+        label=_('Only load'),
+        required=False,
+        widget=FilteredSelectMultiple(_('models'), False),
+        help_text=_('Only objects of these apps and models are loaded, or'
+                    ' of all of them if none is chosen.')
+    )
+    exclude_models = forms.MultipleChoiceField(
+        label=_('Skip'),
+        required=False,
+        widget=FilteredSelectMultiple(_('models'), False),
+        help_text=_('Objects of these apps and models are not loaded.')
+    )
+    dry_run = forms.ChoiceField(
+        label=_('Dry run'),
+        required=False,
+        choices=[
+            ('', _('No, load the fixtures')),
+            ('parse', _('Only read the fixtures')),
+            ('rollback', _('Save the objects, then roll back')),
+        ],
+        help_text=_('Checks the fixtures and reports the objects per model,'
+                    ' the first errors and the throughput, without loading'
+                    ' anything.')
+    )
+
+    # Number of fixtures from the fixture directory offered at a time
+    fixtures_per_page = 50
 
     def __init__(self, *args, **kwargs):
+        query = kwargs.pop('query', '')
+        page = kwargs.pop('page', 1)
         super(ImportForm, self).__init__(*args, **kwargs)
+        model_choices = get_model_choices()
+        self.fields['include_models'].choices = model_choices
+        self.fields['exclude_models'].choices = model_choices
         if settings.SMUGGLER_FIXTURE_DIR:
+            self.fields['chunked_uploads'] = ChunkedUploadsField(
+                required=False)
             self.fields['store'] = forms.BooleanField(
                 label=_('Save in fixture directory'),
                 required=False,
@@ -78,8 +206,18 @@ class ImportForm(forms.Form):
                         'fixture_dir': settings.SMUGGLER_FIXTURE_DIR
                     })
             )
-            self.fields['picked_files'] = FixturePathField(
+            self.fields['background'] = forms.BooleanField(
+                label=_('Load in the background'),
+                required=False,
+                initial=settings.SMUGGLER_BACKGROUND_LOADS,
+                help_text=_('Fixtures are loaded by a background job, you'
+                            ' can follow its progress.')
+            )
+            self.fields['picked_files'] = FixtureIndexField(
                 settings.SMUGGLER_FIXTURE_DIR,
+                query=query,
+                page=page,
+                per_page=self.fixtures_per_page,
                 label=_('From fixture directory'),
                 required=False,
                 help_text=(
@@ -93,9 +231,10 @@ class ImportForm(forms.Form):
     def clean(self):
         super(ImportForm, self).clean()
         if settings.SMUGGLER_FIXTURE_DIR:
-            uploads = self.cleaned_data['uploads']
-            picked_files = self.cleaned_data['picked_files']
-            if not uploads and not picked_files:
+            uploads = self.cleaned_data.get('uploads')
+            chunked_uploads = self.cleaned_data.get('chunked_uploads')
+            picked_files = self.cleaned_data.get('picked_files')
+            if not uploads and not chunked_uploads and not picked_files:
                 raise forms.ValidationError(
                     _('At least one fixture file needs to be'
                       ' uploaded or selected.'))
@@ -111,5 +250,6 @@ class ImportForm(forms.Form):
             'admin/js/jquery.min.js',
             'admin/js/jquery.init.js',
             'admin/js/SelectBox.js',
-            'admin/js/SelectFilter2.js'
+            'admin/js/SelectFilter2.js',
+            'smuggler/js/chunked_upload.js'
         ]
@@ -0,0 +1,562 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""Background jobs that run outside of the request/response cycle.
+
+Jobs are stored as JSON files in a directory below ``SMUGGLER_FIXTURE_DIR``,
+so every process serving the admin sees the same jobs and no message broker
+is needed. Jobs are run by worker threads in the process that created them,
+or by the ``smuggler_jobs`` management command.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.management.base import CommandError
+from django.db import connections
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from django.utils.six.moves import queue
+from smuggler import settings
+from smuggler.manifest import DumpManifest, write_manifest
+from smuggler.uploads import Upload
+from smuggler.dry_run import dry_run_fixtures
+from smuggler.utils import (get_content_type, get_model_filter, load_fixtures,
+                            load_fixtures_in_parallel,
+                            save_uploaded_file_on_disk, serialize_chunks)
+
+logger = logging.getLogger('smuggler.jobs')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Minimum number of seconds between two saves of a running job's progress
+PROGRESS_INTERVAL = 1.0
+
+# Running jobs touch their lock file every HEARTBEAT_INTERVAL seconds, jobs
+# whose lock file is older than HEARTBEAT_TIMEOUT seconds were abandoned
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 120
+
+JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def get_job_dir():
+    if not settings.SMUGGLER_FIXTURE_DIR:
+        raise ImproperlyConfigured(
+            'Background jobs require SMUGGLER_FIXTURE_DIR to be set.')
+    return os.path.join(settings.SMUGGLER_FIXTURE_DIR, '.smuggler_jobs')
+
+
+class Job(object):
+    """A background job and its state.
+
+    ``params`` are the arguments of the job, ``progress`` is updated while
+    the job runs and ``result`` is set when it is done.
+    """
+    class DoesNotExist(ObjectDoesNotExist):
+        pass
+
+    fields = ('id', 'kind', 'status', 'params', 'progress', 'result',
+              'error', 'created', 'started', 'finished')
+
+    def __init__(self, kind, params=None, id=None, status=PENDING,
+                 progress=None, result=None, error=None, created=None,
+                 started=None, finished=None):
+        self.id = id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = status
+        self.params = params or {}
+        self.progress = progress or {}
+        self.result = result or {}
+        self.error = error
+        self.created = created or time.time()
+        self.started = started
+        self.finished = finished
+        self.saved = 0
+
+    @staticmethod
+    def get_path(job_id, extension='json'):
+        return os.path.join(get_job_dir(), '%s.%s' % (job_id, extension))
+
+    @property
+    def path(self):
+        return self.get_path(self.id)
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(self.created)
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def elapsed(self):
+        """Seconds the job has been running, or ran.
+        """
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def objects_per_second(self):
+        if not self.elapsed:
+            return 0
+        return self.progress.get('objects', 0) / self.elapsed
+
+    @property
+    def bytes_per_second(self):
+        if not self.elapsed:
+            return 0
+        return self.progress.get('bytes_read', 0) / self.elapsed
+
+    @property
+    def percent_done(self):
+        if not self.progress.get('bytes_total'):
+            return None
+        return int(100 * self.progress.get('bytes_read', 0) /
+                   self.progress['bytes_total'])
+
+    @property
+    def eta(self):
+        """Estimated time left as a timedelta, based on the number of bytes
+        read so far.
+        """
+        if self.is_finished or not self.bytes_per_second or \
+                not self.progress.get('bytes_total'):
+            return None
+        left = self.progress['bytes_total'] - self.progress['bytes_read']
+        return timedelta(seconds=int(left / self.bytes_per_second))
+
+    @property
+    def model_counts(self):
+        return sorted(self.progress.get('models', {}).items())
+
+    def as_dict(self):
+        """Returns the job's state and its throughput and ETA.
+        """
+        data = dict((field, getattr(self, field)) for field in self.fields)
+        eta = self.eta
+        data.update({
+            'elapsed': self.elapsed,
+            'objects_per_second': self.objects_per_second,
+            'bytes_per_second': self.bytes_per_second,
+            'percent_done': self.percent_done,
+            'eta': eta.days * 86400 + eta.seconds if eta else None,
+        })
+        return data
+
+    @classmethod
+    def get(cls, job_id):
+        if not JOB_ID_RE.match(job_id):
+            raise cls.DoesNotExist('Invalid job id: %s' % job_id)
+        try:
+            with open(cls.get_path(job_id), 'rb') as fp:
+                data = json.loads(force_text(fp.read()))
+        except (IOError, OSError):
+            raise cls.DoesNotExist('Job not found: %s' % job_id)
+        return cls(**dict((str(key), value) for key, value in data.items()))
+
+    @classmethod
+    def all(cls):
+        """Returns all jobs, oldest first.
+        """
+        try:
+            names = os.listdir(get_job_dir())
+        except OSError:
+            return []
+        jobs = []
+        for name in names:
+            job_id, extension = os.path.splitext(name)
+            if extension != '.json':
+                continue
+            try:
+                jobs.append(cls.get(job_id))
+            except cls.DoesNotExist:
+                continue
+        return sorted(jobs, key=lambda job: job.created)
+
+    @classmethod
+    def pending(cls):
+        """Returns the pending jobs, oldest first.
+        """
+        return [job for job in cls.all() if job.status == PENDING]
+
+    def save(self):
+        """Writes the job's state to disk.
+
+        The state is written to a temporary file first, so readers never see
+        a partially written job.
+        """
+        job_dir = get_job_dir()
+        if not os.path.isdir(job_dir):
+            try:
+                os.makedirs(job_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        data = dict((field, getattr(self, field)) for field in self.fields)
+        tmp_path = self.get_path(self.id, 'json.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(force_bytes(json.dumps(data)))
+        os.rename(tmp_path, self.path)
+        self.saved = time.time()
+
+    def claim(self):
+        """Marks the job as taken by the current worker.
+
+        The host and pid of the worker are written to the job's lock file.
+        Returns False if another worker claimed the job first.
+        """
+        try:
+            fd = os.open(self.get_path(self.id, 'lock'),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        try:
+            os.write(fd, force_bytes(json.dumps({
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+            })))
+        finally:
+            os.close(fd)
+        return True
+
+    def is_abandoned(self):
+        """Returns True if the job was claimed by a worker that stopped
+        before the job was finished, e.g. because its process was killed.
+
+        That is the case if the worker's process no longer exists on this
+        host, or if the worker didn't touch the lock file for
+        ``HEARTBEAT_TIMEOUT`` seconds.
+        """
+        if self.is_finished:
+            return False
+        lock_path = self.get_path(self.id, 'lock')
+        try:
+            heartbeat = os.stat(lock_path).st_mtime
+            with open(lock_path, 'rb') as fp:
+                owner = json.loads(force_text(fp.read()))
+        except (IOError, OSError):  # Not claimed
+            return False
+        except ValueError:  # Claimed right now, the owner is not written yet
+            owner = {}
+        if time.time() - heartbeat > HEARTBEAT_TIMEOUT:
+            return True
+        return owner.get('host') == socket.gethostname() and \
+            not process_exists(owner['pid'])
+
+    def beat(self, stopped):
+        """Touches the job's lock file every ``HEARTBEAT_INTERVAL`` seconds
+        until ``stopped`` is set.
+        """
+        while True:
+            stopped.wait(HEARTBEAT_INTERVAL)
+            if stopped.is_set():
+                return
+            try:
+                os.utime(self.get_path(self.id, 'lock'), None)
+            except OSError:  # Not claimed
+                return
+
+    def update_progress(self, **progress):
+        """Updates the job's progress, which is saved at most once every
+        ``PROGRESS_INTERVAL`` seconds.
+        """
+        self.progress.update(progress)
+        if time.time() - self.saved >= PROGRESS_INTERVAL:
+            self.save()
+
+    def run(self):
+        self.status = RUNNING
+        self.started = time.time()
+        self.save()
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self.beat, args=(stopped,),
+                                     name='smuggler-heartbeat')
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            self.result = JOB_HANDLERS[self.kind](self) or {}
+            self.status = DONE
+        except Exception as e:
+            logger.exception('Smuggler job %s failed', self.id)
+            self.status = FAILED
+            self.error = force_text(e)
+        finally:
+            stopped.set()
+        self.finished = time.time()
+        self.save()
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: the process exists, but belongs to another user
+        return e.errno != errno.ESRCH
+    return True
+
+
+def run_dump_job(job):
+    """Writes a dump to ``SMUGGLER_FIXTURE_DIR``.
+
+    The dump is written to a temporary file that is renamed once the dump is
+    complete. The SHA-1 of its content is kept as the ETag of downloads, so
+    identical dumps have the same ETag. A manifest is written next to the
+    dump.
+    """
+    params = job.params
+    manifest = DumpManifest()
+    started = time.time()
+    chunks = serialize_chunks(params['app_labels'], params['exclude'],
+                              params['format'], params['indent'],
+                              params['compression'],
+                              since=params.get('since'),
+                              incremental=params.get('incremental', False),
+                              manifest=manifest, using=params.get('using'))
+    path = os.path.join(settings.SMUGGLER_FIXTURE_DIR, params['filename'])
+    tmp_path = '%s.part' % path
+    size = 0
+    sha1 = hashlib.sha1()
+    try:
+        with open(tmp_path, 'wb') as fp:
+            for chunk in chunks:
+                chunk = force_bytes(chunk)
+                fp.write(chunk)
+                sha1.update(chunk)
+                size += len(chunk)
+                job.update_progress(size=size)
+        write_manifest(path, manifest.as_dict(
+            format=params['format'],
+            compression=params['compression'],
+            size=size,
+            sha1=sha1.hexdigest(),
+            created=datetime.fromtimestamp(started).isoformat(),
+            duration=time.time() - started))
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    content_type = get_content_type(params['format'], params['compression'])
+    return {'filename': params['filename'], 'size': size,
+            'content_type': content_type, 'sha1': sha1.hexdigest()}
+
+
+def run_load_job(job):
+    """Loads fixtures, keeping track of the number of loaded objects per
+    model and the number of bytes read.
+
+    Fixtures that were uploaded for the job are removed afterwards.
+    """
+    params = job.params
+    fixtures = params['fixtures']
+    model_filter = get_model_filter(params.get('include', []),
+                                    params.get('exclude', []))
+    sizes = [os.path.getsize(path) for path in fixtures]
+    models = {}
+    job.progress.update(objects=0, bytes_read=0, bytes_total=sum(sizes),
+                        models=models)
+
+    positions = [0] * len(fixtures)
+    lock = threading.Lock()
+
+    def progress(index, model, position):
+        # Fixtures may be loaded by several threads at once
+        with lock:
+            label = force_text(model._meta)
+            models[label] = models.get(label, 0) + 1
+            positions[index] = position
+            job.update_progress(objects=job.progress['objects'] + 1,
+                                bytes_read=sum(positions))
+
+    workers = settings.SMUGGLER_LOAD_WORKERS
+    try:
+        if params.get('dry_run'):
+            job.result = dry_run_fixtures(
+                fixtures, params['dry_run'], params['using'], params['bulk'],
+                params['on_conflict'], progress, model_filter).as_dict()
+        elif workers > 1 and len(fixtures) > 1:
+            results = load_fixtures_in_parallel(
+                fixtures, params['using'], params['bulk'],
+                params['on_conflict'], workers, progress,
+                model_filter=model_filter)
+            job.result = {
+                'object_count': sum(result['object_count']
+                                    for result in results),
+                'fixture_count': len(fixtures),
+                'fixtures': results,
+            }
+            errors = ['%(name)s: %(error)s' % result for result in results
+                      if result['status'] == 'failed']
+            if errors:
+                raise CommandError('\n'.join(errors))
+        else:
+            object_count = load_fixtures(
+                fixtures, params['using'], params['bulk'],
+                params['on_conflict'], progress, model_filter=model_filter)
+            job.result = {'object_count': object_count,
+                          'fixture_count': len(fixtures)}
+    finally:
+        if params['staging_dir']:
+            shutil.rmtree(params['staging_dir'], ignore_errors=True)
+        for upload_id in params.get('uploads', []):
+            try:
+                Upload.get(upload_id).delete()
+            except Upload.DoesNotExist:
+                pass
+    job.progress['bytes_read'] = job.progress['bytes_total']
+    return job.result
+
+
+JOB_HANDLERS = {
+    'dump': run_dump_job,
+    'load': run_load_job,
+}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def work():
+    while True:
+        job_id = _queue.get()
+        try:
+            job = Job.get(job_id)
+            if job.claim():
+                job.run()
+        except Exception:
+            logger.exception('Smuggler job %s could not be run', job_id)
+        finally:
+            # Worker threads have their own database connections
+            for connection in connections.all():
+                connection.close()
+
+
+def start_workers():
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            return
+        _queue = queue.Queue()
+        for i in range(settings.SMUGGLER_JOB_WORKERS):
+            thread = threading.Thread(target=work,
+                                      name='smuggler-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+
+
+def enqueue(job):
+    """Saves a new job and hands it to a worker thread.
+
+    When ``SMUGGLER_JOB_RUNNER`` is ``'command'`` the job is left for the
+    ``smuggler_jobs`` management command instead.
+    """
+    job.save()
+    if settings.SMUGGLER_JOB_RUNNER == 'thread':
+        start_workers()
+        _queue.put(job.id)
+    return job
+
+
+def start_dump(app_labels, exclude, filename, compression=None, since=None,
+               incremental=False, using=settings.SMUGGLER_DUMP_DATABASE):
+    """Enqueues a job that writes a dump to ``SMUGGLER_FIXTURE_DIR``.
+
+    Unknown apps, models and compressions are reported right away instead of
+    failing the job.
+    """
+    get_job_dir()
+    params = {
+        'app_labels': app_labels,
+        'exclude': exclude,
+        'filename': filename,
+        'format': settings.SMUGGLER_FORMAT,
+        'indent': settings.SMUGGLER_INDENT,
+        'compression': compression,
+        'since': since.isoformat() if since else None,
+        'incremental': incremental,
+        'using': using,
+    }
+    serialize_chunks(app_labels, exclude, params['format'], params['indent'],
+                     compression, since=since, using=using)
+    return enqueue(Job('dump', params))
+
+
+def start_load(fixtures, using=None, uploads=(), include=(),
+               exclude=(), dry_run=None):
+    """Enqueues a job that loads fixtures with load_fixtures.
+
+    ``fixtures`` are paths or uploaded files. Uploaded files are saved in
+    the job directory first, where the worker can read them. The chunked
+    ``uploads`` are removed once the job is done. Only objects of the
+    ``include``d models, except the ``exclude``d ones, are loaded. With a
+    ``dry_run`` mode the fixtures are checked with dry_run_fixtures instead.
+    """
+    job = Job('load')
+    staging_dir = None
+    paths = []
+    for fixture in fixtures:
+        if isinstance(fixture, six.string_types):
+            paths.append(fixture)
+            continue
+        if staging_dir is None:
+            staging_dir = job.get_path(job.id, 'files')
+            os.makedirs(staging_dir)
+        path = os.path.join(staging_dir, os.path.basename(fixture.name))
+        save_uploaded_file_on_disk(fixture, path)
+        paths.append(path)
+    job.params = {
+        'fixtures': paths,
+        'staging_dir': staging_dir,
+        'uploads': list(uploads),
+        'include': list(include),
+        'exclude': list(exclude),
+        'dry_run': dry_run,
+        'using': using,
+        'bulk': settings.SMUGGLER_BULK_LOAD,
+        'on_conflict': settings.SMUGGLER_ON_CONFLICT,
+    }
+    return enqueue(job)
+
+
+def run_pending_jobs():
+    """Runs pending jobs that are not claimed by another worker.
+
+    Jobs that were abandoned by their worker are marked as failed, they
+    are not run again because they may be half done. Returns the jobs that
+    were run or failed.
+    """
+    jobs = []
+    for job in Job.all():
+        if job.is_abandoned():
+            logger.error('Smuggler job %s was abandoned by its worker',
+                         job.id)
+            job.status = FAILED
+            job.error = 'The worker running the job stopped.'
+            job.finished = time.time()
+            job.save()
+            jobs.append(job)
+    for job in Job.pending():
+        if job.claim():
+            job.run()
+            jobs.append(job)
+    return jobs
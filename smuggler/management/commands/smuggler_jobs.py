@@ -0,0 +1,18 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+from django.core.management.base import NoArgsCommand
+from smuggler.jobs import run_pending_jobs
+
+
+class Command(NoArgsCommand):
+    help = 'Runs pending smuggler jobs, e.g. dumps started from the admin.'
+
+    def handle_noargs(self, **options):
+        for job in run_pending_jobs():
+            self.stdout.write('%s job %s: %s\n' % (job.kind, job.id,
+                                                   job.status))
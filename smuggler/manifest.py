@@ -0,0 +1,133 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""Manifests that describe the content of a dump.
+
+A manifest is written next to every dump stored by smuggler, as
+``<dump file name>.manifest``. It is a small JSON document with the number
+of objects of each model and the offset of its first object, so a fixture
+can be described, or a model found in it, without reading the whole file.
+Offsets are positions in the uncompressed dump.
+"""
+import json
+import os.path
+import django
+from django.utils.encoding import force_bytes, force_text
+import smuggler
+
+MANIFEST_EXTENSION = 'manifest'
+
+try:
+    from django.apps import apps
+except ImportError:  # before django 1.7
+    apps = None
+
+
+def get_manifest_path(path):
+    return '%s.%s' % (path, MANIFEST_EXTENSION)
+
+
+def read_manifest(path):
+    """Returns the manifest of the fixture at ``path``, or None if it has
+    none or it can't be read.
+    """
+    try:
+        with open(get_manifest_path(path), 'rb') as fp:
+            return json.loads(force_text(fp.read()))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_manifest(path, manifest):
+    manifest_path = get_manifest_path(path)
+    with open('%s.tmp' % manifest_path, 'wb') as fp:
+        fp.write(force_bytes(json.dumps(manifest, indent=2, sort_keys=True)))
+    os.rename('%s.tmp' % manifest_path, manifest_path)
+
+
+def get_app_version(app_label):
+    """Returns the ``__version__`` or ``VERSION`` of an app's package, or
+    None.
+    """
+    if apps is not None:
+        module = apps.get_app_config(app_label).module
+    else:
+        from django.db.models import get_app
+        from django.utils.importlib import import_module
+        module = import_module(get_app(app_label).__name__.rsplit('.', 1)[0])
+    version = getattr(module, '__version__', None) or \
+        getattr(module, 'VERSION', None)
+    if isinstance(version, (tuple, list)):
+        version = '.'.join([str(part) for part in version])
+    return version
+
+
+def get_versions(app_labels):
+    """Returns the versions of Django, smuggler and of the dumped apps that
+    have one.
+    """
+    app_versions = {}
+    for app_label in app_labels:
+        version = get_app_version(app_label)
+        if version is not None:
+            app_versions[app_label] = force_text(version)
+    return {
+        'django': django.get_version(),
+        'smuggler': smuggler.get_version(),
+        'apps': app_versions,
+    }
+
+
+class DumpManifest(object):
+    """Collects the number of objects and the offset of each model while a
+    dump is produced.
+
+    ``position`` is the number of uncompressed bytes of the dump produced so
+    far, it is kept up to date by ``track``.
+    """
+    def __init__(self):
+        self.models = []
+        self.models_by_label = {}
+        self.position = 0
+
+    def get_model(self, label):
+        if label not in self.models_by_label:
+            model = {'model': label, 'count': 0, 'offset': None}
+            self.models.append(model)
+            self.models_by_label[label] = model
+        return self.models_by_label[label]
+
+    def count(self, label, count=1):
+        self.get_model(label)['count'] += count
+
+    def set_offset(self, label, offset):
+        """Records where the first object of a model starts.
+        """
+        model = self.get_model(label)
+        if model['offset'] is None:
+            model['offset'] = offset
+
+    @property
+    def object_count(self):
+        return sum(model['count'] for model in self.models)
+
+    def track(self, chunks):
+        """Yields the uncompressed chunks of a dump and counts their bytes.
+        """
+        for chunk in chunks:
+            yield chunk
+            self.position += len(force_bytes(chunk))
+
+    def as_dict(self, **extra):
+        data = {
+            'models': [model for model in self.models if model['count']],
+            'object_count': self.object_count,
+            'versions': get_versions(sorted(set(
+                model['model'].split('.', 1)[0] for model in self.models))),
+        }
+        data.update(extra)
+        return data
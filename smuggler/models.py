@@ -0,0 +1,13 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+try:
+    from django.apps import AppConfig  # noqa
+except ImportError:  # before django 1.7
+    # The models of installed apps are imported when Django loads them
+    from smuggler.serializers import register_serializers
+    register_serializers()
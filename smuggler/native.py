@@ -0,0 +1,218 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""Copies of plain tables with the database's own bulk protocol.
+
+In smuggler archives the rows of the models listed in
+``SMUGGLER_COPY_MODELS`` are not serialized object by object. They are
+copied with ``COPY ... TO STDOUT`` on PostgreSQL, or selected in batches on
+SQLite, and restored with ``COPY ... FROM STDIN`` or batched INSERTs. Rows
+are copied as they are, without ``save()``, signals or
+``SMUGGLER_ON_CONFLICT``, so only plain tables should be listed.
+
+A smuggler archive (``.smuggler``) is a tar stream that starts with
+``archive.json``. Then come the parts of the dump, in the order of its
+models: ``NNNN.objects.jsonl`` holds the objects of models that are not
+copied, as JSON Lines, and ``NNNN.<model>.json`` describes the table,
+columns, number of rows and database vendor of a copied table whose rows
+follow in ``NNNN.<model>.<engine extension>``.
+"""
+import datetime
+import decimal
+import json
+import tarfile
+import time
+from io import BytesIO
+from itertools import islice
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import force_bytes, force_text
+from smuggler import settings
+from smuggler.serializers.jsonl import iter_lines
+
+ARCHIVE_FORMAT = 'smuggler'
+ARCHIVE_VERSION = 1
+ARCHIVE_CONTENT_TYPE = 'application/x-tar'
+
+
+def get_copy_models(model_list):
+    """Returns the models of ``model_list`` listed in
+    ``SMUGGLER_COPY_MODELS``.
+    """
+    labels = set(label.lower() for label in settings.SMUGGLER_COPY_MODELS)
+    return set(model for model in model_list
+               if not model._meta.proxy and
+               force_text(model._meta) in labels)
+
+
+def get_copy_tables(model):
+    """Returns the model and the models of its auto-created many-to-many
+    tables, whose rows are copied with its own.
+
+    Raises CommandError for models with parents, the rows of their parent
+    tables would not be copied.
+    """
+    if model._meta.parents:
+        raise CommandError('Only plain tables can be copied, %s has parent '
+                           'models.' % force_text(model._meta))
+    models = [model]
+    for field in model._meta.local_many_to_many:
+        through = field.rel.through
+        if through._meta.auto_created:
+            models.append(through)
+    return models
+
+
+def get_columns(model):
+    return [field.column for field in getattr(
+        model._meta, 'local_concrete_fields', model._meta.local_fields)]
+
+
+class PostgresEngine(object):
+    """Copies rows with ``COPY``, in PostgreSQL's text format.
+    """
+    vendor = 'postgresql'
+    extension = 'copy'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get_sql(self, table, columns, direction):
+        quote = self.connection.ops.quote_name
+        return 'COPY %s (%s) %s' % (
+            quote(table), ', '.join(quote(column) for column in columns),
+            direction)
+
+    def dump(self, table, columns, fp):
+        cursor = self.connection.cursor()
+        cursor.copy_expert(self.get_sql(table, columns, 'TO STDOUT'), fp)
+        return cursor.rowcount
+
+    def load(self, table, columns, fp):
+        cursor = self.connection.cursor()
+        cursor.copy_expert(self.get_sql(table, columns, 'FROM STDIN'), fp)
+        return cursor.rowcount
+
+
+class SQLiteEngine(object):
+    """Copies rows as JSON Lines of column values, read and inserted in
+    batches of ``SMUGGLER_CHUNK_SIZE`` rows with ``executemany``.
+
+    Values the database converts when they are read, like dates and
+    decimals, are stored the way the database stores them.
+    """
+    vendor = 'sqlite'
+    extension = 'jsonl'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def to_db(self, value):
+        ops = self.connection.ops
+        if isinstance(value, datetime.datetime):
+            return ops.value_to_db_datetime(value)
+        if isinstance(value, datetime.date):
+            return ops.value_to_db_date(value)
+        if isinstance(value, datetime.time):
+            return ops.value_to_db_time(value)
+        if isinstance(value, decimal.Decimal):
+            return force_text(value)
+        return value
+
+    def dump(self, table, columns, fp):
+        quote = self.connection.ops.quote_name
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT %s FROM %s' % (
+            ', '.join(quote(column) for column in columns), quote(table)))
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(settings.SMUGGLER_CHUNK_SIZE)
+            if not batch:
+                break
+            fp.write(force_bytes(''.join(
+                json.dumps([self.to_db(value) for value in row],
+                           separators=(',', ':')) + '\n' for row in batch)))
+            rows += len(batch)
+        return rows
+
+    def load(self, table, columns, fp):
+        quote = self.connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            quote(table), ', '.join(quote(column) for column in columns),
+            ', '.join(['%s'] * len(columns)))
+        cursor = self.connection.cursor()
+        lines = iter_lines(fp)
+        rows = 0
+        while True:
+            batch = list(islice(lines, settings.SMUGGLER_CHUNK_SIZE))
+            if not batch:
+                break
+            cursor.executemany(sql, batch)
+            rows += len(batch)
+        return rows
+
+
+ENGINES = {
+    'postgresql': PostgresEngine,
+    'sqlite': SQLiteEngine,
+}
+
+
+def get_engine(connection):
+    """Returns the engine that copies rows of a database connection.
+
+    Raises CommandError for databases smuggler can't copy rows of.
+    """
+    if connection.vendor not in ENGINES:
+        raise CommandError('Tables can not be copied on %s databases.' %
+                           connection.vendor)
+    return ENGINES[connection.vendor](connection)
+
+
+class ChunkWriter(object):
+    """A file object that keeps what is written to it until it is taken.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+
+class ArchiveWriter(object):
+    """Writes a smuggler archive to a ChunkWriter, ``output``.
+    """
+    def __init__(self):
+        self.output = ChunkWriter()
+        self.tar = tarfile.open(mode='w|', fileobj=self.output)
+        self.add_json('archive.json', {'version': ARCHIVE_VERSION})
+
+    def add(self, name, fp, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = time.time()
+        self.tar.addfile(info, fp)
+
+    def add_json(self, name, data):
+        data = force_bytes(json.dumps(data, cls=DjangoJSONEncoder))
+        self.add(name, BytesIO(data), len(data))
+
+    def close(self):
+        self.tar.close()
+
+
+def check_archive(data):
+    """Raises CommandError if ``data``, read from ``archive.json``, describes
+    an archive of a later version.
+    """
+    if data.get('version', 0) > ARCHIVE_VERSION:
+        raise CommandError('Smuggler archives of version %s are not '
+                           'supported.' % data['version'])
@@ -0,0 +1,110 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""
+Serializers that read and write fixtures incrementally.
+"""
+from __future__ import absolute_import
+from django.conf import settings
+from django.core import serializers
+
+try:
+    from msgpack import version as msgpack_version
+except ImportError:  # msgpack is optional
+    msgpack_version = None
+
+# Serialization formats smuggler adds to Django's
+SERIALIZATION_MODULES = {
+    'columnar': 'smuggler.serializers.columnar',
+    'jsonl': 'smuggler.serializers.jsonl',
+}
+if msgpack_version is not None:
+    SERIALIZATION_MODULES['msgpack'] = 'smuggler.serializers.msgpack'
+
+# Formats for which smuggler ships a streaming deserializer that is used
+# instead of Django's when loading fixtures.
+STREAMING_DESERIALIZERS = {
+    'json': 'smuggler.serializers.json',
+}
+
+
+# Formats of which smuggler can read the raw data of each object, which is
+# used to find the models in a fixture without deserializing it.
+OBJECT_READERS = {
+    'columnar': 'smuggler.serializers.columnar',
+    'json': 'smuggler.serializers.json',
+    'jsonl': 'smuggler.serializers.jsonl',
+}
+if msgpack_version is not None:
+    OBJECT_READERS['msgpack'] = 'smuggler.serializers.msgpack'
+
+
+def get_object_reader(format):
+    """Returns a function that yields the raw data of the objects in a
+    fixture stream of a format, or None if smuggler can't read the format
+    that way.
+    """
+    if format not in OBJECT_READERS:
+        return None
+    module = __import__(OBJECT_READERS[format], {}, {}, ['read_objects'])
+    return module.read_objects
+
+
+def get_seeking_reader(format):
+    """Returns a function that yields the raw data of the objects in a
+    fixture stream of a format from the current position of the stream,
+    which must be the start of an object, or None.
+    """
+    if format not in OBJECT_READERS:
+        return None
+    module = __import__(OBJECT_READERS[format], {}, {},
+                        ['read_objects_from'])
+    return module.read_objects_from
+
+
+def filter_objects(objects, model_filter=None, before_object=None):
+    """Yields the raw data of the objects whose model label is accepted by
+    ``model_filter``, or of all objects without a filter.
+
+    ``before_object`` is called with the data of each of them right before
+    it is yielded, that is before the object is deserialized.
+    """
+    if model_filter is not None:
+        # Invalid objects are kept, for the deserializer to report them
+        objects = (data for data in objects if not isinstance(data, dict) or
+                   model_filter(data.get('model')))
+    if before_object is not None:
+        objects = announce_objects(objects, before_object)
+    return objects
+
+
+def announce_objects(objects, before_object):
+    for data in objects:
+        if isinstance(data, dict):
+            before_object(data)
+        yield data
+
+
+def get_deserializer(format):
+    """Returns the deserializer smuggler uses to load fixtures of a format.
+    """
+    if format in STREAMING_DESERIALIZERS:
+        module = __import__(STREAMING_DESERIALIZERS[format], {}, {},
+                            ['Deserializer'])
+        return module.Deserializer
+    return serializers.get_deserializer(format)
+
+
+def register_serializers():
+    """Registers smuggler's serialization formats with Django, unless the
+    project's SERIALIZATION_MODULES setting already defines them. Called
+    when the smuggler app is loaded.
+    """
+    project_modules = getattr(settings, 'SERIALIZATION_MODULES', None) or {}
+    for format, module in SERIALIZATION_MODULES.items():
+        if format not in project_modules:
+            serializers.register_serializer(format, module)
@@ -0,0 +1,318 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""
+Serialize data to/from a compact, column oriented binary format.
+
+A columnar fixture starts with ``MAGIC``, followed by blocks of objects of
+a single model. Each block is a little-endian 4 byte length, a JSON header
+with the model, the number of rows and the encoding and size of each
+column, then the columns one after the other: the primary keys, then one
+column per field. Columns are encoded by the type of their values:
+
+* ``int``, ``float`` and ``bool`` columns are packed arrays, decoded with a
+  single ``struct.unpack``;
+* ``dict`` columns hold strings that repeat, as a JSON list of the distinct
+  strings followed by packed indexes into it;
+* ``text`` columns hold other strings, as packed lengths followed by the
+  UTF-8 text;
+* ``json`` columns hold anything else, like many-to-many keys, as a JSON
+  list.
+
+Columns with null values start with one byte per row that is 1 for nulls.
+Dates, times and decimals are stored as the strings Django's JSON
+serializer writes. Blocks of models that are not loaded are skipped
+without decoding their columns.
+"""
+from __future__ import absolute_import
+import json
+import struct
+import sys
+from itertools import groupby
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer as PythonSerializer
+from django.core.serializers.python import (
+    Deserializer as PythonDeserializer)
+from django.utils import six
+from django.utils.encoding import force_bytes
+from smuggler.serializers import filter_objects
+
+MAGIC = b'SMUGCOL1'
+
+# Number of objects per block of the Django serializer
+BLOCK_SIZE = 1000
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+_encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def normalize(value):
+    """Returns a value as None, a bool, an int, a float, a string or the
+    JSON data Django's JSON serializer would write for it.
+    """
+    if value is None or isinstance(value, (bool, float, list, tuple, dict) +
+                                   six.integer_types + six.string_types):
+        return value
+    return _encoder.default(value)
+
+
+def get_encoding(values):
+    """Returns the encoding of a column of values that are not None.
+    """
+    if not values:
+        return 'null'
+    if all(isinstance(value, bool) for value in values):
+        return 'bool'
+    if all(isinstance(value, six.integer_types) and
+           not isinstance(value, bool) and INT_MIN <= value <= INT_MAX
+           for value in values):
+        return 'int'
+    if all(isinstance(value, float) for value in values):
+        return 'float'
+    if all(isinstance(value, six.string_types) for value in values):
+        if len(set(values)) * 2 <= len(values):
+            return 'dict'
+        return 'text'
+    return 'json'
+
+
+def get_index_format(size):
+    if size <= 0xff:
+        return 'B'
+    if size <= 0xffff:
+        return 'H'
+    return 'I'
+
+
+def encode_column(name, values):
+    """Returns the header and the bytes of a column.
+    """
+    present = [value for value in values if value is not None]
+    encoding = get_encoding(present)
+    column = {'name': name, 'encoding': encoding}
+    output = []
+    if encoding != 'null' and len(present) < len(values):
+        column['nulls'] = True
+        output.append(bytes(bytearray(value is None for value in values)))
+    if encoding == 'bool':
+        output.append(bytes(bytearray(bool(value) for value in values)))
+    elif encoding == 'int':
+        output.append(struct.pack('<%dq' % len(values),
+                                  *[value or 0 for value in values]))
+    elif encoding == 'float':
+        output.append(struct.pack('<%dd' % len(values),
+                                  *[value or 0.0 for value in values]))
+    elif encoding == 'dict':
+        strings = sorted(set(present))
+        indexes = dict((string, index)
+                       for index, string in enumerate(strings))
+        strings = force_bytes(json.dumps(strings, separators=(',', ':')))
+        column['index'] = get_index_format(len(indexes))
+        output.append(struct.pack('<I', len(strings)))
+        output.append(strings)
+        output.append(struct.pack(
+            '<%d%s' % (len(values), column['index']),
+            *[indexes.get(value, 0) for value in values]))
+    elif encoding == 'text':
+        strings = [force_bytes(value or '') for value in values]
+        output.append(struct.pack('<%dI' % len(values),
+                                  *[len(string) for string in strings]))
+        output.extend(strings)
+    elif encoding == 'json':
+        output.append(force_bytes(_encoder.encode(values)))
+    data = b''.join(output)
+    column['size'] = len(data)
+    return column, data
+
+
+def dump_block(model, objects):
+    """Encodes the serialized data of objects of a model as a block.
+    """
+    names = list(objects[0]['fields'])
+    columns = [encode_column('pk', [normalize(data.get('pk'))
+                                    for data in objects])]
+    for name in names:
+        columns.append(encode_column(name, [
+            normalize(data['fields'].get(name)) for data in objects]))
+    header = force_bytes(json.dumps({
+        'model': model,
+        'rows': len(objects),
+        'columns': [column for column, data in columns],
+    }, separators=(',', ':')))
+    return b''.join([struct.pack('<I', len(header)), header] +
+                    [data for column, data in columns])
+
+
+def dump_blocks(objects):
+    """Yields the model label and the block of each run of serialized
+    objects of the same model.
+    """
+    for model, group in groupby(objects, lambda data: data['model']):
+        yield model, dump_block(model, list(group))
+
+
+def decode_column(column, data, rows):
+    """Returns the values of a column.
+    """
+    encoding = column['encoding']
+    if encoding == 'null':
+        return [None] * rows
+    nulls = None
+    if column.get('nulls'):
+        nulls, data = bytearray(data[:rows]), data[rows:]
+    if encoding == 'bool':
+        values = [bool(value) for value in bytearray(data)]
+    elif encoding == 'int':
+        values = list(struct.unpack('<%dq' % rows, data))
+    elif encoding == 'float':
+        values = list(struct.unpack('<%dd' % rows, data))
+    elif encoding == 'dict':
+        size = struct.unpack('<I', data[:4])[0]
+        strings = json.loads(data[4:4 + size].decode('utf-8'))
+        values = [strings[index] for index in struct.unpack(
+            '<%d%s' % (rows, column['index']), data[4 + size:])]
+    elif encoding == 'text':
+        lengths = struct.unpack('<%dI' % rows, data[:4 * rows])
+        values = []
+        position = 4 * rows
+        for length in lengths:
+            values.append(data[position:position + length].decode('utf-8'))
+            position += length
+    elif encoding == 'json':
+        values = json.loads(data.decode('utf-8'))
+    else:
+        raise ValueError('Unknown column encoding: %s' % encoding)
+    if nulls:
+        values = [None if null else value
+                  for null, value in zip(nulls, values)]
+    return values
+
+
+def decode_block(header, data):
+    """Yields the serialized data of the objects of a block.
+    """
+    rows = header['rows']
+    columns = []
+    position = 0
+    for column in header['columns']:
+        columns.append(decode_column(
+            column, data[position:position + column['size']], rows))
+        position += column['size']
+    names = [column['name'] for column in header['columns'][1:]]
+    for values in zip(*columns):
+        yield {
+            'model': header['model'],
+            'pk': values[0],
+            'fields': dict(zip(names, values[1:])),
+        }
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Unexpected end of columnar data')
+    return data
+
+
+def read_blocks(stream, model_filter=None):
+    """Yields the header and the column data of the blocks of a stream, from
+    its current position. With a ``model_filter`` the blocks of models it
+    rejects are skipped.
+    """
+    while True:
+        prefix = stream.read(4)
+        if not prefix:
+            break
+        if len(prefix) != 4:
+            raise ValueError('Unexpected end of columnar data')
+        size = struct.unpack('<I', prefix)[0]
+        header = json.loads(read_exactly(stream, size).decode('utf-8'))
+        data = read_exactly(stream, sum(column['size']
+                                        for column in header['columns']))
+        if model_filter is None or model_filter(header['model']):
+            yield header, data
+
+
+def read_objects_from(stream, model_filter=None):
+    """Yields the serialized data of the objects of a columnar stream from
+    its current position, which must be the start of a block.
+    """
+    for header, data in read_blocks(stream, model_filter):
+        for obj in decode_block(header, data):
+            yield obj
+
+
+def read_objects(stream, model_filter=None):
+    """Yields the serialized data of the objects of a columnar stream.
+    """
+    if read_exactly(stream, len(MAGIC)) != MAGIC:
+        raise ValueError('Not a columnar fixture')
+    for obj in read_objects_from(stream, model_filter):
+        yield obj
+
+
+class Serializer(PythonSerializer):
+    """
+    Convert a queryset to columnar blocks of at most BLOCK_SIZE objects.
+    """
+    internal_use_only = False
+
+    def serialize(self, queryset, **options):
+        options.setdefault('stream', six.BytesIO())
+        return super(Serializer, self).serialize(queryset, **options)
+
+    def start_serialization(self):
+        super(Serializer, self).start_serialization()
+        self.stream.write(MAGIC)
+
+    def end_object(self, obj):
+        super(Serializer, self).end_object(obj)
+        if self.objects[0]['model'] != self.objects[-1]['model']:
+            self.write_blocks(self.objects[:-1])
+            self.objects = self.objects[-1:]
+        elif len(self.objects) >= BLOCK_SIZE:
+            self.write_blocks(self.objects)
+            self.objects = []
+
+    def end_serialization(self):
+        self.write_blocks(self.objects)
+        self.objects = []
+
+    def write_blocks(self, objects):
+        for model, block in dump_blocks(objects):
+            self.stream.write(block)
+
+    def getvalue(self):
+        # Grand-parent super
+        return super(PythonSerializer, self).getvalue()
+
+
+def Deserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of columnar data one block at a time.
+
+    With the ``model_filter`` option, blocks of models the filter rejects
+    are skipped before they are decoded. The ``before_object`` option is
+    called with the raw data of each object before it is deserialized.
+    """
+    if isinstance(stream_or_string, six.binary_type):
+        stream_or_string = six.BytesIO(stream_or_string)
+    objects = filter_objects(
+        read_objects(stream_or_string, options.pop('model_filter', None)),
+        before_object=options.pop('before_object', None))
+    try:
+        for obj in PythonDeserializer(objects, **options):
+            yield obj
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        # Map to deserializer error
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
@@ -0,0 +1,196 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""
+JSON serializer with a deserializer that reads the fixture incrementally.
+
+Django's JSON deserializer parses the whole fixture before the first object
+is returned. This one decodes the objects of the fixture one at a time, so
+memory use depends on the size of the objects, not of the fixture. The
+module can be used in ``SERIALIZATION_MODULES`` to replace Django's.
+"""
+from __future__ import absolute_import
+import codecs
+import json
+import re
+import sys
+from json.scanner import py_make_scanner
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import Serializer  # noqa
+from django.core.serializers.python import (
+    Deserializer as PythonDeserializer)
+from django.utils import six
+from smuggler.serializers import filter_objects
+
+# Number of bytes read from the fixture at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+# Errors closer than this to the end of the buffer may be caused by a value
+# cut off by the end of the chunk, like ``-Infinity`` or a ``\uXXXX``
+# escape, and are retried with more data.
+INCOMPLETE_MARGIN = len('-Infinity')
+
+# Errors of strings cut off by the end of the chunk; Python 2 reports the
+# second when the chunk ends with the opening quote.
+INCOMPLETE_ERRORS = ('Unterminated string', 'end is out of bounds')
+
+ERROR_POSITION_RE = re.compile(r'\(char (\d+)')
+
+# A character that can't be part of a number
+NOT_NUMBER_RE = re.compile(r'[^0-9.eE+-]')
+
+
+class JSONArrayReader(object):
+    """Iterates over the elements of a JSON array read from a stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Reads the next chunk of the stream into the buffer.
+
+        Returns False when the end of the stream was reached.
+        """
+        if self.eof:
+            return False
+        data = self.stream.read(READ_CHUNK_SIZE)
+        if not data:
+            self.eof = True
+        if isinstance(data, six.binary_type):
+            data = self.text_decoder.decode(data, final=self.eof)
+        # Drop the part of the buffer that has already been decoded
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """Skips whitespace and returns the next character, or None at the
+        end of the stream.
+        """
+        while True:
+            while (self.pos < len(self.buffer) and
+                   self.buffer[self.pos] in WHITESPACE):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def decode(self):
+        """Decodes the JSON value at the current position.
+        """
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as e:
+                if self.is_incomplete(e) and self.fill():
+                    continue
+                raise
+            # A number may be cut off by the end of the buffer, make sure
+            # something else follows the value.
+            if NOT_NUMBER_RE.search(self.buffer, end) or not self.fill():
+                self.pos = end
+                return value
+
+    def get_error_position(self, error):
+        """Returns the position in the buffer of a decoding error.
+        """
+        position = getattr(error, 'pos', None)
+        if position is not None:
+            return position
+        # Python 2 only gives the position in the message, and not at all
+        # when a nested value is missing, which its pure Python scanner
+        # reports.
+        match = ERROR_POSITION_RE.search(str(error))
+        if match is None:
+            decoder = json.JSONDecoder()
+            decoder.scan_once = py_make_scanner(decoder)
+            try:
+                decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as e:
+                match = ERROR_POSITION_RE.search(str(e))
+        return int(match.group(1)) if match else self.pos
+
+    def is_incomplete(self, error):
+        """Returns True if a decoding error may be caused by the end of the
+        buffer rather than by invalid JSON.
+        """
+        if str(error).startswith(INCOMPLETE_ERRORS):
+            return True
+        return (self.get_error_position(error) >=
+                len(self.buffer) - INCOMPLETE_MARGIN)
+
+    def __iter__(self):
+        if self.next_char() != '[':
+            self.decode()  # Raises the decoder's error for invalid JSON
+            raise ValueError('Expected a JSON array of objects')
+        self.pos += 1
+        if self.next_char() == ']':
+            return
+        for value in self.iter_elements():
+            yield value
+
+    def iter_elements(self):
+        """Iterates over the elements of the array from the current position,
+        which must be the start of an element.
+        """
+        while True:
+            yield self.decode()
+            char = self.next_char()
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(
+                    "Expecting ',' delimiter or ']' at char %d of the "
+                    "current chunk" % self.pos)
+            self.pos += 1
+
+
+def read_objects(stream):
+    """Yields the raw data of the objects in a JSON fixture.
+    """
+    return iter(JSONArrayReader(stream))
+
+
+def read_objects_from(stream):
+    """Yields the raw data of the objects in a JSON fixture from the current
+    position of the stream, the start of an object, to the end of the array.
+    """
+    return JSONArrayReader(stream).iter_elements()
+
+
+def Deserializer(stream_or_string, **options):
+    """Deserialize a stream or string of JSON data one object at a time.
+
+    With the ``model_filter`` option, objects whose model label the filter
+    rejects are skipped before they are deserialized. The ``before_object``
+    option is called with the raw data of the others first.
+    """
+    if isinstance(stream_or_string, six.binary_type):
+        stream_or_string = six.BytesIO(stream_or_string)
+    elif isinstance(stream_or_string, six.text_type):
+        stream_or_string = six.StringIO(stream_or_string)
+    objects = filter_objects(JSONArrayReader(stream_or_string),
+                             options.pop('model_filter', None),
+                             options.pop('before_object', None))
+    try:
+        for obj in PythonDeserializer(objects, **options):
+            yield obj
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        # Map to deserializer error
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
@@ -0,0 +1,90 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""
+Serialize data to/from JSON Lines, one JSON object per line.
+
+Unlike a JSON array a JSON Lines fixture can be written, read, split and
+concatenated one object at a time.
+"""
+from __future__ import absolute_import
+import json
+import sys
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer as PythonSerializer
+from django.core.serializers.python import (
+    Deserializer as PythonDeserializer)
+from django.utils import six
+from smuggler.serializers import filter_objects
+
+
+def dumps(data):
+    """Encodes serialized object data as a single line of JSON.
+    """
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+class Serializer(PythonSerializer):
+    """
+    Convert a queryset to JSON Lines.
+    """
+    internal_use_only = False
+
+    def end_object(self, obj):
+        # Let the python serializer build the object's data and write it to
+        # the stream right away.
+        super(Serializer, self).end_object(obj)
+        self.stream.write(dumps(self.objects.pop()))
+        self.stream.write('\n')
+
+    def getvalue(self):
+        # Grand-parent super
+        return super(PythonSerializer, self).getvalue()
+
+
+def iter_lines(stream):
+    """Yields the decoded objects of a JSON Lines stream, skipping blank
+    lines.
+    """
+    for line in stream:
+        if isinstance(line, six.binary_type):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# The raw data of the objects in a JSON Lines fixture, from the start or
+# from the current position of the stream
+read_objects = read_objects_from = iter_lines
+
+
+def Deserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of JSON Lines data one line at a time.
+
+    With the ``model_filter`` option, objects whose model label the filter
+    rejects are skipped before they are deserialized. The ``before_object``
+    option is called with the raw data of the others first.
+    """
+    if isinstance(stream_or_string, six.binary_type):
+        stream_or_string = six.BytesIO(stream_or_string)
+    elif isinstance(stream_or_string, six.text_type):
+        stream_or_string = six.StringIO(stream_or_string)
+    objects = filter_objects(iter_lines(stream_or_string),
+                             options.pop('model_filter', None),
+                             options.pop('before_object', None))
+    try:
+        for obj in PythonDeserializer(objects, **options):
+            yield obj
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        # Map to deserializer error
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
@@ -0,0 +1,112 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""
+Serialize data to/from MessagePack, one packed object after the other.
+
+Requires the `msgpack <https://pypi.python.org/pypi/msgpack>`_ package.
+Like JSON Lines a MessagePack fixture can be written, read, split and
+concatenated one object at a time, but it is binary: it is smaller and
+faster to encode and decode than JSON. Dates, times and decimals are
+stored as the strings Django's JSON serializer writes.
+"""
+from __future__ import absolute_import
+import sys
+import msgpack
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer as PythonSerializer
+from django.core.serializers.python import (
+    Deserializer as PythonDeserializer)
+from django.utils import six
+from smuggler.serializers import filter_objects
+
+_encoder = DjangoJSONEncoder()
+
+
+def dumps(data):
+    """Packs serialized object data.
+    """
+    return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+class Serializer(PythonSerializer):
+    """
+    Convert a queryset to MessagePack.
+    """
+    internal_use_only = False
+
+    def serialize(self, queryset, **options):
+        options.setdefault('stream', six.BytesIO())
+        return super(Serializer, self).serialize(queryset, **options)
+
+    def end_object(self, obj):
+        # Let the python serializer build the object's data and write it to
+        # the stream right away.
+        super(Serializer, self).end_object(obj)
+        self.stream.write(dumps(self.objects.pop()))
+
+    def getvalue(self):
+        # Grand-parent super
+        return super(PythonSerializer, self).getvalue()
+
+
+class CountingReader(object):
+    """Reads a stream and counts the bytes read.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def iter_unpacked(stream):
+    """Yields the unpacked objects of a MessagePack stream, from its current
+    position. Raises ValueError if the stream ends within an object.
+    """
+    reader = CountingReader(stream)
+    unpacker = msgpack.Unpacker(reader, raw=False)
+    position = 0
+    for data in unpacker:
+        # Only known to be the end of an object right after unpacking one
+        position = unpacker.tell()
+        yield data
+    if position != reader.count:
+        raise ValueError('Unexpected end of MessagePack data')
+
+
+# The raw data of the objects in a MessagePack fixture, from the start or
+# from the current position of the stream
+read_objects = read_objects_from = iter_unpacked
+
+
+def Deserializer(stream_or_string, **options):
+    """
+    Deserialize a stream or string of MessagePack data one object at a time.
+
+    With the ``model_filter`` option, objects whose model label the filter
+    rejects are skipped before they are deserialized. The ``before_object``
+    option is called with the raw data of the others first.
+    """
+    if isinstance(stream_or_string, six.binary_type):
+        stream_or_string = six.BytesIO(stream_or_string)
+    objects = filter_objects(iter_unpacked(stream_or_string),
+                             options.pop('model_filter', None),
+                             options.pop('before_object', None))
+    try:
+        for obj in PythonDeserializer(objects, **options):
+            yield obj
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        # Map to deserializer error
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
@@ -8,7 +8,29 @@
 
 from django.conf import settings
 
+SMUGGLER_BACKGROUND_DUMPS = getattr(settings, 'SMUGGLER_BACKGROUND_DUMPS',
+                                    False)
+SMUGGLER_BACKGROUND_LOADS = getattr(settings, 'SMUGGLER_BACKGROUND_LOADS',
+                                    False)
+SMUGGLER_BULK_LOAD = getattr(settings, 'SMUGGLER_BULK_LOAD', False)
+SMUGGLER_COMPRESSION = getattr(settings, 'SMUGGLER_COMPRESSION', None)
+SMUGGLER_COMPRESSION_LEVEL = getattr(settings, 'SMUGGLER_COMPRESSION_LEVEL',
+                                     None)
+SMUGGLER_COPY_MODELS = getattr(settings, 'SMUGGLER_COPY_MODELS', [])
+SMUGGLER_DELTA_FIELDS = getattr(settings, 'SMUGGLER_DELTA_FIELDS', {})
+SMUGGLER_DRY_RUN_MAX_ERRORS = getattr(settings, 'SMUGGLER_DRY_RUN_MAX_ERRORS',
+                                      20)
+SMUGGLER_DUMP_DATABASE = getattr(settings, 'SMUGGLER_DUMP_DATABASE', None)
+SMUGGLER_DUMP_WORKERS = getattr(settings, 'SMUGGLER_DUMP_WORKERS', 1)
 SMUGGLER_EXCLUDE_LIST = getattr(settings, 'SMUGGLER_EXCLUDE_LIST', [])
 SMUGGLER_FIXTURE_DIR = getattr(settings, 'SMUGGLER_FIXTURE_DIR', None)
 SMUGGLER_FORMAT = getattr(settings, 'SMUGGLER_FORMAT', 'json')
-SMUGGLER_INDENT = getattr(settings, 'SMUGGLER_INDENT', 2)
+SMUGGLER_INDENT = getattr(settings, 'SMUGGLER_INDENT', None)
+SMUGGLER_JOB_RUNNER = getattr(settings, 'SMUGGLER_JOB_RUNNER', 'thread')
+SMUGGLER_JOB_WORKERS = getattr(settings, 'SMUGGLER_JOB_WORKERS', 1)
+SMUGGLER_LOAD_WORKERS = getattr(settings, 'SMUGGLER_LOAD_WORKERS', 1)
+SMUGGLER_RESUMABLE_LOAD = getattr(settings, 'SMUGGLER_RESUMABLE_LOAD', False)
+SMUGGLER_UPLOAD_PART_SIZE = getattr(settings, 'SMUGGLER_UPLOAD_PART_SIZE',
+                                    8 * 1024 * 1024)
+SMUGGLER_CHUNK_SIZE = getattr(settings, 'SMUGGLER_CHUNK_SIZE', 1000)
+SMUGGLER_ON_CONFLICT = getattr(settings, 'SMUGGLER_ON_CONFLICT', 'update')
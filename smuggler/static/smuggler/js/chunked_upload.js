@@ -0,0 +1,169 @@
+/*
+ * Uploads the fixtures selected on the load form in parts before the form
+ * is submitted, so large fixtures don't have to fit in a single request.
+ *
+ * Each part is sent with its SHA-1 and sent again when it fails. When the
+ * connection drops, the upload resumes from the last part the server
+ * received. Browsers without the File and Web Crypto APIs submit the form
+ * as a regular multipart upload.
+ */
+(function() {
+    'use strict';
+
+    var MAX_RETRIES = 5;
+    var RETRY_DELAY = 2000;
+
+    function getCookie(name) {
+        var cookies = document.cookie ? document.cookie.split(';') : [];
+        for (var i = 0; i < cookies.length; i++) {
+            var cookie = cookies[i].replace(/^\s+/, '');
+            if (cookie.substring(0, name.length + 1) === name + '=') {
+                return decodeURIComponent(cookie.substring(name.length + 1));
+            }
+        }
+        return null;
+    }
+
+    function request(method, url, body, csrfToken) {
+        return new Promise(function(resolve, reject) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(method, url);
+            xhr.setRequestHeader('X-CSRFToken', csrfToken);
+            xhr.onload = function() {
+                var data = {};
+                try {
+                    data = JSON.parse(xhr.responseText);
+                } catch (e) {}
+                resolve({status: xhr.status, data: data});
+            };
+            xhr.onerror = function() {
+                reject(new Error('Network error'));
+            };
+            xhr.send(body);
+        });
+    }
+
+    function sha1(blob) {
+        return new Promise(function(resolve, reject) {
+            var reader = new FileReader();
+            reader.onload = function() {
+                resolve(reader.result);
+            };
+            reader.onerror = reject;
+            reader.readAsArrayBuffer(blob);
+        }).then(function(buffer) {
+            return window.crypto.subtle.digest('SHA-1', buffer);
+        }).then(function(digest) {
+            var bytes = new Uint8Array(digest), hex = '';
+            for (var i = 0; i < bytes.length; i++) {
+                hex += ('0' + bytes[i].toString(16)).slice(-2);
+            }
+            return hex;
+        });
+    }
+
+    function delay(milliseconds) {
+        return new Promise(function(resolve) {
+            setTimeout(resolve, milliseconds);
+        });
+    }
+
+    function sendParts(file, upload, csrfToken, onProgress) {
+        var retries = 0;
+
+        function next(state) {
+            onProgress(state.offset, state.size);
+            if (state.complete) {
+                return state;
+            }
+            var part = file.slice(state.offset, state.offset + state.part_size);
+            return sha1(part).then(function(checksum) {
+                var url = upload.url + '?offset=' + state.offset +
+                    '&sha1=' + checksum;
+                return request('POST', url, part, csrfToken);
+            }).then(function(response) {
+                if (response.status === 200 || response.status === 409) {
+                    // 409 means the server has another offset, resume there
+                    retries = 0;
+                    return response.data;
+                }
+                throw new Error(response.data.error || response.status);
+            }).then(next, function(error) {
+                if (++retries > MAX_RETRIES) {
+                    throw error;
+                }
+                return delay(RETRY_DELAY).then(function() {
+                    return request('GET', upload.url, null, csrfToken);
+                }).then(function(response) {
+                    return next(response.data.url ? response.data : state);
+                });
+            });
+        }
+
+        return next(upload);
+    }
+
+    function uploadFile(file, input, csrfToken, onProgress) {
+        var data = new FormData();
+        data.append('filename', file.name);
+        data.append('size', file.size);
+        return request('POST', input.getAttribute('data-url'), data,
+                       csrfToken).then(function(response) {
+            if (response.status !== 201) {
+                throw new Error(response.data.error || response.status);
+            }
+            return sendParts(file, response.data, csrfToken, onProgress);
+        });
+    }
+
+    function init() {
+        var input = document.querySelector('input[name="chunked_uploads"]');
+        if (!input || !window.Promise || !window.FileReader ||
+                !window.FormData || !(window.crypto && window.crypto.subtle)) {
+            return;
+        }
+        var form = input.form;
+        var fileInput = form.elements.uploads;
+        var status = document.createElement('p');
+        status.className = 'help';
+        fileInput.parentNode.appendChild(status);
+
+        form.addEventListener('submit', function(event) {
+            var files = Array.prototype.slice.call(fileInput.files);
+            if (!files.length) {
+                return;
+            }
+            event.preventDefault();
+            var csrfToken = form.elements.csrfmiddlewaretoken ?
+                form.elements.csrfmiddlewaretoken.value :
+                getCookie('csrftoken');
+            var ids = [];
+            var done = files.reduce(function(previous, file) {
+                return previous.then(function() {
+                    return uploadFile(file, input, csrfToken,
+                                      function(offset, size) {
+                        var percent = size ? Math.floor(100 * offset / size) :
+                            100;
+                        status.textContent = file.name + ': ' + percent + '%';
+                    });
+                }).then(function(upload) {
+                    ids.push(upload.id);
+                });
+            }, Promise.resolve());
+            done.then(function() {
+                input.value = ids.join(',');
+                // The files were uploaded already, don't send them again
+                fileInput.disabled = true;
+                form.submit();
+            }, function(error) {
+                status.textContent = 'Upload failed: ' + error.message;
+            });
+        });
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', init);
+    } else {
+        init();
+    }
+})();
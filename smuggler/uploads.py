@@ -0,0 +1,169 @@
+# Copyright (c) 2009 Guilherme Gondim and contributors
+#
+# This file is part of Django Smuggler.
+#
+# Django Smuggler is free software under terms of the GNU Lesser
+# General Public License version 3 (LGPLv3) as published by the Free
+# Software Foundation. See the file README for copying conditions.
+"""Chunked uploads of large fixtures.
+
+An upload is started with the name and size of a fixture, then its parts of
+``SMUGGLER_UPLOAD_PART_SIZE`` bytes are sent one after another, each with
+its SHA-1. Parts are appended to a staging file below
+``SMUGGLER_FIXTURE_DIR`` and a part that fails is sent again, so uploads
+survive dropped connections and no request has to carry the whole fixture.
+"""
+import errno
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.utils.encoding import force_bytes, force_text
+from smuggler import settings
+from smuggler.compression import READ_CHUNK_SIZE
+from smuggler.utils import get_fixture_formats, parse_fixture_name
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def get_upload_dir():
+    if not settings.SMUGGLER_FIXTURE_DIR:
+        raise ImproperlyConfigured(
+            'Chunked uploads require SMUGGLER_FIXTURE_DIR to be set.')
+    return os.path.join(settings.SMUGGLER_FIXTURE_DIR, '.smuggler_uploads')
+
+
+class Upload(object):
+    """A chunked upload and its state.
+
+    ``offset`` is the number of bytes received so far, the upload is
+    complete when it reaches ``size``.
+    """
+    class DoesNotExist(ObjectDoesNotExist):
+        pass
+
+    fields = ('id', 'filename', 'size', 'offset', 'created')
+
+    def __init__(self, filename, size, id=None, offset=0, created=None):
+        self.id = id or uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.offset = offset
+        self.created = created or time.time()
+
+    @staticmethod
+    def get_path(upload_id, extension='json'):
+        return os.path.join(get_upload_dir(), '%s.%s' % (upload_id, extension))
+
+    @property
+    def path(self):
+        """Path of the uploaded fixture once the upload is complete.
+        """
+        return os.path.join(self.get_path(self.id, 'files'), self.filename)
+
+    @property
+    def part_path(self):
+        return '%s.part' % self.path
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+    def as_dict(self):
+        data = dict((field, getattr(self, field)) for field in self.fields)
+        data.update({
+            'complete': self.is_complete,
+            'part_size': settings.SMUGGLER_UPLOAD_PART_SIZE,
+        })
+        return data
+
+    @classmethod
+    def create(cls, filename, size):
+        """Starts the upload of a fixture of ``size`` bytes.
+
+        Raises ValueError for invalid file names and sizes.
+        """
+        filename = os.path.basename(filename or '')
+        if parse_fixture_name(filename)[0] not in get_fixture_formats():
+            raise ValueError('Invalid file name: %s' % filename)
+        if size < 0:
+            raise ValueError('Invalid size: %d' % size)
+        upload = cls(filename, size)
+        os.makedirs(upload.get_path(upload.id, 'files'))
+        open(upload.part_path, 'wb').close()
+        if upload.is_complete:  # An empty file
+            os.rename(upload.part_path, upload.path)
+        upload.save()
+        return upload
+
+    @classmethod
+    def get(cls, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise cls.DoesNotExist('Invalid upload id: %s' % upload_id)
+        try:
+            with open(cls.get_path(upload_id), 'rb') as fp:
+                data = json.loads(force_text(fp.read()))
+        except (IOError, OSError):
+            raise cls.DoesNotExist('Upload not found: %s' % upload_id)
+        return cls(**dict((str(key), value) for key, value in data.items()))
+
+    def save(self):
+        upload_dir = get_upload_dir()
+        if not os.path.isdir(upload_dir):
+            try:
+                os.makedirs(upload_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        data = dict((field, getattr(self, field)) for field in self.fields)
+        tmp_path = self.get_path(self.id, 'json.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(force_bytes(json.dumps(data)))
+        os.rename(tmp_path, self.get_path(self.id))
+
+    def append(self, stream, length, checksum):
+        """Appends a part of ``length`` bytes read from ``stream``.
+
+        Every part but the last must be ``SMUGGLER_UPLOAD_PART_SIZE`` bytes
+        long. Raises ValueError, and discards the part, when its size is
+        wrong or its SHA-1 is not ``checksum``.
+        """
+        if self.is_complete:
+            raise ValueError('Upload is complete.')
+        part_size = settings.SMUGGLER_UPLOAD_PART_SIZE
+        if length > part_size or self.offset + length > self.size or (
+                length < part_size and self.offset + length < self.size):
+            raise ValueError('Invalid part size: %d' % length)
+        sha1 = hashlib.sha1()
+        received = 0
+        with open(self.part_path, 'r+b') as fp:
+            fp.seek(self.offset)
+            while received < length:
+                data = stream.read(min(READ_CHUNK_SIZE, length - received))
+                if not data:
+                    break
+                fp.write(data)
+                sha1.update(data)
+                received += len(data)
+            if received != length or sha1.hexdigest() != checksum:
+                fp.truncate(self.offset)
+                raise ValueError('Checksum mismatch of part at offset %d.' %
+                                 self.offset)
+        self.offset += length
+        if self.is_complete:
+            os.rename(self.part_path, self.path)
+        self.save()
+
+    def delete(self):
+        """Removes the upload and its file, unless it was moved away.
+        """
+        shutil.rmtree(self.get_path(self.id, 'files'), ignore_errors=True)
+        try:
+            os.unlink(self.get_path(self.id))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -21,5 +21,20 @@ urlpatterns = [
         name='dump-model-data'),
     url(r'^load/$',
         'smuggler.views.load_data',
-        name='load-data')
+        name='load-data'),
+    url(r'^load/uploads/$',
+        'smuggler.views.start_upload',
+        name='start-upload'),
+    url(r'^load/uploads/(?P<upload_id>[0-9a-f]{32})/$',
+        'smuggler.views.upload_part',
+        name='upload-part'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/$',
+        'smuggler.views.job_status',
+        name='job-status'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/download/$',
+        'smuggler.views.job_download',
+        name='job-download'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/manifest/$',
+        'smuggler.views.job_manifest',
+        name='job-manifest')
 ]
@@ -5,22 +5,72 @@
 # Django Smuggler is free software under terms of the GNU Lesser
 # General Public License version 3 (LGPLv3) as published by the Free
 # Software Foundation. See the file README for copying conditions.
-import re
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os.path
+import shutil
+import sys
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from functools import partial
+from itertools import groupby, islice, repeat
+from multiprocessing.pool import ThreadPool
+import django
+from django.conf import settings as django_settings
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management import CommandError
 from django.core.management.color import no_style
-from django.core.management.commands.dumpdata import Command as DumpData
-from django.core.management.commands.loaddata import Command as LoadData
-from django.db import router
-from django.db.utils import DEFAULT_DB_ALIAS
-from django.http import HttpResponse
+from django.core.management.commands.dumpdata import sort_dependencies
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, router, transaction
+from django.db.models import signals
+from django.db.utils import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils import six, timezone
 from django.utils.six import StringIO
 from smuggler import settings
+from smuggler.manifest import DumpManifest, read_manifest
+from smuggler.native import (ARCHIVE_CONTENT_TYPE, ARCHIVE_FORMAT,
+                             ArchiveWriter, check_archive, get_columns,
+                             get_copy_models, get_copy_tables, get_engine)
+from smuggler.serializers import (columnar, filter_objects,
+                                  get_deserializer, get_object_reader,
+                                  get_seeking_reader, jsonl)
+from smuggler.compression import (READ_CHUNK_SIZE, get_compression,
+                                  iter_compressed, open_compressed,
+                                  split_compression)
 
 try:
     allow_migrate = router.allow_migrate
 except AttributeError:  # before django 1.7
     allow_migrate = router.allow_syncdb
 
+try:
+    atomic = transaction.atomic
+except AttributeError:  # before django 1.6
+    atomic = transaction.commit_on_success
+
+try:
+    from django.apps import apps
+except ImportError:  # before django 1.7
+    apps = None
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # before django 1.5
+    from django.http import HttpResponse as StreamingHttpResponse
+
+if django.VERSION >= (1, 7):
+    NATURAL_KEY_OPTIONS = {'use_natural_foreign_keys': True}
+else:
+    NATURAL_KEY_OPTIONS = {'use_natural_keys': True}
+
 
 def save_uploaded_file_on_disk(uploaded_file, destination_path):
     with open(destination_path, 'wb') as fp:
@@ -28,52 +78,1694 @@ def save_uploaded_file_on_disk(uploaded_file, destination_path):
             fp.write(chunk)
 
 
+def get_app_labels():
+    """Returns the labels of all installed apps that have models.
+    """
+    if apps is not None:
+        return [app_config.label for app_config in apps.get_app_configs()
+                if app_config.models_module is not None]
+    return [app.__name__.split('.')[-2] for app in models.get_apps()]
+
+
+def get_app_models(app_label):
+    """Returns the models of an installed app.
+
+    Raises LookupError if there is no app with the given label.
+    """
+    if apps is not None:
+        app_config = apps.get_app_config(app_label)
+        if app_config.models_module is None:
+            return []
+        return list(app_config.get_models())
+    try:
+        return models.get_models(models.get_app(app_label))
+    except ImproperlyConfigured:
+        raise LookupError(app_label)
+
+
+def get_model(app_label, model_label):
+    """Returns a model by app label and model name.
+
+    Raises LookupError if the model does not exist.
+    """
+    if apps is not None:
+        return apps.get_model(app_label, model_label)
+    model = models.get_model(app_label, model_label)
+    if model is None:
+        raise LookupError('%s.%s' % (app_label, model_label))
+    return model
+
+
+def get_read_database(model, using=None):
+    """Returns the alias of the database a model is dumped from: ``using``,
+    or the one the database routers pick for reading.
+    """
+    return using or router.db_for_read(model)
+
+
+def get_write_database(model, using=None):
+    """Returns the alias of the database a model is loaded into: ``using``,
+    or the one the database routers pick for writing.
+    """
+    return using or router.db_for_write(model)
+
+
+def get_write_databases(using=None):
+    """Returns the aliases of the databases fixtures may be loaded into.
+    """
+    if using:
+        return [using]
+    return sorted(set(router.db_for_write(model)
+                      for app_label in get_app_labels()
+                      for model in get_app_models(app_label)))
+
+
+def check_database(using):
+    """Raises CommandError if ``using`` is not the alias of a database.
+    """
+    if using is not None and using not in django_settings.DATABASES:
+        raise CommandError('Unknown database: %s' % using)
+
+
+def group_by_database(models, get_database, using=None):
+    """Returns the given models by the alias ``get_database`` returns for
+    each of them.
+    """
+    databases = {}
+    for model in models:
+        databases.setdefault(get_database(model, using), []).append(model)
+    return databases
+
+
+@contextmanager
+def on_databases(context, aliases):
+    """Enters ``context(alias)`` for each alias, e.g. a transaction on each
+    of several databases.
+    """
+    if not aliases:
+        yield
+        return
+    with context(aliases[0]):
+        with on_databases(context, aliases[1:]):
+            yield
+
+
+def atomic_databases(aliases):
+    return on_databases(lambda using: atomic(using=using), aliases)
+
+
+def constraint_checks_disabled(aliases):
+    return on_databases(
+        lambda using: connections[using].constraint_checks_disabled(),
+        aliases)
+
+
+def get_dump_models(app_labels=[], exclude=[]):
+    """Returns the models to dump for the given app labels and excludes.
+
+    Labels are interpreted the same way the dumpdata command does, models
+    with natural keys are sorted before the models that depend on them.
+    """
+    excluded_apps = set()
+    excluded_models = set()
+    for label in exclude:
+        if '.' in label:
+            try:
+                excluded_models.add(get_model(*label.split('.', 1)))
+            except LookupError:
+                raise CommandError('Unknown model in excludes: %s' % label)
+        else:
+            try:
+                get_app_models(label)
+            except LookupError:
+                raise CommandError('Unknown app in excludes: %s' % label)
+            excluded_apps.add(label)
+    model_list = []
+    for label in app_labels or get_app_labels():
+        app_label, model_label = (label.split('.', 1) + [None])[:2]
+        try:
+            app_models = get_app_models(app_label)
+        except LookupError:
+            raise CommandError('Unknown application: %s' % app_label)
+        if app_label in excluded_apps:
+            continue
+        if model_label:
+            try:
+                app_models = [get_model(app_label, model_label)]
+            except LookupError:
+                raise CommandError('Unknown model: %s.%s' % (
+                    app_label, model_label))
+        for model in app_models:
+            if model not in model_list and model not in excluded_models:
+                model_list.append(model)
+    return sort_dependencies([(None, model_list)])
+
+
+def iter_queryset(queryset, chunk_size=settings.SMUGGLER_CHUNK_SIZE):
+    """Yields the objects in a queryset ordered by primary key.
+
+    Objects are fetched in pages of ``chunk_size``, each page starting after
+    the last primary key of the previous one. Memory use is bounded by the
+    page size and, unlike with offsets, every page is a primary key index
+    range scan no matter how far into the table it is.
+    """
+    queryset = queryset.order_by(queryset.model._meta.pk.attname)
+    page = list(queryset[:chunk_size])
+    while page:
+        for obj in page:
+            yield obj
+        if len(page) < chunk_size:
+            break
+        page = list(queryset.filter(pk__gt=page[-1].pk)[:chunk_size])
+
+
+def get_delta_field(model):
+    """Returns the name of the field that tells which rows of a model
+    changed, the field set in ``SMUGGLER_DELTA_FIELDS`` or None.
+    """
+    delta_fields = dict((label.lower(), field) for label, field in
+                        settings.SMUGGLER_DELTA_FIELDS.items())
+    return delta_fields.get(force_text(model._meta).lower())
+
+
+def get_delta_filter(model, value):
+    """Returns the queryset filter that selects the rows of a model that
+    changed since ``value``, a value of its delta field or, for models
+    without one, of its primary key.
+
+    Rows with a delta field equal to the value are included, they may have
+    changed after the value was recorded.
+    """
+    field = get_delta_field(model)
+    if field is None:
+        return {'pk__gt': value}
+    return {'%s__gte' % field: value}
+
+
+def get_watermarks(model_list, using=None):
+    """Returns the highest value of the delta field, or primary key, of each
+    model by model label, along with the name of the field.
+    """
+    watermarks = {}
+    for model in model_list:
+        field = get_delta_field(model) or 'pk'
+        value = model._default_manager.using(
+            get_read_database(model, using)).aggregate(
+            watermark=models.Max(field))['watermark']
+        if value is not None:
+            watermarks[force_text(model._meta)] = [field, value]
+    return watermarks
+
+
+def get_watermarks_path():
+    if not settings.SMUGGLER_FIXTURE_DIR:
+        raise ImproperlyConfigured(
+            'Incremental dumps require SMUGGLER_FIXTURE_DIR to be set.')
+    return os.path.join(settings.SMUGGLER_FIXTURE_DIR,
+                        '.smuggler_watermarks.json')
+
+
+def load_watermarks():
+    """Returns the watermarks stored by the last incremental dumps.
+    """
+    try:
+        with open(get_watermarks_path(), 'rb') as fp:
+            return json.loads(fp.read().decode('utf-8'))
+    except IOError:
+        return {}
+
+
+def save_watermarks(watermarks):
+    """Stores the watermarks of an incremental dump, keeping those of the
+    models that were not dumped.
+    """
+    path = get_watermarks_path()
+    stored = load_watermarks()
+    stored.update(watermarks)
+    with open('%s.tmp' % path, 'wb') as fp:
+        fp.write(force_bytes(json.dumps(stored, cls=DjangoJSONEncoder)))
+    os.rename('%s.tmp' % path, path)
+
+
+def get_delta(model_list, since=None, incremental=False):
+    """Returns the lower bounds of the rows to dump, by model.
+
+    ``since`` applies to models with a delta field. For incremental dumps
+    the watermarks of the previous incremental dump are used.
+    """
+    delta = {}
+    if since is not None:
+        for model in model_list:
+            if get_delta_field(model):
+                delta[model] = since
+    if incremental:
+        stored = load_watermarks()
+        for model in model_list:
+            field, value = stored.get(force_text(model._meta), [None, None])
+            if field == (get_delta_field(model) or 'pk'):
+                delta[model] = value
+    return delta
+
+
+def iter_then_save_watermarks(chunks, watermarks):
+    """Yields the chunks of a dump and saves its watermarks once the whole
+    dump has been produced.
+    """
+    for chunk in chunks:
+        yield chunk
+    save_watermarks(watermarks)
+
+
+def iter_dump_objects(model_list, using=None,
+                      chunk_size=settings.SMUGGLER_CHUNK_SIZE, delta=None,
+                      manifest=None):
+    """Yields the objects of the given models, one at a time.
+
+    Each model is read from the database ``using``, or from the one the
+    database routers pick. When ``delta`` maps a model to a lower bound only
+    the rows of that model that changed since are dumped. The objects are
+    counted in ``manifest``.
+    """
+    for model in model_list:
+        alias = get_read_database(model, using)
+        if model._meta.proxy or not allow_migrate(alias, model):
+            continue
+        queryset = model._default_manager.using(alias)
+        if delta and model in delta:
+            queryset = queryset.filter(**get_delta_filter(model,
+                                                          delta[model]))
+        label = force_text(model._meta)
+        for obj in iter_queryset(queryset, chunk_size):
+            if manifest is not None:
+                manifest.count(label)
+            yield obj
+
+
+def iter_python(objects, chunk_size=settings.SMUGGLER_CHUNK_SIZE):
+    """Converts objects to Python data with Django's python serializer.
+
+    Yields lists of at most ``chunk_size`` serialized objects.
+    """
+    serializer = serializers.get_serializer('python')()
+    objects = iter(objects)
+    while True:
+        chunk = list(islice(objects, chunk_size))
+        if not chunk:
+            break
+        yield serializer.serialize(chunk, **NATURAL_KEY_OPTIONS)
+
+
+def iter_json_part(objects, indent=None,
+                   chunk_size=settings.SMUGGLER_CHUNK_SIZE, manifest=None):
+    """Serializes objects to the elements of a JSON array, without the
+    enclosing brackets.
+
+    Parts of the same array are joined with a comma. The offset of the first
+    object of each model is recorded in ``manifest``.
+    """
+    json_kwargs = {'cls': DjangoJSONEncoder, 'indent': indent}
+    if indent:
+        json_kwargs['separators'] = (',', ': ')  # Prevent trailing spaces
+    else:
+        json_kwargs['separators'] = (',', ':')
+    separator = '\n' if indent else ''
+    for chunk in iter_python(objects, chunk_size):
+        output = []
+        size = 0  # The output is ASCII, characters are bytes
+        for data in chunk:
+            output.append(separator)
+            size += len(separator)
+            if manifest is not None:
+                manifest.set_offset(data['model'], manifest.position + size)
+            output.append(json.dumps(data, **json_kwargs))
+            size += len(output[-1])
+            separator = ',\n' if indent else ','
+        yield ''.join(output)
+
+
+def iter_json(objects, indent=None,
+              chunk_size=settings.SMUGGLER_CHUNK_SIZE, manifest=None):
+    """Serializes objects to JSON, yielding the output a chunk at a time.
+
+    Indented output is identical to that of Django's json serializer,
+    without indent the output uses compact separators.
+    """
+    yield '['
+    for chunk in iter_json_part(objects, indent, chunk_size, manifest):
+        yield chunk
+    yield '\n]\n' if indent else ']'
+
+
+def iter_jsonl(objects, indent=None,
+               chunk_size=settings.SMUGGLER_CHUNK_SIZE, manifest=None):
+    """Serializes objects to JSON Lines, yielding the output a chunk at a
+    time.
+
+    Lines can't be indented, ``indent`` is ignored. The offset of the first
+    object of each model is recorded in ``manifest``.
+    """
+    for chunk in iter_python(objects, chunk_size):
+        lines = [jsonl.dumps(data) + '\n' for data in chunk]
+        if manifest is not None:
+            size = 0
+            for data, line in zip(chunk, lines):
+                manifest.set_offset(data['model'], manifest.position + size)
+                size += len(line)
+        yield ''.join(lines)
+
+
+def iter_columnar(objects, indent=None,
+                  chunk_size=settings.SMUGGLER_CHUNK_SIZE, manifest=None):
+    """Serializes objects to columnar blocks, yielding the output a chunk
+    at a time.
+
+    The output is binary, ``indent`` is ignored. Each chunk has a block per
+    model of its objects. The offset of the first block of each model is
+    recorded in ``manifest``.
+    """
+    yield columnar.MAGIC
+    for chunk in iter_python(objects, chunk_size):
+        blocks = []
+        size = 0
+        for model, block in columnar.dump_blocks(chunk):
+            if manifest is not None:
+                manifest.set_offset(model, manifest.position + size)
+            blocks.append(block)
+            size += len(block)
+        yield b''.join(blocks)
+
+
+def iter_msgpack(objects, indent=None,
+                 chunk_size=settings.SMUGGLER_CHUNK_SIZE, manifest=None):
+    """Serializes objects to MessagePack, yielding the output a chunk at a
+    time.
+
+    The output is binary, ``indent`` is ignored. The offset of the first
+    object of each model is recorded in ``manifest``.
+    """
+    # msgpack is optional, the format is only registered when it is installed
+    from smuggler.serializers.msgpack import dumps
+    for chunk in iter_python(objects, chunk_size):
+        packed = [dumps(data) for data in chunk]
+        if manifest is not None:
+            size = 0
+            for data, record in zip(chunk, packed):
+                manifest.set_offset(data['model'], manifest.position + size)
+                size += len(record)
+        yield b''.join(packed)
+
+
+# Formats smuggler serializes chunk by chunk
+STREAMING_SERIALIZERS = {
+    'columnar': iter_columnar,
+    'json': iter_json,
+    'jsonl': iter_jsonl,
+    'msgpack': iter_msgpack,
+}
+
+
+def iter_serialized(objects, format=settings.SMUGGLER_FORMAT,
+                    indent=settings.SMUGGLER_INDENT, manifest=None):
+    """Serializes objects to the given format, yielding the output a chunk
+    at a time.
+
+    Formats smuggler can't stream are serialized in one go, without
+    recording offsets in ``manifest``.
+    """
+    if format in STREAMING_SERIALIZERS:
+        for chunk in STREAMING_SERIALIZERS[format](objects, indent,
+                                                   manifest=manifest):
+            yield chunk
+    else:
+        stream = StringIO()
+        serializers.serialize(format, objects, indent=indent, stream=stream,
+                              **NATURAL_KEY_OPTIONS)
+        yield stream.getvalue()
+
+
+# Formats smuggler can dump in parts, one part per model
+PART_SERIALIZERS = {
+    'json': iter_json_part,
+    'jsonl': iter_jsonl,
+    'msgpack': iter_msgpack,
+}
+
+
+def export_snapshot(using=DEFAULT_DB_ALIAS):
+    """Exports the snapshot of the current transaction so other connections
+    can read the same data.
+
+    Returns the snapshot id, or None when the database does not support
+    exporting snapshots (only PostgreSQL does).
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    cursor = connection.cursor()
+    cursor.execute('SELECT pg_export_snapshot()')
+    return cursor.fetchone()[0]
+
+
+# Makes the first statement of a transaction read a consistent snapshot and
+# refuse writes, by database vendor
+SNAPSHOT_SQL = {
+    'postgresql': 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY',
+    'mysql': 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY',
+}
+
+
+def iter_in_snapshot(chunks, aliases):
+    """Yields the chunks of a dump produced in a read-only transaction on
+    each of the given databases, so all models are read from one consistent
+    snapshot.
+
+    Transactions started by the caller are used as they are, their isolation
+    level can't be changed anymore.
+    """
+    outermost = [alias for alias in aliases
+                 if not getattr(connections[alias], 'in_atomic_block', True)]
+    with atomic_databases(aliases):
+        for alias in outermost:
+            sql = SNAPSHOT_SQL.get(connections[alias].vendor)
+            if sql:
+                connections[alias].cursor().execute(sql)
+        for chunk in chunks:
+            yield chunk
+
+
+def import_snapshot(snapshot, using=DEFAULT_DB_ALIAS):
+    """Makes the current transaction read the data of an exported snapshot.
+    """
+    cursor = connections[using].cursor()
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+    cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot])
+
+
+# Connections inherited from the parent of a worker process. They are kept
+# referenced so they are never closed, which would close them for the parent.
+inherited_connections = []
+
+
+def init_dump_worker():
+    """Gives a worker process connections of its own, in the state of new
+    connections.
+
+    Workers are forked while the parent reads in a transaction, the
+    transaction state they inherit would make ``atomic`` take the worker's
+    new connection for one that is already in a transaction.
+    """
+    for connection in connections.all():
+        inherited_connections.append(connection.connection)
+        connection.connection = None
+        if hasattr(connection, 'in_atomic_block'):  # django 1.6+
+            connection.in_atomic_block = False
+            connection.savepoint_ids = []
+            connection.needs_rollback = False
+            connection.autocommit = False
+            connection.commit_on_exit = True
+            connection.closed_in_transaction = False
+
+
+def dump_part(args):
+    """Serializes the objects of a model to a part file.
+
+    Runs in a worker of iter_parallel_dump, returns the path, the model
+    label and the number of objects.
+    """
+    (model, path, using, format, indent, delta, snapshot,
+     close_connection) = args
+    manifest = DumpManifest()
+    chunks = PART_SERIALIZERS[format](
+        iter_dump_objects([model], using, delta=delta, manifest=manifest),
+        indent)
+    try:
+        with open(path, 'wb') as fp:
+            # The model is read in a transaction of its own, of the exported
+            # snapshot if there is one
+            with atomic(using=using):
+                if snapshot:
+                    import_snapshot(snapshot, using)
+                for chunk in chunks:
+                    fp.write(force_bytes(chunk))
+    finally:
+        if close_connection:
+            connections[using].close()
+    return path, force_text(model._meta), manifest.object_count
+
+
+def iter_parts(parts, format, indent=None, manifest=None):
+    """Joins the part files returned by dump_part into a dump, yielding it a
+    chunk at a time.
+
+    The objects and offset of each part are recorded in ``manifest``.
+    """
+    separator = b''
+    if format == 'json':
+        yield b'['
+    for path, label, count in parts:
+        with open(path, 'rb') as fp:
+            data = fp.read(READ_CHUNK_SIZE)
+            if data:
+                yield separator
+                if format == 'json':
+                    separator = b','
+                if manifest is not None:
+                    # Indented parts start with a line break
+                    manifest.count(label, count)
+                    manifest.set_offset(label, manifest.position +
+                                        len(data) - len(data.lstrip()))
+            while data:
+                yield data
+                data = fp.read(READ_CHUNK_SIZE)
+        os.unlink(path)
+    if format == 'json':
+        yield b'\n]\n' if indent else b']'
+
+
+def iter_parallel_dump(model_list, using=None,
+                       format=settings.SMUGGLER_FORMAT,
+                       indent=settings.SMUGGLER_INDENT,
+                       workers=settings.SMUGGLER_DUMP_WORKERS, pool=None,
+                       delta=None, manifest=None):
+    """Dumps each model in a worker process of its own, yielding the dump a
+    chunk at a time.
+
+    The output is identical to that of a serial dump. On PostgreSQL all
+    workers that read a database read the same snapshot, on other databases
+    each model is read in a transaction of its own. A ``pool`` can be given
+    instead of creating a process pool of ``workers`` processes. ``using``
+    and ``delta`` are passed on to iter_dump_objects, ``manifest`` to
+    iter_parts.
+    """
+    part_dir = tempfile.mkdtemp(prefix='smuggler')
+    close_connection = pool is None
+    if pool is None:
+        pool = multiprocessing.Pool(workers, init_dump_worker)
+    aliases = [get_read_database(model, using) for model in model_list]
+    try:
+        with atomic_databases(sorted(set(aliases))):
+            snapshots = dict((alias, export_snapshot(alias))
+                             for alias in set(aliases))
+            parts = pool.imap(dump_part, [
+                (model, os.path.join(part_dir, '%d.part' % i), aliases[i],
+                 format, indent, delta, snapshots[aliases[i]],
+                 close_connection)
+                for i, model in enumerate(model_list)])
+            for chunk in iter_parts(parts, format, indent, manifest):
+                yield chunk
+    finally:
+        if close_connection:
+            pool.terminate()
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+
+def iter_archive(model_list, using=None, delta=None, manifest=None):
+    """Dumps the given models to a smuggler archive, yielding it a chunk at
+    a time.
+
+    The rows of the models listed in ``SMUGGLER_COPY_MODELS``, and of their
+    many-to-many tables, are copied whole with the engine of their
+    database, ``delta`` only applies to the other models. Every table is
+    spooled to a temporary file first, a tar member starts with its size.
+    """
+    writer = ArchiveWriter()
+    yield writer.output.take()
+    copy_models = get_copy_models(model_list)
+    part = 0
+    for copied, group in groupby(model_list, lambda m: m in copy_models):
+        if not copied:
+            part += 1
+            with tempfile.TemporaryFile() as fp:
+                for chunk in iter_jsonl(iter_dump_objects(
+                        list(group), using, delta=delta, manifest=manifest)):
+                    fp.write(force_bytes(chunk))
+                size = fp.tell()
+                fp.seek(0)
+                writer.add('%04d.objects.jsonl' % part, fp, size)
+            yield writer.output.take()
+            continue
+        for model in group:
+            alias = get_read_database(model, using)
+            if not allow_migrate(alias, model):
+                continue
+            engine = get_engine(connections[alias])
+            for table_model in get_copy_tables(model):
+                part += 1
+                label = force_text(table_model._meta)
+                columns = get_columns(table_model)
+                with tempfile.TemporaryFile() as fp:
+                    rows = engine.dump(table_model._meta.db_table, columns,
+                                       fp)
+                    writer.add_json('%04d.%s.json' % (part, label), {
+                        'model': label,
+                        'copied_with': force_text(model._meta),
+                        'table': table_model._meta.db_table,
+                        'columns': columns,
+                        'rows': rows,
+                        'vendor': engine.vendor,
+                    })
+                    size = fp.tell()
+                    fp.seek(0)
+                    writer.add('%04d.%s.%s' % (part, label, engine.extension),
+                               fp, size)
+                if manifest is not None:
+                    manifest.count(label, rows)
+                yield writer.output.take()
+    writer.close()
+    yield writer.output.take()
+
+
+def serialize_chunks(app_labels=[], exclude=[],
+                     format=settings.SMUGGLER_FORMAT,
+                     indent=settings.SMUGGLER_INDENT,
+                     compression=settings.SMUGGLER_COMPRESSION,
+                     workers=settings.SMUGGLER_DUMP_WORKERS, since=None,
+                     incremental=False, manifest=None,
+                     using=settings.SMUGGLER_DUMP_DATABASE):
+    """Returns an iterator over the (compressed) chunks of a dump of the
+    given apps and models.
+
+    With more than one worker, formats that can be dumped in parts are
+    dumped with iter_parallel_dump. Unknown apps, models, formats and
+    compressions are reported before the first chunk is produced.
+
+    With ``since`` only rows changed since then are dumped from models with
+    a delta field. Incremental dumps only dump the rows that changed since
+    the previous incremental dump and store new watermarks when they are
+    complete.
+
+    The objects of each model and their offsets in the uncompressed dump
+    are recorded in ``manifest``. Models are read from the database
+    ``using``, or from the one the database routers pick for each model, in
+    a single read-only transaction with iter_in_snapshot.
+
+    The ``smuggler`` format dumps a smuggler archive with iter_archive.
+    """
+    if format not in serializers.get_public_serializer_formats() and \
+            format != ARCHIVE_FORMAT:
+        raise CommandError('Unknown serialization format: %s' % format)
+    check_database(using)
+    if compression:
+        get_compression(compression)
+    model_list = get_dump_models(app_labels, exclude)
+    delta = get_delta(model_list, since, incremental)
+    if incremental:
+        # Taken before dumping, rows that change during the dump are dumped
+        # again by the next incremental dump.
+        watermarks = get_watermarks(model_list, using)
+    if format == ARCHIVE_FORMAT:
+        chunks = iter_archive(model_list, using, delta, manifest)
+    elif workers > 1 and format in PART_SERIALIZERS:
+        chunks = iter_parallel_dump(model_list, using, format=format,
+                                    indent=indent, workers=workers,
+                                    delta=delta, manifest=manifest)
+    else:
+        chunks = iter_serialized(
+            iter_dump_objects(model_list, using, delta=delta,
+                              manifest=manifest),
+            format, indent, manifest)
+    chunks = iter_in_snapshot(chunks, sorted(set(
+        get_read_database(model, using) for model in model_list)))
+    if manifest is not None:
+        chunks = manifest.track(chunks)
+    if incremental:
+        chunks = iter_then_save_watermarks(chunks, watermarks)
+    if compression:
+        chunks = iter_compressed(chunks, compression,
+                                 settings.SMUGGLER_COMPRESSION_LEVEL)
+    return chunks
+
+
+# Content types of uncompressed dumps that are not text
+CONTENT_TYPES = {
+    ARCHIVE_FORMAT: ARCHIVE_CONTENT_TYPE,
+    'columnar': 'application/octet-stream',
+    'msgpack': 'application/x-msgpack',
+}
+
+
+def get_content_type(format, compression=None):
+    """Returns the content type of a dump.
+    """
+    if compression:
+        return get_compression(compression)[1]
+    return CONTENT_TYPES.get(format, 'text/plain')
+
+
 def serialize_to_response(app_labels=[], exclude=[], response=None,
                           format=settings.SMUGGLER_FORMAT,
-                          indent=settings.SMUGGLER_INDENT):
-    response = response or HttpResponse(content_type='text/plain')
-    stream = StringIO()
-    error_stream = StringIO()
-    try:
-        dumpdata = DumpData()
-        dumpdata.style = no_style()
-        dumpdata.execute(*app_labels, **{
-            'stdout': stream,
-            'stderr': error_stream,
-            'exclude': exclude,
-            'format': format,
-            'indent': indent,
-            'use_natural_keys': True
-        })
-    except SystemExit:
-        # Django 1.4's implementation of execute catches CommandErrors and
-        # then calls sys.exit(1), we circumvent this here.
-        errors = error_stream.getvalue().strip().replace('Error: ', '')
-        raise CommandError(errors)
-    response.write(stream.getvalue())
+                          indent=settings.SMUGGLER_INDENT,
+                          compression=settings.SMUGGLER_COMPRESSION,
+                          since=None, incremental=False,
+                          using=settings.SMUGGLER_DUMP_DATABASE):
+    """Dumps the given apps and models to a streaming response.
+
+    If ``compression`` is given the dump is compressed while it is streamed.
+    If ``response`` is given the dump is written to it instead. ``since``,
+    ``incremental`` and ``using`` are passed on to serialize_chunks.
+    """
+    content_type = get_content_type(format, compression)
+    chunks = serialize_chunks(app_labels, exclude, format, indent,
+                              compression, since=since,
+                              incremental=incremental, using=using)
+    if response is None:
+        return StreamingHttpResponse(chunks, content_type=content_type)
+    for chunk in chunks:
+        response.write(chunk)
     return response
 
 
-def load_fixtures(fixtures):
-    stream = StringIO()
-    error_stream = StringIO()
-    loaddata = LoadData()
-    loaddata.style = no_style()
-    loaddata.execute(*fixtures, **{
-        'stdout': stream,
-        'stderr': error_stream,
-        'ignore': True,
-        'database': DEFAULT_DB_ALIAS,
-        'verbosity': 1
-    })
-    if hasattr(loaddata, 'loaded_object_count'):
-        return loaddata.loaded_object_count
+def parse_since(value):
+    """Parses the ISO 8601 date or date and time of an incremental dump.
+
+    Raises CommandError for invalid values.
+    """
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            since = parse_date(value)
+            if since is not None:
+                since = datetime.datetime.combine(since, datetime.time())
+    except ValueError:
+        since = None
+    if since is None:
+        raise CommandError('Invalid date: %s' % value)
+    if django_settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_current_timezone())
+    return since
+
+
+def parse_range(header, size):
+    """Parses the HTTP ``Range`` header of a request for a file of ``size``
+    bytes and returns the (first byte, last byte) of the requested range.
+
+    Returns None when the whole file should be sent: for missing, invalid
+    or multiple ranges. Raises ValueError for unsatisfiable ranges.
+    """
+    unit, _, ranges = (header or '').partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first:
+            first = int(first)
+            last = int(last) if last else size - 1
+            if first > last and first < size:
+                return None
+        else:
+            # A suffix range, the last bytes of the file
+            first = max(size - int(last), 0)
+            last = size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise ValueError('Unsatisfiable range: %s' % header)
+    return first, min(last, size - 1)
+
+
+def iter_file(fp, start=0, length=None, chunk_size=READ_CHUNK_SIZE):
+    """Yields ``length`` bytes, or the rest, of a file object starting at
+    ``start`` and closes the file.
+    """
+    try:
+        fp.seek(start)
+        while length is None or length > 0:
+            size = chunk_size if length is None else min(chunk_size, length)
+            data = fp.read(size)
+            if not data:
+                break
+            if length is not None:
+                length -= len(data)
+            yield data
+    finally:
+        fp.close()
+
+
+def parse_fixture_name(name):
+    """Returns the serialization format and compression of a fixture file
+    name, e.g. ('json', 'gz') for 'dump.json.gz'.
+    """
+    name, compression = split_compression(name)
+    return os.path.splitext(name)[1][1:].lower(), compression
+
+
+def get_fixture_formats():
+    """Returns the formats of the fixtures smuggler can load, Django's
+    serialization formats and smuggler archives.
+    """
+    return list(serializers.get_serializer_formats()) + [ARCHIVE_FORMAT]
+
+
+def has_save_listeners(model):
+    """Returns True if signal receivers are connected to the saving of a
+    model.
+    """
+    if not hasattr(signals.pre_save, 'has_listeners'):  # before django 1.6
+        return True
+    return (signals.pre_save.has_listeners(model) or
+            signals.post_save.has_listeners(model))
+
+
+def save_object(obj, using=None):
+    """Saves a deserialized object the way loaddata does, into the database
+    ``using`` or the one the database routers pick for its model.
+    """
+    try:
+        obj.save(using=get_write_database(obj.object.__class__, using))
+    except (DatabaseError, IntegrityError) as e:
+        e.args = ('Could not load %s(pk=%s): %s' % (
+            obj.object._meta, obj.object.pk, force_text(e)),)
+        raise
+
+
+def save_objects(objects, using=None):
+    """Saves deserialized objects one at a time. Yields the model of each
+    saved object.
+    """
+    for obj in objects:
+        save_object(obj, using)
+        yield obj.object.__class__
+
+
+def save_batch(model, objects, using=None,
+               on_conflict=settings.SMUGGLER_ON_CONFLICT):
+    """Saves a batch of deserialized objects of the same model.
+
+    Objects with a new primary key are inserted with multi-row INSERTs,
+    objects with an existing primary key are saved one at a time when
+    ``on_conflict`` is 'update' and skipped when it is 'skip'. Yields the
+    model once for each saved object.
+    """
+    using = get_write_database(model, using)
+    connection = connections[using]
+    pks = [obj.object.pk for obj in objects]
+    lookup_size = max(connection.ops.bulk_batch_size([model._meta.pk], pks), 1)
+    existing = set()
+    for i in range(0, len(pks), lookup_size):
+        existing.update(model._base_manager.using(using).filter(
+            pk__in=pks[i:i + lookup_size]).values_list('pk', flat=True))
+    new_objects = []
+    for obj in objects:
+        if obj.object.pk not in existing:
+            new_objects.append(obj)
+        elif on_conflict == 'update':
+            save_object(obj, using)
+            yield model
+    if not new_objects:
+        return
+    fields = getattr(model._meta, 'local_concrete_fields',
+                     model._meta.local_fields)
+    instances = [obj.object for obj in new_objects]
+    batch_size = max(connection.ops.bulk_batch_size(fields, instances), 1)
+    try:
+        for i in range(0, len(instances), batch_size):
+            # Like bulk_create, but raw so field values are inserted as is
+            model._base_manager._insert(instances[i:i + batch_size],
+                                        fields=fields, using=using, raw=True)
+    except (DatabaseError, IntegrityError) as e:
+        e.args = ('Could not load %s: %s' % (model._meta, force_text(e)),)
+        raise
+    for obj in new_objects:
+        obj.object._state.adding = False
+        obj.object._state.db = using
+        for accessor_name, object_list in (obj.m2m_data or {}).items():
+            setattr(obj.object, accessor_name, object_list)
+        yield model
+
+
+def has_natural_key(model):
+    """Returns True if objects of a model can be referred to by natural key.
+    """
+    return hasattr(model._default_manager, 'get_by_natural_key')
+
+
+class BatchSaver(object):
+    """Saves deserialized objects in batches of consecutive objects of the
+    same model.
+
+    Objects without a primary key and objects of models with save signal
+    receivers are saved one at a time.
+
+    Deserializers look up natural keys when they deserialize an object, so
+    the batch must be saved before an object that may refer to it is
+    deserialized. Smuggler's deserializers are given ``before_object``,
+    which saves the batch when the next object is of another model. With
+    other deserializers the batch of a model with natural keys is saved
+    before the next object is read.
+    """
+    def __init__(self, using=None, on_conflict=settings.SMUGGLER_ON_CONFLICT,
+                 batch_size=settings.SMUGGLER_CHUNK_SIZE):
+        self.using = using
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.batch = []
+        self.batch_pks = set()
+        self.saved = []
+        self.error = None
+        self.announced = False
+
+    def before_object(self, data):
+        self.announced = True
+        if self.batch and force_text(data.get('model')).lower() != \
+                force_text(self.batch[0].object._meta):
+            # Errors would be taken for errors of the deserializer
+            try:
+                self.flush()
+            except Exception:
+                self.error = sys.exc_info()
+
+    def flush(self):
+        batch, self.batch, self.batch_pks = self.batch, [], set()
+        if batch:
+            self.saved.extend(save_batch(batch[0].object.__class__, batch,
+                                         self.using, self.on_conflict))
+
+    def take_saved(self):
+        if self.error is not None:
+            six.reraise(*self.error)
+        saved, self.saved = self.saved, []
+        return saved
+
+    def save(self, objects, deserializing=True):
+        """Saves ``objects``, which are read from a deserializer unless
+        ``deserializing`` is False. Yields the model of each saved object.
+        """
+        objects = iter(objects)
+        while True:
+            if deserializing and not self.announced and self.batch and \
+                    has_natural_key(self.batch[0].object.__class__):
+                self.flush()
+            try:
+                obj = next(objects)
+            except StopIteration:
+                break
+            except Exception:
+                self.take_saved()  # Errors of the batch come first
+                raise
+            for model in self.take_saved():
+                yield model
+            model = obj.object.__class__
+            pk = obj.object.pk
+            bulk = pk is not None and not has_save_listeners(model)
+            if self.batch and (
+                    not bulk or model is not self.batch[0].object.__class__ or
+                    pk in self.batch_pks or
+                    len(self.batch) >= self.batch_size):
+                self.flush()
+                for saved_model in self.take_saved():
+                    yield saved_model
+            if bulk:
+                self.batch.append(obj)
+                self.batch_pks.add(pk)
+            else:
+                save_object(obj, self.using)
+                yield model
+        self.flush()
+        for model in self.take_saved():
+            yield model
+
+
+def bulk_save_objects(objects, using=None,
+                      on_conflict=settings.SMUGGLER_ON_CONFLICT,
+                      batch_size=settings.SMUGGLER_CHUNK_SIZE):
+    """Saves deserialized objects in batches of consecutive objects of the
+    same model with a BatchSaver. Yields the model of each saved object.
+
+    The objects must have been deserialized already, use BatchSaver for
+    objects read from a deserializer.
+    """
+    return BatchSaver(using, on_conflict, batch_size).save(
+        objects, deserializing=False)
+
+
+def get_fixture_name(fixture):
+    """Returns the file name of a fixture path or uploaded file.
+    """
+    if isinstance(fixture, six.string_types):
+        return os.path.basename(fixture)
+    return fixture.name
+
+
+def open_fixture(fixture):
+    """Returns the file name and an open binary file object of a fixture
+    path or uploaded file.
+    """
+    if isinstance(fixture, six.string_types):
+        return get_fixture_name(fixture), open(fixture, 'rb')
+    fixture.open()
+    return fixture.name, fixture
+
+
+class ModelFilter(object):
+    """Selects the objects of a fixture to load by their model label.
+
+    ``include`` and ``exclude`` are app labels or model labels like
+    ``auth.user``. Only objects of included models are loaded, or of every
+    model if nothing is included, except objects of excluded models.
+    """
+    def __init__(self, include=(), exclude=()):
+        self.include = frozenset(force_text(label).lower()
+                                 for label in include)
+        self.exclude = frozenset(force_text(label).lower()
+                                 for label in exclude)
+
+    @staticmethod
+    def matches(labels, label):
+        return label in labels or label.split('.', 1)[0] in labels
+
+    def __call__(self, label):
+        if not isinstance(label, six.string_types):
+            return True  # Let the deserializer report invalid labels
+        label = label.lower()
+        if self.include and not self.matches(self.include, label):
+            return False
+        return not self.matches(self.exclude, label)
+
+    @property
+    def key(self):
+        return 'include=%s;exclude=%s' % (','.join(sorted(self.include)),
+                                          ','.join(sorted(self.exclude)))
+
+
+def get_model_filter(include=(), exclude=()):
+    """Returns a ModelFilter, or None when no models are included or
+    excluded.
+    """
+    if not include and not exclude:
+        return None
+    return ModelFilter(include, exclude)
+
+
+def iter_manifest_objects(fp, format, manifest, model_filter):
+    """Yields the raw data of the objects of the models ``model_filter``
+    accepts, seeking to the offset of each model the manifest of an
+    uncompressed fixture lists instead of reading the whole fixture.
+    """
+    read_objects_from = get_seeking_reader(format)
+    for model in sorted([model for model in manifest['models']
+                         if model_filter(model['model'])],
+                        key=lambda model: model['offset']):
+        fp.seek(model['offset'])
+        for data in islice(read_objects_from(fp), model['count']):
+            yield data
+
+
+def can_seek_models(fixture, format, compression, manifest):
+    """Tells whether the objects of a model can be found in a fixture with
+    the offsets of its manifest.
+    """
+    return (isinstance(fixture, six.string_types) and compression is None and
+            get_seeking_reader(format) is not None and
+            manifest is not None and
+            manifest.get('size') == os.path.getsize(fixture) and
+            all(model.get('offset') is not None
+                for model in manifest.get('models', [])))
+
+
+def iter_deserialized(objects, using=DEFAULT_DB_ALIAS):
+    """Deserializes the raw data of objects, reporting errors as
+    DeserializationError.
+    """
+    try:
+        for obj in serializers.get_deserializer('python')(
+                objects, using=using, ignorenonexistent=True):
+            yield obj
+    except (GeneratorExit, DeserializationError):
+        raise
+    except Exception as e:
+        six.reraise(DeserializationError, DeserializationError(e),
+                    sys.exc_info()[2])
+
+
+def deserialize_fixture(fixture, fp, using=None, model_filter=None,
+                        before_object=None):
+    """Returns an iterator of the deserialized objects of a fixture that
+    may be saved to the database ``using``, or to the one the database
+    routers pick for their model, read from its open binary file ``fp``.
+    Natural keys are looked up in ``using`` or the default database.
+
+    With a ``model_filter`` only the objects of the models it accepts are
+    returned. Smuggler's deserializers skip the other objects before they
+    are deserialized, and uncompressed fixtures with a manifest are only
+    read where the accepted models are. They call ``before_object`` with the
+    raw data of each object before it is deserialized, other deserializers
+    don't.
+    """
+    name = get_fixture_name(fixture)
+    format, compression = parse_fixture_name(name)
+    if format not in serializers.get_public_serializer_formats():
+        raise CommandError(
+            "Problem installing fixture '%s': %s is not a known "
+            "serialization format." % (name, format))
+    manifest = None
+    if model_filter is not None and isinstance(fixture, six.string_types):
+        manifest = read_manifest(fixture)
+    lookup_database = using or DEFAULT_DB_ALIAS
+    if model_filter is None:
+        objects = get_deserializer(format)(
+            open_compressed(fp, compression), using=lookup_database,
+            ignorenonexistent=True, before_object=before_object)
+    elif can_seek_models(fixture, format, compression, manifest):
+        objects = iter_deserialized(filter_objects(iter_manifest_objects(
+            fp, format, manifest, model_filter), before_object=before_object),
+            lookup_database)
     else:
-        # Django < 1.6 has no loaded_object_count attribute, we need
-        # to fetch it from stderror :(
-        errors = error_stream.getvalue()
-        out = stream.getvalue()
-        if errors:
-            # The only way to handle errors in Django 1.4 is to inspect stdout
-            raise CommandError(errors.strip().splitlines()[-1])
-        return int(re.search('Installed ([0-9]+)', out.strip()).group(1))
+        objects = (obj for obj in get_deserializer(format)(
+            open_compressed(fp, compression), using=lookup_database,
+            ignorenonexistent=True, model_filter=model_filter,
+            before_object=before_object)
+            # Deserializers of other formats ignore the filter
+            if model_filter(force_text(obj.object._meta)))
+    return (obj for obj in objects if allow_migrate(
+        get_write_database(obj.object.__class__, using),
+        obj.object.__class__))
+
+
+def iter_archive_parts(fp):
+    """Yields the parts of a smuggler archive read from the binary file
+    ``fp``, as the description of a copied table, or None for objects, and
+    the file object of the part.
+    """
+    archive = tarfile.open(fileobj=fp, mode='r|')
+    table = None
+    for member in archive:
+        data = archive.extractfile(member)
+        if member.name == 'archive.json':
+            check_archive(json.loads(force_text(data.read())))
+        elif member.name.endswith('.objects.jsonl'):
+            yield None, data
+        elif member.name.endswith('.json'):
+            table = json.loads(force_text(data.read()))
+        else:  # The rows of the table described by the previous member
+            yield table, data
+
+
+def get_table_target(table, using=None, model_filter=None):
+    """Returns the model of a copied table and the engine that restores its
+    rows, or None if the table is not loaded.
+
+    Raises CommandError if the rows can't be restored into the database the
+    routers pick for writing the model.
+    """
+    model = get_model(*table['model'].split('.', 1))
+    alias = get_write_database(model, using)
+    if model_filter is not None and not model_filter(table['copied_with']) \
+            or not allow_migrate(alias, model):
+        return None
+    engine = get_engine(connections[alias])
+    if engine.vendor != table['vendor']:
+        raise CommandError(
+            'The rows of %s were copied from a %s database and can not be '
+            'restored into a %s database.' % (
+                table['model'], table['vendor'], engine.vendor))
+    return model, engine
+
+
+def deserialize_archive_objects(fp, using=None, model_filter=None,
+                                before_object=None):
+    """Returns an iterator of the deserialized objects of the objects part
+    of a smuggler archive that may be saved, like deserialize_fixture.
+    """
+    return (obj for obj in jsonl.Deserializer(
+        fp, using=using or DEFAULT_DB_ALIAS, ignorenonexistent=True,
+        model_filter=model_filter, before_object=before_object)
+        if allow_migrate(get_write_database(obj.object.__class__, using),
+                         obj.object.__class__))
+
+
+def load_archive(fp, using=None, bulk=settings.SMUGGLER_BULK_LOAD,
+                 on_conflict=settings.SMUGGLER_ON_CONFLICT, model_filter=None):
+    """Loads the parts of a smuggler archive read from the binary file
+    ``fp``. Yields the model of each loaded object or row.
+
+    Objects are loaded like those of a JSON Lines fixture. The rows of a
+    copied table are restored with the engine of the database the routers
+    pick for writing its model, which must be of the vendor they were
+    copied from.
+    """
+    for table, data in iter_archive_parts(fp):
+        if table is None:
+            if bulk:
+                saver = BatchSaver(using, on_conflict)
+                models = saver.save(deserialize_archive_objects(
+                    data, using, model_filter, saver.before_object))
+            else:
+                models = save_objects(deserialize_archive_objects(
+                    data, using, model_filter), using)
+            for model in models:
+                yield model
+            continue
+        target = get_table_target(table, using, model_filter)
+        if target is None:
+            continue
+        model, engine = target
+        rows = engine.load(table['table'], table['columns'], data)
+        for model in repeat(model, rows):
+            yield model
+
+
+def load_fixture(fixture, using=None,
+                 bulk=settings.SMUGGLER_BULK_LOAD,
+                 on_conflict=settings.SMUGGLER_ON_CONFLICT, progress=None,
+                 skip=0, model_filter=None):
+    """Loads a single fixture, decompressing it while it is read.
+
+    The fixture is either a path or an uploaded file, which is read directly
+    from memory or from its temporary file. Objects are saved into the
+    database ``using``, or the one the database routers pick for writing
+    their model. When ``bulk`` is True objects are saved in batches with a
+    BatchSaver. Yields the models of the loaded objects, one for each
+    object.
+
+    When ``progress`` is given it is called with the model of each loaded
+    object and the number of (compressed) bytes read from the fixture. The
+    first ``skip`` objects are read but not saved. ``model_filter`` is
+    passed on to deserialize_fixture. Smuggler archives are loaded with
+    load_archive.
+    """
+    name, fp = open_fixture(fixture)
+    try:
+        format, compression = parse_fixture_name(name)
+        if format == ARCHIVE_FORMAT:
+            if skip:
+                raise CommandError("Loads of smuggler archives can't be "
+                                   "resumed: %s" % name)
+            models = load_archive(open_compressed(fp, compression), using,
+                                  bulk, on_conflict, model_filter)
+        else:
+            saver = before_object = None
+            if bulk:
+                saver = BatchSaver(using, on_conflict)
+                before_object = saver.before_object
+            objects = deserialize_fixture(fixture, fp, using, model_filter,
+                                          before_object)
+            if skip:
+                objects = islice(objects, skip, None)
+            if saver is not None:
+                models = saver.save(objects)
+            else:
+                models = save_objects(objects, using)
+        for model in models:
+            if progress is not None:
+                progress(model, fp.tell())
+            yield model
+    finally:
+        fp.close()
+
+
+def reset_sequences(models, using=None):
+    """Resets the primary key sequences of the given models, so new rows
+    get a primary key above those of the loaded rows.
+    """
+    for alias, alias_models in group_by_database(models, get_write_database,
+                                                 using).items():
+        connection = connections[alias]
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(),
+                                                         alias_models)
+        if sequence_sql:
+            cursor = connection.cursor()
+            for line in sequence_sql:
+                cursor.execute(line)
+
+
+def check_constraints(models, using=None):
+    """Checks the constraints of the tables of loaded models, which were
+    not checked while they were loaded.
+    """
+    for alias, alias_models in group_by_database(models, get_write_database,
+                                                 using).items():
+        connections[alias].check_constraints(table_names=[
+            model._meta.db_table for model in alias_models])
+
+
+def get_fixture_hash(fixture):
+    """Returns the SHA-1 hash of the content of a fixture.
+    """
+    name, fp = open_fixture(fixture)
+    sha1 = hashlib.sha1()
+    try:
+        data = fp.read(READ_CHUNK_SIZE)
+        while data:
+            sha1.update(data)
+            data = fp.read(READ_CHUNK_SIZE)
+    finally:
+        if fp is not fixture:  # Uploads can't be reopened once closed
+            fp.close()
+    return sha1.hexdigest()
+
+
+def get_checkpoint_path(fixture_hash):
+    if not settings.SMUGGLER_FIXTURE_DIR:
+        raise ImproperlyConfigured(
+            'Resumable loads require SMUGGLER_FIXTURE_DIR to be set.')
+    return os.path.join(settings.SMUGGLER_FIXTURE_DIR,
+                        '.smuggler_checkpoints', '%s.json' % fixture_hash)
+
+
+def load_checkpoint(fixture_hash):
+    """Returns the checkpoint of a fixture with the given hash: the number
+    of committed ``records``, the ``models`` they belong to and whether the
+    fixture is ``done``.
+    """
+    try:
+        with open(get_checkpoint_path(fixture_hash), 'rb') as fp:
+            return json.loads(fp.read().decode('utf-8'))
+    except IOError:
+        return {'hash': fixture_hash, 'records': 0, 'done': False}
+
+
+def save_checkpoint(checkpoint):
+    path = get_checkpoint_path(checkpoint['hash'])
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open('%s.tmp' % path, 'wb') as fp:
+        fp.write(force_bytes(json.dumps(checkpoint)))
+    os.rename('%s.tmp' % path, path)
+
+
+def delete_checkpoint(fixture_hash):
+    try:
+        os.unlink(get_checkpoint_path(fixture_hash))
+    except OSError:
+        pass
+
+
+def load_fixture_in_batches(fixture, checkpoint, using=None,
+                            bulk=settings.SMUGGLER_BULK_LOAD,
+                            on_conflict=settings.SMUGGLER_ON_CONFLICT,
+                            progress=None,
+                            batch_size=settings.SMUGGLER_CHUNK_SIZE,
+                            model_filter=None):
+    """Loads a fixture, committing every ``batch_size`` objects and saving
+    the number of committed objects in the fixture's checkpoint.
+
+    Loading starts after the objects the checkpoint says were committed.
+    Returns the number of objects loaded from the fixture.
+    """
+    aliases = get_write_databases(using)
+    # Include the models loaded before the load was interrupted
+    loaded_models = set(get_model(*label.split('.', 1))
+                        for label in checkpoint.get('models', []))
+    models = load_fixture(fixture, using, bulk, on_conflict, progress,
+                          skip=checkpoint['records'],
+                          model_filter=model_filter)
+    try:
+        while True:
+            with atomic_databases(aliases):
+                with constraint_checks_disabled(aliases):
+                    batch = list(islice(models, batch_size))
+                check_constraints(set(batch), using)
+                loaded_models.update(batch)
+                if not batch:
+                    reset_sequences(loaded_models, using)
+            if not batch:
+                break
+            checkpoint['records'] += len(batch)
+            checkpoint['models'] = sorted(set(
+                '%s.%s' % (model._meta.app_label, model._meta.object_name)
+                for model in loaded_models))
+            save_checkpoint(checkpoint)
+    finally:
+        models.close()
+    checkpoint['done'] = True
+    save_checkpoint(checkpoint)
+    return checkpoint['records']
+
+
+def load_fixtures_resumable(fixtures, using=None,
+                            bulk=settings.SMUGGLER_BULK_LOAD,
+                            on_conflict=settings.SMUGGLER_ON_CONFLICT,
+                            progress=None, model_filter=None):
+    """Loads fixtures in batches of ``SMUGGLER_CHUNK_SIZE`` objects, each
+    committed on its own, keeping a checkpoint for every fixture.
+
+    When the same fixtures are loaded again after a failure, fixtures that
+    were loaded completely are skipped and the others continue after the
+    last committed batch. Fixtures are recognized by the hash of their
+    content, and the models loaded from them. The checkpoints are removed
+    once all fixtures are loaded. Returns the number of loaded objects.
+    """
+    hashes = [get_fixture_hash(fixture) for fixture in fixtures]
+    if model_filter is not None:
+        hashes = [hashlib.sha1(force_bytes(
+            fixture_hash + model_filter.key)).hexdigest()
+            for fixture_hash in hashes]
+    object_count = 0
+    for index, fixture in enumerate(fixtures):
+        checkpoint = load_checkpoint(hashes[index])
+        checkpoint['name'] = get_fixture_name(fixture)
+        if checkpoint['done']:
+            object_count += checkpoint['records']
+            continue
+        fixture_progress = None
+        if progress is not None:
+            fixture_progress = partial(progress, index)
+        try:
+            object_count += load_fixture_in_batches(
+                fixture, checkpoint, using, bulk, on_conflict,
+                fixture_progress, settings.SMUGGLER_CHUNK_SIZE, model_filter)
+        except Exception as e:
+            e.fixture_index = index
+            raise
+    for fixture_hash in hashes:
+        delete_checkpoint(fixture_hash)
+    return object_count
+
+
+def load_fixtures(fixtures, using=None,
+                  bulk=settings.SMUGGLER_BULK_LOAD,
+                  on_conflict=settings.SMUGGLER_ON_CONFLICT, progress=None,
+                  resumable=settings.SMUGGLER_RESUMABLE_LOAD,
+                  model_filter=None):
+    """Loads fixture files or uploaded fixtures into the database in a single
+    transaction, or with load_fixtures_resumable when ``resumable`` is True.
+
+    Objects are loaded into the database ``using``, or into the one the
+    database routers pick for writing their model. Then there is a
+    transaction on each database objects may be loaded into.
+
+    When ``progress`` is given it is called for each loaded object with the
+    index of the fixture being loaded, the model of the object and the
+    number of bytes read from the fixture. ``model_filter`` is passed on to
+    load_fixture. Returns the number of loaded objects.
+    """
+    if resumable:
+        return load_fixtures_resumable(fixtures, using, bulk, on_conflict,
+                                       progress, model_filter)
+    aliases = get_write_databases(using)
+    loaded_models = set()
+    object_count = 0
+    with atomic_databases(aliases):
+        with constraint_checks_disabled(aliases):
+            for index, fixture in enumerate(fixtures):
+                fixture_progress = None
+                if progress is not None:
+                    fixture_progress = partial(progress, index)
+                try:
+                    for model in load_fixture(fixture, using, bulk,
+                                              on_conflict, fixture_progress,
+                                              model_filter=model_filter):
+                        loaded_models.add(model)
+                        object_count += 1
+                except Exception as e:
+                    # Tell callers which fixture could not be loaded
+                    e.fixture_index = index
+                    raise
+        # Constraint checks were disabled, check the loaded tables manually
+        check_constraints(loaded_models, using)
+        if object_count:
+            reset_sequences(loaded_models, using)
+    return object_count
+
+
+def get_fixture_model_counts(fixture):
+    """Returns the number of objects per model label in a fixture, without
+    loading them.
+
+    Returns None if smuggler can't read the fixture's format without
+    deserializing it.
+    """
+    name, fp = open_fixture(fixture)
+    try:
+        format, compression = parse_fixture_name(name)
+        read_objects = get_object_reader(format)
+        if read_objects is None:
+            return None
+        counts = {}
+        try:
+            for data in read_objects(open_compressed(fp, compression)):
+                counts[data['model']] = counts.get(data['model'], 0) + 1
+        except (KeyError, TypeError, ValueError) as e:
+            raise DeserializationError(
+                "Problem reading fixture '%s': %s" % (name, e))
+    finally:
+        if fp is not fixture:  # Uploads can't be reopened once closed
+            fp.close()
+    return counts
+
+
+def get_fixture_models(fixture):
+    """Returns the set of models of the objects in a fixture, without
+    loading them.
+
+    Returns None if smuggler can't read the fixture's format without
+    deserializing it.
+    """
+    counts = get_fixture_model_counts(fixture)
+    if counts is None:
+        return None
+    fixture_models = set()
+    for label in counts:
+        try:
+            fixture_models.add(get_model(*label.split('.', 1)))
+        except (LookupError, TypeError):
+            raise DeserializationError(
+                "Invalid model identifier in fixture '%s': %s" % (
+                    get_fixture_name(fixture), label))
+    return fixture_models
+
+
+def get_model_dependencies(model):
+    """Returns the models a model refers to with foreign keys, one-to-one
+    and many-to-many relations, or with its natural key.
+    """
+    dependencies = set()
+    for field in list(model._meta.fields) + list(model._meta.many_to_many):
+        rel = getattr(field, 'rel', None)
+        if rel is not None and not isinstance(rel.to, six.string_types):
+            dependencies.add(rel.to)
+    if hasattr(model, 'natural_key'):
+        for label in getattr(model.natural_key, 'dependencies', []):
+            dependencies.add(get_model(*label.split('.', 1)))
+    dependencies.discard(model)
+    return dependencies
+
+
+def group_fixtures(fixtures):
+    """Splits fixtures in groups that can be loaded independently of each
+    other.
+
+    Fixtures with objects of the same model, or of models that depend on
+    each other, end up in the same group. Within a group fixtures are sorted
+    so that fixtures are loaded after the fixtures they depend on. Returns a
+    list of groups, each a list of fixture indexes.
+    """
+    fixture_models = [get_fixture_models(fixture) for fixture in fixtures]
+    if None in fixture_models:  # Unknown contents, load all in one group
+        return [list(range(len(fixtures)))]
+    owners = {}
+    for index, model_set in enumerate(fixture_models):
+        for model in model_set:
+            owners.setdefault(model, []).append(index)
+    groups = list(range(len(fixtures)))
+
+    def find(index):
+        while groups[index] != index:
+            index = groups[index]
+        return index
+
+    depends_on = [set() for fixture in fixtures]
+    for index, model_set in enumerate(fixture_models):
+        for model in model_set:
+            related = set(owners[model])
+            for dependency in get_model_dependencies(model):
+                for owner in owners.get(dependency, []):
+                    if owner != index:
+                        depends_on[index].add(owner)
+                        related.add(owner)
+            for owner in related:
+                groups[find(owner)] = find(index)
+    grouped = {}
+    for index in range(len(fixtures)):
+        grouped.setdefault(find(index), []).append(index)
+    result = []
+    for members in sorted(grouped.values()):
+        ordered = []
+        while members:
+            # Load the first fixture whose dependencies are loaded, or the
+            # first fixture if its dependencies are circular
+            ready = [index for index in members
+                     if not depends_on[index].intersection(members)]
+            ordered.append((ready or members)[0])
+            members = [index for index in members if index != ordered[-1]]
+        result.append(ordered)
+    return result
+
+
+def load_fixture_group(args):
+    """Loads a group of fixtures in a transaction of its own.
+
+    Runs in a worker of load_fixtures_in_parallel. Returns the number of
+    objects loaded from each fixture and the error, if any.
+    """
+    (fixtures, indexes, using, bulk, on_conflict, progress, model_filter,
+     close_connection) = args
+    counts = [0] * len(indexes)
+
+    def count(index, model, position):
+        counts[index] += 1
+        if progress is not None:
+            progress(indexes[index], model, position)
+
+    try:
+        load_fixtures([fixtures[index] for index in indexes], using, bulk,
+                      on_conflict, count, model_filter=model_filter)
+        return counts, None, None
+    except Exception as e:
+        failed = getattr(e, 'fixture_index', None)
+        if failed is not None:
+            failed = indexes[failed]
+        return counts, failed, force_text(e)
+    finally:
+        if close_connection:
+            for alias in get_write_databases(using):
+                connections[alias].close()
+
+
+def load_fixtures_in_parallel(fixtures, using=None,
+                              bulk=settings.SMUGGLER_BULK_LOAD,
+                              on_conflict=settings.SMUGGLER_ON_CONFLICT,
+                              workers=settings.SMUGGLER_LOAD_WORKERS,
+                              progress=None, pool=None, model_filter=None):
+    """Loads groups of independent fixtures concurrently, each group in a
+    transaction of its own on a connection of its own.
+
+    Groups of models routed to different databases, e.g. shards, are loaded
+    concurrently too. SQLite doesn't support concurrent writes, when
+    fixtures may be loaded into SQLite the groups are loaded one after
+    another. A ``pool`` can be given instead of creating a thread
+    pool of ``workers`` threads. ``progress`` is called like it is by
+    load_fixtures, possibly from several threads at once. ``model_filter``
+    is passed on to load_fixture.
+
+    Returns a result for each fixture: a dict with its ``name``, ``status``
+    ('loaded', 'failed' or 'rolled back'), ``object_count`` and ``error``.
+    """
+    groups = group_fixtures(fixtures)
+    close_connection = False
+    if pool is None and workers > 1 and len(groups) > 1 and all(
+            connections[alias].vendor != 'sqlite'
+            for alias in get_write_databases(using)):
+        pool = ThreadPool(min(workers, len(groups)))
+        close_connection = True
+    map_groups = pool.imap if pool is not None else six.moves.map
+    results = [{'name': get_fixture_name(fixture), 'status': 'loaded',
+                'object_count': 0, 'error': None} for fixture in fixtures]
+    try:
+        for indexes, (counts, failed, error) in zip(groups, map_groups(
+                load_fixture_group, [
+                    (fixtures, indexes, using, bulk, on_conflict, progress,
+                     model_filter, close_connection) for indexes in groups])):
+            for index, count in zip(indexes, counts):
+                results[index]['object_count'] = count
+                if error is None:
+                    continue
+                results[index]['object_count'] = 0
+                if failed is None or index == failed:
+                    results[index].update(status='failed', error=error)
+                else:
+                    results[index]['status'] = 'rolled back'
+    finally:
+        if close_connection:
+            pool.terminate()
+    return results
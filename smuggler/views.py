@@ -5,40 +5,81 @@
 # Django Smuggler is free software under terms of the GNU Lesser
 # General Public License version 3 (LGPLv3) as published by the Free
 # Software Foundation. See the file README for copying conditions.
+import json
 import os.path
 from datetime import datetime
-import tempfile
 from django.contrib.admin.helpers import AdminForm
-from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.core.exceptions import (ImproperlyConfigured, ObjectDoesNotExist,
+                                    PermissionDenied)
 from django.core.management.base import CommandError
 from django.core.serializers.base import DeserializationError
+from django.core.urlresolvers import reverse
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseNotAllowed,
+                         HttpResponseNotModified, HttpResponseRedirect)
+from django.shortcuts import render
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _, ungettext_lazy
 from django.contrib import messages
 from django.contrib.auth.decorators import user_passes_test
 from django.views.generic.edit import FormView
+from smuggler.compression import get_compression
+from smuggler.dry_run import dry_run_fixtures
 from smuggler.forms import ImportForm
+from smuggler.jobs import DONE, Job, start_dump, start_load
+from smuggler.manifest import read_manifest
 from smuggler import settings
+from smuggler.uploads import Upload
 from smuggler.utils import (save_uploaded_file_on_disk, serialize_to_response,
-                            load_fixtures)
+                            get_model_filter, iter_file, load_fixtures,
+                            load_fixtures_in_parallel, parse_range,
+                            parse_since, StreamingHttpResponse)
 
 
 def dump_to_response(request, app_label=[], exclude=[], filename_prefix=None):
     """Utility function that dumps the given app/model to an HttpResponse.
+
+    The dump is compressed with ``SMUGGLER_COMPRESSION`` or the compression
+    given in the ``compress`` query parameter. The ``since`` and
+    ``incremental`` query parameters make a dump of the rows that changed
+    since a date or since the previous incremental dump. Models are read
+    from the database in the ``database`` query parameter,
+    ``SMUGGLER_DUMP_DATABASE`` or the one the routers pick for reading them.
+    With ``SMUGGLER_BACKGROUND_DUMPS`` or the ``background`` query parameter
+    the dump is written to ``SMUGGLER_FIXTURE_DIR`` by a background job
+    instead, and the user is redirected to the job's status page.
     """
     try:
+        compression = request.GET.get('compress',
+                                      settings.SMUGGLER_COMPRESSION)
+        if compression == 'none':
+            compression = None
         filename = '%s.%s' % (datetime.now().isoformat(),
                               settings.SMUGGLER_FORMAT)
+        if compression:
+            filename = '%s.%s' % (filename, get_compression(compression)[0])
         if filename_prefix:
             filename = '%s_%s' % (filename_prefix, filename)
         if not isinstance(app_label, list):
             app_label = [app_label]
-        response = serialize_to_response(app_label, exclude)
+        since = request.GET.get('since')
+        since = parse_since(since) if since else None
+        incremental = 'incremental' in request.GET
+        using = request.GET.get('database') or \
+            settings.SMUGGLER_DUMP_DATABASE
+        if 'background' in request.GET or settings.SMUGGLER_BACKGROUND_DUMPS:
+            job = start_dump(app_label, exclude, filename, compression,
+                             since, incremental, using)
+            return HttpResponseRedirect(
+                reverse('job-status', kwargs={'job_id': job.id}))
+        response = serialize_to_response(app_label, exclude,
+                                         compression=compression,
+                                         since=since,
+                                         incremental=incremental,
+                                         using=using)
         response['Content-Disposition'] = 'attachment; filename=%s' % filename
         return response
-    except CommandError as e:
+    except (CommandError, ImproperlyConfigured) as e:
         messages.error(
             request,
             _('An exception occurred while dumping data: %s') % force_text(e))
@@ -81,6 +122,175 @@ def dump_model_data(request, app_label, model_label):
                             [], '-'.join((app_label, model_label)))
 
 
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), content_type='application/json',
+                        status=status)
+
+
+def get_job_or_404(job_id):
+    try:
+        return Job.get(job_id)
+    except (Job.DoesNotExist, ImproperlyConfigured):
+        raise Http404
+
+
+@user_passes_test(is_superuser)
+def job_status(request, job_id):
+    """Shows the status of a background job.
+
+    The page reloads itself until the job is finished. With ``format=json``
+    the status is returned as JSON, for polling from scripts.
+    """
+    job = get_job_or_404(job_id)
+    if request.GET.get('format') == 'json':
+        return json_response(job.as_dict())
+    return render(request, 'smuggler/job_status.html', {
+        'job': job,
+        'done': job.status == DONE,
+    })
+
+
+@user_passes_test(is_superuser)
+def job_manifest(request, job_id):
+    """Returns the manifest of the file written by a finished dump job.
+    """
+    job = get_job_or_404(job_id)
+    if job.kind != 'dump' or job.status != DONE:
+        raise Http404
+    manifest = read_manifest(os.path.join(settings.SMUGGLER_FIXTURE_DIR,
+                                          job.result['filename']))
+    if manifest is None:
+        raise Http404
+    return json_response(manifest)
+
+
+def etag_matches(etag, header):
+    """Tells whether an ``If-None-Match`` or ``If-Range`` header matches an
+    ETag, comparing weak ETags as strong ones.
+    """
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [
+        tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+@user_passes_test(is_superuser)
+def job_download(request, job_id):
+    """Downloads the file written by a finished dump job.
+
+    Downloads can be resumed with ``Range`` requests and revalidated with
+    ``If-None-Match``, the ETag is the SHA-1 of the dump.
+    """
+    job = get_job_or_404(job_id)
+    if job.kind != 'dump' or job.status != DONE:
+        raise Http404
+    path = os.path.join(settings.SMUGGLER_FIXTURE_DIR,
+                        job.result['filename'])
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        raise Http404
+    etag = None
+    if 'sha1' in job.result:  # jobs of older versions have no ETag
+        etag = '"%s"' % job.result['sha1']
+    if etag and etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH',
+                                                    '')):
+        fp.close()
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    size = os.fstat(fp.fileno()).st_size
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range or (etag and etag_matches(etag, if_range)):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            fp.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+    if byte_range is None:
+        response = StreamingHttpResponse(
+            iter_file(fp), content_type=job.result['content_type'])
+        response['Content-Length'] = size
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            iter_file(fp, first, last - first + 1),
+            content_type=job.result['content_type'], status=206)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    if etag:
+        response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = ('attachment; filename=%s' %
+                                       job.result['filename'])
+    return response
+
+
+def upload_response(upload, status=200, **extra):
+    """Returns the state of a chunked upload and the URL its parts are sent
+    to.
+    """
+    data = upload.as_dict()
+    data['url'] = reverse('upload-part', kwargs={'upload_id': upload.id})
+    data.update(extra)
+    return json_response(data, status=status)
+
+
+def get_upload_or_404(upload_id):
+    try:
+        return Upload.get(upload_id)
+    except (Upload.DoesNotExist, ImproperlyConfigured):
+        raise Http404
+
+
+@user_passes_test(is_superuser)
+def start_upload(request):
+    """Starts a chunked upload of the fixture named ``filename`` that is
+    ``size`` bytes long.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not settings.SMUGGLER_FIXTURE_DIR:
+        raise Http404
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return json_response({'error': 'Invalid size.'}, status=400)
+    try:
+        upload = Upload.create(request.POST.get('filename'), size)
+    except ValueError as e:
+        return json_response({'error': force_text(e)}, status=400)
+    return upload_response(upload, status=201)
+
+
+@user_passes_test(is_superuser)
+def upload_part(request, upload_id):
+    """Returns the state of a chunked upload, appends a part to it or
+    cancels it.
+
+    A part is the body of a POST request with its ``offset`` and ``sha1`` in
+    the query string. Parts that do not start where the upload stopped are
+    refused with the state of the upload, from which clients resume.
+    """
+    upload = get_upload_or_404(upload_id)
+    if request.method == 'DELETE':
+        upload.delete()
+        return HttpResponse(status=204)
+    if request.method == 'POST':
+        if request.GET.get('offset') != str(upload.offset):
+            return upload_response(upload, status=409)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            upload.append(request, length, request.GET.get('sha1', ''))
+        except ValueError as e:
+            return upload_response(upload, status=400, error=force_text(e))
+    elif request.method != 'GET':
+        return HttpResponseNotAllowed(['GET', 'POST', 'DELETE'])
+    return upload_response(upload)
+
+
 class AdminFormMixin(object):
     def get_context_data(self, **kwargs):
         context = super(AdminFormMixin, self).get_context_data(
@@ -104,29 +314,68 @@ class LoadDataView(AdminFormMixin, FormView):
     template_name = 'smuggler/load_data_form.html'
     success_url = '.'
 
+    def get_form_kwargs(self):
+        kwargs = super(LoadDataView, self).get_form_kwargs()
+        kwargs.update({
+            'query': self.request.GET.get('q', ''),
+            'page': self.request.GET.get('page', 1),
+        })
+        return kwargs
+
     def form_valid(self, form):
         uploads = form.cleaned_data.get('uploads', [])
+        chunked_uploads = form.cleaned_data.get('chunked_uploads', [])
         store = form.cleaned_data.get('store', False)
         picked_files = form.cleaned_data.get('picked_files', [])
+        include = form.cleaned_data.get('include_models', [])
+        exclude = form.cleaned_data.get('exclude_models', [])
+        dry_run = form.cleaned_data.get('dry_run')
         fixtures = []
-        tmp_fixtures = []
         for upload in uploads:
-            file_name = upload.name
             if store:  # Store the file in SMUGGLER_FIXTURE_DIR
                 destination_path = os.path.join(
-                    settings.SMUGGLER_FIXTURE_DIR, file_name)
+                    settings.SMUGGLER_FIXTURE_DIR, upload.name)
                 save_uploaded_file_on_disk(upload, destination_path)
-            else:  # Store the file in a tmp file
-                prefix, suffix = os.path.splitext(file_name)
-                destination_path = tempfile.mkstemp(
-                    suffix=suffix, prefix=prefix + '_')[1]
-                save_uploaded_file_on_disk(upload, destination_path)
-                tmp_fixtures.append(destination_path)
-            fixtures.append(destination_path)
+            # Uploads are loaded straight from memory or their temporary file
+            fixtures.append(upload)
+        staged_uploads = []
+        for upload in chunked_uploads:
+            if store:  # Move the file to SMUGGLER_FIXTURE_DIR
+                destination_path = os.path.join(
+                    settings.SMUGGLER_FIXTURE_DIR, upload.filename)
+                os.rename(upload.path, destination_path)
+                upload.delete()
+                fixtures.append(destination_path)
+            else:
+                fixtures.append(upload.path)
+                staged_uploads.append(upload)
         for file_name in picked_files:
             fixtures.append(file_name)
+        if form.cleaned_data.get('background', False):
+            job = start_load(fixtures, uploads=[
+                upload.id for upload in staged_uploads],
+                include=include, exclude=exclude, dry_run=dry_run)
+            return HttpResponseRedirect(
+                reverse('job-status', kwargs={'job_id': job.id}))
+        try:
+            if dry_run:
+                self.dry_run(fixtures, dry_run,
+                             get_model_filter(include, exclude))
+            else:
+                self.load(fixtures, get_model_filter(include, exclude))
+        finally:
+            for upload in staged_uploads:
+                upload.delete()
+        return super(LoadDataView, self).form_valid(form)
+
+    def load(self, fixtures, model_filter=None):
+        """Loads fixtures in the request and reports the result.
+        """
+        if settings.SMUGGLER_LOAD_WORKERS > 1 and len(fixtures) > 1:
+            self.load_in_parallel(fixtures, model_filter)
+            return
         try:
-            obj_count = load_fixtures(fixtures)
+            obj_count = load_fixtures(fixtures, model_filter=model_filter)
             user_msg = ' '.join([
                 ungettext_lazy(
                     'Successfully imported %(count)d file.',
@@ -144,18 +393,106 @@ class LoadDataView(AdminFormMixin, FormView):
             messages.error(
                 self.request,
                 _('An exception occurred while loading data: %s') % str(e))
-        finally:
-            # Remove our tmp files
-            for tmp_file in tmp_fixtures:
-                os.unlink(tmp_file)
-        return super(LoadDataView, self).form_valid(form)
+
+    def dry_run(self, fixtures, mode, model_filter=None):
+        """Checks fixtures without loading them and reports what was found.
+        """
+        report = dry_run_fixtures(fixtures, mode, model_filter=model_filter)
+        summary = ' '.join([
+            ungettext_lazy(
+                'Dry run of %(count)d file.',
+                'Dry run of %(count)d files.',
+                report.fixture_count
+            ) % {'count': report.fixture_count},
+            ungettext_lazy(
+                'Read %(count)d object.',
+                'Read %(count)d objects.',
+                report.object_count
+            ) % {'count': report.object_count},
+            ungettext_lazy(
+                'Found %(count)d error.',
+                'Found %(count)d errors.',
+                report.error_count
+            ) % {'count': report.error_count}])
+        if report.is_valid:
+            messages.info(self.request, summary)
+        else:
+            messages.error(self.request, summary)
+        if report.models:
+            messages.info(self.request, _('Objects per model: %s') % ', '.join(
+                '%s: %d' % item for item in sorted(report.models.items())))
+        rates = []
+        if report.parse_rate is not None:
+            rates.append(_('read %(rate)d objects/s') % {
+                'rate': report.parse_rate})
+        if report.insert_rate is not None:
+            rates.append(_('saved %(rate)d objects/s') % {
+                'rate': report.insert_rate})
+        if rates:
+            messages.info(self.request,
+                          _('Throughput: %s') % ', '.join(rates))
+        for error in report.errors:
+            if error['position'] is not None:
+                message = _('%(name)s, object %(position)d: %(error)s') % error
+            elif error['name']:
+                message = '%(name)s: %(error)s' % error
+            else:  # The constraint checks failed
+                message = error['error']
+            messages.error(self.request, message)
+        for warning in report.warnings:
+            messages.warning(self.request, _(
+                '%(name)s, object %(position)d: %(error)s') % warning)
+
+    def load_in_parallel(self, fixtures, model_filter=None):
+        """Loads independent fixtures concurrently and reports the result of
+        each fixture.
+        """
+        try:
+            results = load_fixtures_in_parallel(
+                fixtures, workers=settings.SMUGGLER_LOAD_WORKERS,
+                model_filter=model_filter)
+        except DeserializationError as e:
+            messages.error(
+                self.request,
+                _('An exception occurred while loading data: %s') % str(e))
+            return
+        loaded = [result for result in results
+                  if result['status'] == 'loaded']
+        if loaded:
+            obj_count = sum(result['object_count'] for result in loaded)
+            messages.info(self.request, ' '.join([
+                ungettext_lazy(
+                    'Successfully imported %(count)d file.',
+                    'Successfully imported %(count)d files.',
+                    len(loaded)
+                ) % {'count': len(loaded)},
+                ungettext_lazy(
+                    'Loaded %(count)d object.',
+                    'Loaded %(count)d objects.',
+                    obj_count
+                ) % {'count': obj_count}]))
+        for result in results:
+            if result['status'] == 'failed':
+                messages.error(
+                    self.request,
+                    _('An exception occurred while loading %(name)s: '
+                      '%(error)s') % result)
+            elif result['status'] == 'rolled back':
+                messages.warning(
+                    self.request,
+                    _('%(name)s was not loaded because a file it was loaded'
+                      ' with failed.') % result)
 
     def get_fieldsets(self, form):
         fields = form.fields.keys()
         if 'picked_files' in fields:
             return [
-                (_('Upload'), {'fields': ['uploads', 'store']}),
-                (_('From fixture directory'), {'fields': ['picked_files']})
+                (_('Upload'), {'fields': ['uploads', 'chunked_uploads',
+                                          'store']}),
+                (_('From fixture directory'), {'fields': ['picked_files']}),
+                (_('Models'), {'fields': ['include_models',
+                                          'exclude_models']}),
+                (_('Options'), {'fields': ['background', 'dry_run']})
             ]
         return [(None, {'fields': fields})]
 
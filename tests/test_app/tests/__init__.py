@@ -3,14 +3,32 @@ from .test_admin import TestAdminNormalUser, TestAdminSuperUser
 from .test_auth import (TestSmugglerViewsAllowsSuperuser,
                         TestSmugglerViewsDeniesNonSuperuser,
                         TestSmugglerViewsRequireAuthentication)
-from .test_dump import BasicDumpTestCase
-from .test_forms import TestForm
-from .test_load import TestInvalidLoad, SimpleLoadTestCase
+from .test_compression import TestCompression
+from .test_databases import (TestDatabaseRouting, TestDumpDatabase,
+                             TestDumpSnapshot)
+from .test_dry_run import TestArchiveDryRun, TestDryRun
+from .test_dump import (BasicDumpTestCase, DeltaDumpTestCase,
+                        ManifestTestCase, ParallelDumpTestCase)
+from .test_fixture_index import TestFixtureIndex
+from .test_forms import TestFixtureDirForm, TestForm
+from .test_jobs import TestJobs
+from .test_native import TestNativeCopy
+from .test_load import (TestInvalidLoad, SimpleLoadTestCase, BulkLoadTestCase,
+                        FilteredLoadTestCase, ParallelLoadTestCase,
+                        ResumableLoadTestCase)
+from .test_serializers import (TestColumnarSerializer, TestJSONArrayReader,
+                               TestJSONDeserializer, TestJSONLinesSerializer,
+                               TestMessagePackSerializer,
+                               TestSerializerRegistration)
 from .test_urls import TestSmugglerUrls
-from .test_utils import TestSaveUploadedFileOnDisk
-from .test_views import (TestDumpData,
+from .test_utils import (TestModelFilter, TestParseRange,
+                         TestSaveUploadedFileOnDisk)
+from .test_views import (TestChunkedUpload,
+                         TestDumpData,
                          TestDumpHandlesErrorsGracefully,
+                         TestDumpInBackground,
                          TestDumpViewsGenerateDownloadsWithSaneFilenames,
+                         TestLoadDataFromFixtureDir,
                          TestLoadDataGet,
                          TestLoadDataPost)
 
@@ -21,15 +39,43 @@ __tests__ = [
     TestSmugglerViewsAllowsSuperuser,
     TestSmugglerViewsDeniesNonSuperuser,
     TestSmugglerViewsRequireAuthentication,
+    TestCompression,
+    TestDatabaseRouting,
+    TestDumpDatabase,
+    TestDumpSnapshot,
+    TestArchiveDryRun,
+    TestDryRun,
     BasicDumpTestCase,
+    DeltaDumpTestCase,
+    ManifestTestCase,
+    ParallelDumpTestCase,
+    TestFixtureIndex,
+    TestFixtureDirForm,
     TestForm,
+    TestJobs,
     TestInvalidLoad,
     SimpleLoadTestCase,
+    BulkLoadTestCase,
+    FilteredLoadTestCase,
+    ParallelLoadTestCase,
+    ResumableLoadTestCase,
+    TestNativeCopy,
+    TestColumnarSerializer,
+    TestJSONArrayReader,
+    TestJSONDeserializer,
+    TestJSONLinesSerializer,
+    TestMessagePackSerializer,
+    TestSerializerRegistration,
     TestSmugglerUrls,
+    TestModelFilter,
+    TestParseRange,
     TestSaveUploadedFileOnDisk,
+    TestChunkedUpload,
     TestDumpData,
     TestDumpHandlesErrorsGracefully,
+    TestDumpInBackground,
     TestDumpViewsGenerateDownloadsWithSaneFilenames,
+    TestLoadDataFromFixtureDir,
     TestLoadDataGet,
     TestLoadDataPost
 ]
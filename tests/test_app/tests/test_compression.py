@@ -0,0 +1,60 @@
+import bz2
+import zlib
+from unittest import TestCase, skipIf
+from django.core.serializers.base import DeserializationError
+from django.utils.six import BytesIO
+from smuggler import compression
+
+
+DATA = ('[%s]' % ', '.join(['{"pk": %d}' % i for i in range(10000)])
+        ).encode('ascii')
+
+
+class TestCompression(TestCase):
+    def assertRoundTrip(self, name, extension):
+        compressed = b''.join(compression.iter_compressed(
+            [DATA[i:i + 1000] for i in range(0, len(DATA), 1000)], name))
+        stream = compression.open_compressed(BytesIO(compressed), extension)
+        self.assertEqual(stream.read(), DATA)
+
+    def test_gzip_round_trip(self):
+        self.assertRoundTrip('gzip', 'gz')
+
+    @skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_zstd_round_trip(self):
+        self.assertRoundTrip('zstd', 'zst')
+
+    def test_unknown_compression(self):
+        self.assertRaises(Exception, compression.get_compression, 'rar')
+
+    def test_split_compression(self):
+        self.assertEqual(compression.split_compression('dump.json.GZ'),
+                         ('dump.json', 'gz'))
+        self.assertEqual(compression.split_compression('dump.json'),
+                         ('dump.json', None))
+
+    def test_decompress_in_small_reads(self):
+        stream = compression.open_compressed(
+            BytesIO(bz2.compress(DATA)), 'bz2')
+        chunks = []
+        chunk = stream.read(100)
+        while chunk:
+            self.assertTrue(len(chunk) <= 100)
+            chunks.append(chunk)
+            chunk = stream.read(100)
+        self.assertTrue(b''.join(chunks) == DATA)
+
+    @skipIf(compression.lzma is None, 'lzma is not available')
+    def test_decompress_xz(self):
+        stream = compression.open_compressed(
+            BytesIO(compression.lzma.compress(DATA)), 'xz')
+        self.assertEqual(stream.read(), DATA)
+
+    def test_invalid_compressed_data(self):
+        stream = compression.open_compressed(
+            BytesIO(zlib.compress(DATA)), 'gz')
+        self.assertRaises(DeserializationError, stream.read)
+
+    def test_invalid_zip_archive(self):
+        self.assertRaises(DeserializationError, compression.open_compressed,
+                          BytesIO(DATA), 'zip')
@@ -0,0 +1,135 @@
+import json
+import os.path
+from django.contrib.sites.models import Site
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.db import connections, router
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import reload_module
+from smuggler import settings, utils
+from smuggler.utils import get_write_databases, load_fixtures, serialize_chunks
+from tests.test_app.models import Page
+from tests.test_app.tests.test_views import SuperUserTestCase
+
+
+p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               *args))
+
+
+class TestAppRouter(object):
+    """Routes the models of test_app to the 'other' database.
+    """
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'test_app':
+            return 'other'
+        return None
+
+    db_for_write = db_for_read
+
+
+class RoutedTestCase(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        super(RoutedTestCase, self).setUp()
+        self.routers = router.routers
+        router.routers = [TestAppRouter()]
+
+    def tearDown(self):
+        router.routers = self.routers
+        super(RoutedTestCase, self).tearDown()
+
+
+class TestDatabaseRouting(RoutedTestCase):
+    def dump(self, app_labels, using=None):
+        return json.loads(b''.join(force_bytes(chunk) for chunk in
+                                   serialize_chunks(app_labels, using=using))
+                          .decode('utf-8'))
+
+    def test_write_databases(self):
+        self.assertEqual(['default', 'other'], get_write_databases())
+        self.assertEqual(['other'], get_write_databases('other'))
+
+    def test_load_routes_models(self):
+        count = load_fixtures([
+            p('..', 'smuggler_fixtures', 'all_dump.json')])
+        self.assertEqual(2, count)
+        self.assertEqual(1, Page.objects.using('other').count())
+        self.assertEqual(0, Page.objects.using('default').count())
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+
+    def test_load_into_database(self):
+        load_fixtures([p('..', 'smuggler_fixtures', 'page_dump.json')],
+                      using='default')
+        self.assertEqual(0, Page.objects.using('other').count())
+        self.assertEqual(1, Page.objects.using('default').count())
+
+    def test_dump_routes_models(self):
+        Page.objects.using('other').create(title='other', path='/other/')
+        Page.objects.using('default').create(title='default', path='/')
+        self.assertEqual(['other'], [obj['fields']['title']
+                                     for obj in self.dump(['test_app'])])
+        self.assertEqual(['default'], [
+            obj['fields']['title']
+            for obj in self.dump(['test_app'], using='default')])
+
+    def test_dump_unknown_database(self):
+        self.assertRaises(CommandError, serialize_chunks, ['sites'],
+                          using='unknown')
+
+
+class TestDumpSnapshot(TransactionTestCase):
+    def test_dump_in_transaction(self):
+        connection = connections['default']
+        chunks = serialize_chunks(['sites'])
+        next(chunks)
+        self.assertTrue(connection.in_atomic_block)
+        list(chunks)
+        self.assertFalse(connection.in_atomic_block)
+
+    def test_snapshot_statement(self):
+        utils.SNAPSHOT_SQL['sqlite'] = 'SELECT 1'
+        try:
+            with CaptureQueriesContext(connections['default']) as queries:
+                list(serialize_chunks(['sites']))
+        finally:
+            del utils.SNAPSHOT_SQL['sqlite']
+        self.assertIn('SELECT 1', [query['sql'] for query in queries
+                                   if 'BEGIN' not in query['sql']][0])
+
+
+class TestDumpDatabase(SuperUserTestCase, RoutedTestCase):
+    def tearDown(self):
+        super(TestDumpDatabase, self).tearDown()
+        reload_module(settings)
+
+    def test_dump_database_setting(self):
+        Page.objects.using('default').create(title='default', path='/')
+        with self.settings(SMUGGLER_DUMP_DATABASE='default'):
+            reload_module(settings)
+            response = self.c.get(reverse('dump-model-data', kwargs={
+                'app_label': 'test_app', 'model_label': 'page'}))
+            content = b''.join(response.streaming_content)
+        self.assertEqual(['default'], [
+            obj['fields']['title']
+            for obj in json.loads(content.decode('utf-8'))])
+
+    def test_dump_database(self):
+        Page.objects.using('default').create(title='default', path='/')
+        response = self.c.get(reverse('dump-model-data', kwargs={
+            'app_label': 'test_app', 'model_label': 'page'}),
+            {'database': 'default'})
+        content = b''.join(response.streaming_content)
+        self.assertEqual(['default'], [
+            obj['fields']['title']
+            for obj in json.loads(content.decode('utf-8'))])
+
+    def test_dump_unknown_database(self):
+        response = self.c.get(reverse('dump-data'), {'database': 'unknown'},
+                              follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual('An exception occurred while dumping data: '
+                         'Unknown database: unknown',
+                         response_messages[0].message)
@@ -0,0 +1,165 @@
+import json
+import os.path
+import shutil
+import tempfile
+from django.contrib.auth.models import Group, User
+from django.contrib.sites.models import Site
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import reload_module
+from smuggler import settings
+from smuggler.dry_run import DryRun, dry_run_fixtures, PARSE, ROLLBACK
+from smuggler.utils import ModelFilter, serialize_chunks
+from tests.test_app.models import Page
+
+
+p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               *args))
+
+
+class TestDryRun(TestCase):
+    def assertNothingLoaded(self):
+        self.assertEqual(0, Page.objects.count())
+        self.assertEqual('example.com', Site.objects.get(pk=1).name)
+
+    def test_parse(self):
+        report = dry_run_fixtures(
+            [p('..', 'smuggler_fixtures', 'all_dump.json')], PARSE)
+        self.assertTrue(report.is_valid)
+        self.assertEqual({'sites.site': 1, 'test_app.page': 1},
+                         report.models)
+        self.assertEqual(2, report.object_count)
+        self.assertEqual(0, report.inserted)
+        self.assertTrue(report.parse_rate > 0)
+        self.assertEqual(None, report.insert_rate)
+        self.assertNothingLoaded()
+
+    def test_rollback(self):
+        report = dry_run_fixtures(
+            [p('..', 'smuggler_fixtures', 'all_dump.json'),
+             p('..', 'smuggler_fixtures', 'page_dump.json.gz')], ROLLBACK)
+        self.assertEqual([], report.errors)
+        self.assertEqual(2, report.fixture_count)
+        self.assertEqual(3, report.inserted)
+        self.assertTrue(report.insert_rate > 0)
+        self.assertNothingLoaded()
+
+    def test_rollback_reports_failed_objects(self):
+        path = p('..', 'smuggler_fixtures', 'garbage',
+                 'invalid_page_dump.json')
+        for bulk in (False, True):
+            report = DryRun(ROLLBACK, bulk=bulk).run([path])
+            self.assertFalse(report.is_valid)
+            self.assertEqual(1, report.error_count)
+            self.assertEqual('invalid_page_dump.json',
+                             report.errors[0]['name'])
+            self.assertEqual(2, report.errors[0]['position'])
+            self.assertEqual(1, report.inserted)
+            self.assertNothingLoaded()
+
+    def test_parse_error(self):
+        report = dry_run_fixtures(
+            [p('..', 'smuggler_fixtures', 'garbage', 'garbage.json'),
+             SimpleUploadedFile('fixture.txt', b'')])
+        self.assertEqual(2, report.error_count)
+        self.assertEqual(('garbage.json', 1), (report.errors[0]['name'],
+                                               report.errors[0]['position']))
+        self.assertEqual(('fixture.txt', None), (report.errors[1]['name'],
+                                                 report.errors[1]['position']))
+
+    def test_max_errors(self):
+        path = p('..', 'smuggler_fixtures', 'garbage', 'garbage.json')
+        report = dry_run_fixtures([path, path], max_errors=1)
+        self.assertEqual(2, report.error_count)
+        self.assertEqual(1, len(report.errors))
+
+    def test_model_filter(self):
+        report = dry_run_fixtures(
+            [p('..', 'smuggler_fixtures', 'all_dump.json')],
+            model_filter=ModelFilter(include=['sites']))
+        self.assertEqual({'sites.site': 1}, report.models)
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, DryRun, 'commit')
+
+    def natural_key_fixture(self, format='json'):
+        """Returns a dump of groups and users that refer to them by natural
+        key, which are deleted.
+        """
+        for name in ('editors', 'readers', 'writers'):
+            group = Group.objects.create(name=name)
+            User.objects.create(username=name).groups.add(group)
+        data = b''.join(force_bytes(chunk) for chunk in serialize_chunks(
+            ['auth.group', 'auth.user'], format=format))
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        return data
+
+    def test_natural_keys(self):
+        for format in ('json', 'jsonl', 'xml'):
+            data = self.natural_key_fixture(format)
+            for mode in (PARSE, ROLLBACK):
+                for bulk in (False, True):
+                    report = DryRun(mode, bulk=bulk, batch_size=2).run(
+                        [SimpleUploadedFile('auth.%s' % format, data)])
+                    self.assertEqual([], report.errors)
+                    if format == 'xml' and mode == PARSE:
+                        # Django's deserializer looks the groups up
+                        self.assertEqual(4, report.warnings[0]['position'])
+                        continue
+                    self.assertEqual([], report.warnings)
+                    self.assertEqual({'auth.group': 3, 'auth.user': 3},
+                                     report.models)
+                    if mode == ROLLBACK:
+                        self.assertEqual(6, report.inserted)
+            self.assertEqual(0, Group.objects.count())
+
+    def test_parse_missing_natural_key(self):
+        fixture = SimpleUploadedFile('users.json', json.dumps([{
+            'model': 'auth.user', 'pk': 1,
+            'fields': {'username': 'user', 'groups': [['missing']]}}]
+        ).encode('utf-8'))
+        report = dry_run_fixtures([fixture], PARSE)
+        self.assertEqual(1, report.error_count)
+        self.assertEqual(1, report.errors[0]['position'])
+
+
+class TestArchiveDryRun(TestCase):
+    def setUp(self):
+        with self.settings(SMUGGLER_COPY_MODELS=['test_app.Page']):
+            reload_module(settings)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'dump.smuggler')
+        Page.objects.create(title='Home', path='home', body='Welcome')
+        Page.objects.create(title='About', path='about', body='About')
+        with open(self.path, 'wb') as fp:
+            for chunk in serialize_chunks(['sites', 'test_app'],
+                                          format='smuggler'):
+                fp.write(chunk)
+
+    def tearDown(self):
+        reload_module(settings)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        Page.objects.all().delete()
+        report = dry_run_fixtures([self.path], PARSE)
+        self.assertEqual([], report.errors)
+        self.assertEqual({'sites.site': 1, 'test_app.page': 2},
+                         report.models)
+        self.assertEqual(0, Page.objects.count())
+
+    def test_rollback(self):
+        Page.objects.all().delete()
+        report = dry_run_fixtures([self.path], ROLLBACK)
+        self.assertEqual([], report.errors)
+        self.assertEqual(3, report.inserted)
+        self.assertEqual(0, Page.objects.count())
+
+    def test_rollback_reports_copy_errors(self):
+        # The copied rows conflict with the existing pages
+        report = dry_run_fixtures([self.path], ROLLBACK)
+        self.assertFalse(report.is_valid)
+        self.assertEqual(0, report.inserted)
+        self.assertEqual(2, Page.objects.count())
@@ -1,9 +1,28 @@
+import datetime
+import gzip
 import json
-from django.utils.six import StringIO
+import multiprocessing
+import os.path
+import shutil
+import tempfile
+import django
+from django.contrib.auth.models import User
+from django.utils.six import BytesIO, StringIO
+from django.contrib.sites.models import Site
+from django.core import serializers
 from django.core.management import CommandError
+from django.db import connections, DEFAULT_DB_ALIAS, transaction
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import reload_module
+from multiprocessing.pool import ThreadPool
+from unittest import skipIf
 from tests.test_app.models import Page
-from smuggler import utils
+import smuggler
+from smuggler import settings, utils
+from smuggler.manifest import DumpManifest
+from smuggler.serializers import columnar, msgpack_version
 
 
 class BasicDumpTestCase(TestCase):
@@ -49,3 +68,331 @@ class BasicDumpTestCase(TestCase):
     def test_serialize_unknown_app_fail(self):
         self.assertRaises(CommandError, utils.serialize_to_response,
                           ['flatpages'])
+
+    def test_serialize_unknown_model_fail(self):
+        self.assertRaises(CommandError, utils.serialize_to_response,
+                          ['sites.unknown'])
+
+    def test_serialize_to_streaming_response(self):
+        response = utils.serialize_to_response(app_labels=['sites'])
+        out = self.normalize(b''.join(response.streaming_content))
+        self.assertEqual(out, self.SITE_DUMP)
+
+    def test_serialize_indent_matches_django_serializer(self):
+        stream = StringIO()
+        utils.serialize_to_response(app_labels=['sites', 'test_app'],
+                                    response=stream, indent=2)
+        self.assertEqual(stream.getvalue(), serializers.serialize(
+            'json', list(Site.objects.all()) + list(Page.objects.all()),
+            indent=2))
+
+    def test_serialize_uses_compact_separators(self):
+        stream = StringIO()
+        utils.serialize_to_response(app_labels=['sites', 'test_app'],
+                                    response=stream)
+        out = stream.getvalue()
+        self.assertNotIn(', ', out)
+        self.assertNotIn(': ', out)
+        self.assertEqual(self.normalize(out), self.BASIC_DUMP)
+
+    def test_serialize_jsonl(self):
+        stream = StringIO()
+        utils.serialize_to_response(app_labels=['sites', 'test_app'],
+                                    response=stream, format='jsonl')
+        out = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(out, self.BASIC_DUMP)
+
+    def test_serialize_compressed(self):
+        response = utils.serialize_to_response(app_labels=['sites'],
+                                               compression='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        out = gzip.GzipFile(fileobj=BytesIO(
+            b''.join(response.streaming_content))).read()
+        self.assertEqual(self.normalize(out.decode('utf-8')), self.SITE_DUMP)
+
+    def test_serialize_unknown_compression_fail(self):
+        self.assertRaises(CommandError, utils.serialize_to_response,
+                          ['sites'], compression='rar')
+
+    def test_iter_dump_objects_uses_keyset_pages(self):
+        for i in range(2, 6):
+            Page(title='test', path='test-%d' % i, body='test body').save()
+        with self.assertNumQueries(3):
+            objects = list(utils.iter_dump_objects([Page], chunk_size=2))
+        self.assertEqual([obj.pk for obj in objects],
+                         list(Page.objects.values_list('pk', flat=True)))
+
+    def test_iter_dump_objects_exact_pages(self):
+        Page(title='test', path='test-2', body='test body').save()
+        with self.assertNumQueries(2):
+            objects = list(utils.iter_dump_objects([Page], chunk_size=2))
+        self.assertEqual(len(objects), 2)
+
+    def test_iter_json_yields_chunks(self):
+        for i in range(2, 5):
+            Page(title='test', path='test-%d' % i, body='test body').save()
+        chunks = list(utils.iter_json(Page.objects.all(), chunk_size=2))
+        self.assertEqual(len(self.normalize(''.join(chunks))), 4)
+        self.assertEqual(len(chunks), 4)
+
+
+def share_connection(conn):
+    # The in-memory test database is only reachable through its connection
+    conn.allow_thread_sharing = True
+    setattr(connections._connections, DEFAULT_DB_ALIAS, conn)
+
+
+def get_transaction_state(using):
+    with transaction.atomic(using=using):
+        connection = connections[using]
+        return connection.in_atomic_block, connection.get_autocommit()
+
+
+class ParallelDumpTestCase(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Page.objects.create(title='test %d' % i, path='/%d/' % i,
+                                body='test body')
+        self.pool = ThreadPool(1, share_connection,
+                               (connections[DEFAULT_DB_ALIAS],))
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def dump(self, format, indent=None, pool=None):
+        model_list = utils.get_dump_models(['sites', 'test_app', 'auth'])
+        if pool is None:
+            chunks = utils.iter_serialized(
+                utils.iter_dump_objects(model_list), format, indent)
+            return b''.join(force_bytes(chunk) for chunk in chunks)
+        return b''.join(utils.iter_parallel_dump(
+            model_list, format=format, indent=indent, pool=pool))
+
+    def test_parallel_json_matches_serial(self):
+        self.assertEqual(self.dump('json'), self.dump('json', pool=self.pool))
+
+    def test_parallel_indented_json_matches_serial(self):
+        self.assertEqual(self.dump('json', 2),
+                         self.dump('json', 2, pool=self.pool))
+
+    def test_parallel_jsonl_matches_serial(self):
+        self.assertEqual(self.dump('jsonl'),
+                         self.dump('jsonl', pool=self.pool))
+
+    @skipIf(msgpack_version is None, 'msgpack is not installed')
+    def test_parallel_msgpack_matches_serial(self):
+        self.assertEqual(self.dump('msgpack'),
+                         self.dump('msgpack', pool=self.pool))
+
+    def test_worker_forked_in_transaction(self):
+        # Test cases run in a transaction, like dumps in iter_in_snapshot
+        pool = multiprocessing.Pool(1, utils.init_dump_worker)
+        try:
+            self.assertEqual((True, False), pool.apply(
+                get_transaction_state, (DEFAULT_DB_ALIAS,)))
+        finally:
+            pool.terminate()
+
+    def test_part_is_read_in_transaction(self):
+        # Test cases run in a transaction, the part's is a savepoint in it
+        connection = connections[DEFAULT_DB_ALIAS]
+        depths = []
+
+        def read(objects, depth):
+            for obj in objects:
+                depths.append(len(connection.savepoint_ids) - depth)
+                yield obj
+
+        def iter_dump_objects(*args, **kwargs):
+            return read(original(*args, **kwargs),
+                        len(connection.savepoint_ids))
+        original, utils.iter_dump_objects = (utils.iter_dump_objects,
+                                             iter_dump_objects)
+        try:
+            self.dump('jsonl', pool=self.pool)
+        finally:
+            utils.iter_dump_objects = original
+        self.assertTrue(depths)
+        self.assertTrue(all(depth == 1 for depth in depths))
+
+    def test_parallel_empty_dump(self):
+        self.assertEqual(b'[]', b''.join(utils.iter_parallel_dump(
+            [], format='json', pool=self.pool)))
+
+    def test_no_snapshot_without_postgresql(self):
+        self.assertEqual(None, utils.export_snapshot())
+
+    def test_formats_without_parts_are_dumped_serially(self):
+        chunks = utils.serialize_chunks(['sites'], format='xml', workers=4)
+        self.assertIn('<django-objects', ''.join(chunks))
+
+
+class ManifestTestCase(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Page.objects.create(title='test %d' % i, path='/%d/' % i,
+                                body='test body')
+
+    def assertOffsets(self, data, manifest):
+        text = data.decode('utf-8')
+        decoder = json.JSONDecoder()
+        for model in manifest.models:
+            offset = model['offset']
+            while text[offset].isspace():
+                offset += 1
+            obj = decoder.raw_decode(text, offset)[0]
+            self.assertEqual(model['model'], obj['model'])
+
+    def dump(self, format='json', indent=None, compression=None,
+             pool=None):
+        manifest = DumpManifest()
+        if pool is None:
+            chunks = utils.serialize_chunks(
+                ['sites', 'test_app'], format=format, indent=indent,
+                compression=compression, manifest=manifest)
+        else:
+            chunks = manifest.track(utils.iter_parallel_dump(
+                utils.get_dump_models(['sites', 'test_app']), format=format,
+                indent=indent, pool=pool, manifest=manifest))
+        return b''.join(force_bytes(chunk) for chunk in chunks), manifest
+
+    def test_manifest_counts(self):
+        data, manifest = self.dump()
+        self.assertEqual([('sites.site', 1), ('test_app.page', 5)],
+                         [(model['model'], model['count'])
+                          for model in manifest.models])
+        self.assertEqual(6, manifest.object_count)
+
+    def test_manifest_offsets(self):
+        self.assertOffsets(*self.dump())
+        self.assertOffsets(*self.dump(indent=2))
+        self.assertOffsets(*self.dump('jsonl'))
+
+    def test_manifest_columnar_offsets(self):
+        data, manifest = self.dump('columnar')
+        for model in manifest.models:
+            stream = BytesIO(data)
+            stream.seek(model['offset'])
+            self.assertEqual(model['model'], next(
+                columnar.read_objects_from(stream))['model'])
+
+    @skipIf(msgpack_version is None, 'msgpack is not installed')
+    def test_manifest_msgpack_offsets(self):
+        from smuggler.serializers import msgpack
+        data, manifest = self.dump('msgpack')
+        for model in manifest.models:
+            stream = BytesIO(data)
+            stream.seek(model['offset'])
+            self.assertEqual(model['model'], next(
+                msgpack.read_objects_from(stream))['model'])
+
+    def test_manifest_offsets_are_uncompressed(self):
+        data, manifest = self.dump(compression='gzip')
+        self.assertOffsets(gzip.GzipFile(fileobj=BytesIO(data)).read(),
+                           manifest)
+
+    def test_parallel_manifest(self):
+        pool = ThreadPool(1, share_connection,
+                          (connections[DEFAULT_DB_ALIAS],))
+        try:
+            data, manifest = self.dump(indent=2, pool=pool)
+        finally:
+            pool.terminate()
+        self.assertEqual(self.dump(indent=2)[1].models, manifest.models)
+        self.assertOffsets(data, manifest)
+
+    def test_manifest_without_offsets(self):
+        data, manifest = self.dump('xml')
+        self.assertEqual(6, manifest.object_count)
+        self.assertEqual(None, manifest.models[0]['offset'])
+
+    def test_manifest_versions(self):
+        versions = self.dump()[1].as_dict()['versions']
+        self.assertEqual(django.get_version(), versions['django'])
+        self.assertEqual(smuggler.get_version(), versions['smuggler'])
+
+
+class DeltaDumpTestCase(TestCase):
+    def setUp(self):
+        self.fixture_dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            SMUGGLER_FIXTURE_DIR=self.fixture_dir,
+            SMUGGLER_DELTA_FIELDS={'auth.User': 'date_joined'})
+        self.override.enable()
+        reload_module(settings)
+        for i in range(3):
+            Page.objects.create(title='test %d' % i, path='/%d/' % i,
+                                body='test body')
+
+    def tearDown(self):
+        self.override.disable()
+        reload_module(settings)
+        shutil.rmtree(self.fixture_dir)
+
+    def dump(self, app_labels, **kwargs):
+        chunks = utils.serialize_chunks(app_labels, format='json',
+                                        compression=None, **kwargs)
+        return [(obj['model'], obj['pk'])
+                for obj in json.loads(''.join(chunks))]
+
+    def test_incremental_dump_uses_primary_key_watermark(self):
+        self.assertEqual(3, len(self.dump(['test_app'], incremental=True)))
+        self.assertEqual([], self.dump(['test_app'], incremental=True))
+        page = Page.objects.create(title='new', path='/new/', body='new')
+        self.assertEqual([('test_app.page', page.pk)],
+                         self.dump(['test_app'], incremental=True))
+
+    def test_incremental_dump_uses_delta_field(self):
+        user = User.objects.create(username='first')
+        self.assertEqual([('auth.user', user.pk)],
+                         self.dump(['auth.user'], incremental=True))
+        # Rows at the watermark are dumped again
+        self.assertEqual([('auth.user', user.pk)],
+                         self.dump(['auth.user'], incremental=True))
+        user.date_joined -= datetime.timedelta(days=1)
+        user.save()
+        self.assertEqual([], self.dump(['auth.user'], incremental=True))
+
+    def test_incomplete_dump_keeps_watermarks(self):
+        chunks = utils.serialize_chunks(['test_app'], format='json',
+                                        compression=None, incremental=True)
+        next(chunks)
+        chunks.close()
+        self.assertEqual({}, utils.load_watermarks())
+        self.assertEqual(3, len(self.dump(['test_app'], incremental=True)))
+        self.assertEqual({'test_app.page': ['pk', 3]},
+                         utils.load_watermarks())
+
+    def test_watermarks_of_other_models_are_kept(self):
+        self.dump(['test_app'], incremental=True)
+        self.dump(['sites'], incremental=True)
+        self.assertEqual(['sites.site', 'test_app.page'],
+                         sorted(utils.load_watermarks()))
+
+    def test_dump_since(self):
+        old = User.objects.create(
+            username='old', date_joined=datetime.datetime(2015, 1, 1))
+        new = User.objects.create(
+            username='new', date_joined=datetime.datetime(2015, 3, 1))
+        since = utils.parse_since('2015-02-01')
+        self.assertEqual([('auth.user', new.pk)],
+                         self.dump(['auth.user'], since=since))
+        # Models without a delta field are dumped whole
+        self.assertEqual(3, len(self.dump(['test_app'], since=since)))
+        self.assertNotIn(('auth.user', old.pk),
+                         self.dump(['auth', 'test_app'], since=since))
+
+    def test_parse_since(self):
+        self.assertEqual(datetime.datetime(2015, 2, 1),
+                         utils.parse_since('2015-02-01'))
+        self.assertEqual(datetime.datetime(2015, 2, 1, 12, 30),
+                         utils.parse_since('2015-02-01T12:30'))
+        self.assertRaises(CommandError, utils.parse_since, 'yesterday')
+        self.assertRaises(CommandError, utils.parse_since, '2015-02-31')
+
+    def test_incremental_dump_requires_fixture_dir(self):
+        with self.settings(SMUGGLER_FIXTURE_DIR=None):
+            reload_module(settings)
+            self.assertRaises(Exception, utils.serialize_chunks,
+                              ['test_app'], incremental=True)
+        self.assertFalse(os.listdir(self.fixture_dir))
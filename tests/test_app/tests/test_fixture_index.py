@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from smuggler.fixture_index import FixtureIndex, get_fixture_index
+from smuggler.manifest import write_manifest
+
+
+class TestFixtureIndex(TestCase):
+    def setUp(self):
+        self.fixture_dir = tempfile.mkdtemp()
+        self.write('pages.json', [
+            {'model': 'test_app.page', 'pk': 1, 'fields': {}},
+            {'model': 'test_app.page', 'pk': 2, 'fields': {}},
+            {'model': 'sites.site', 'pk': 1, 'fields': {}}])
+        self.write('notes.txt', [])
+
+    def tearDown(self):
+        shutil.rmtree(self.fixture_dir)
+
+    def write(self, name, objects):
+        with open(os.path.join(self.fixture_dir, name), 'w') as fp:
+            json.dump(objects, fp)
+
+    def test_search(self):
+        self.write('sites.json', [])
+        index = FixtureIndex(self.fixture_dir)
+        self.assertEqual(['pages.json', 'sites.json'],
+                         [entry.name for entry in index.search()])
+        self.assertEqual(['sites.json'],
+                         [entry.name for entry in index.search('SITE')])
+
+    def test_entry(self):
+        index = FixtureIndex(self.fixture_dir)
+        entry = index.get(os.path.join(self.fixture_dir, 'pages.json'))
+        self.assertEqual('json', entry.format)
+        self.assertEqual(None, entry.compression)
+        self.assertEqual(os.path.getsize(entry.path), entry.size)
+        self.assertEqual(None, index.get(
+            os.path.join(self.fixture_dir, 'notes.txt')))
+
+    def test_listing_is_cached(self):
+        index = FixtureIndex(self.fixture_dir)
+        index.search()
+        index.listed += 60  # as if the directory was listed long ago
+        entries = index.entries
+        index.search()
+        self.assertTrue(entries is index.entries)
+        self.write('sites.json', [])
+        os.utime(self.fixture_dir, (index.mtime + 10, index.mtime + 10))
+        self.assertEqual(2, len(index.search()))
+
+    def test_count_models(self):
+        index = FixtureIndex(self.fixture_dir)
+        entries = index.search()
+        index.count_models(entries)
+        self.assertEqual(3, entries[0].object_count)
+        self.assertEqual([('sites.site', 1), ('test_app.page', 2)],
+                         entries[0].models)
+        self.assertTrue(os.path.exists(index.get_index_path()))
+        # Counts are read from the index by other processes
+        self.assertEqual(3, FixtureIndex(
+            self.fixture_dir).search()[0].object_count)
+
+    def test_saving_does_not_list_again(self):
+        index = FixtureIndex(self.fixture_dir)
+        index.count_models(index.search())
+        os.utime(self.fixture_dir, (0, 0))
+        index.search()
+        entries = index.entries
+        entries[0].counted = False
+        index.count_models(entries)
+        index.search()
+        self.assertTrue(entries is index.entries)
+
+    def test_changed_fixture_is_counted_again(self):
+        index = FixtureIndex(self.fixture_dir)
+        index.count_models(index.search())
+        self.write('pages.json', [])
+        path = os.path.join(self.fixture_dir, 'pages.json')
+        os.utime(path, (0, 0))
+        self.assertEqual(None, FixtureIndex(
+            self.fixture_dir).search()[0].object_count)
+
+    def test_overwritten_fixture_is_counted_again(self):
+        index = FixtureIndex(self.fixture_dir)
+        entries = index.search()
+        index.count_models(entries)
+        self.write('pages.json', [
+            {'model': 'sites.site', 'pk': 1, 'fields': {}}])
+        path = os.path.join(self.fixture_dir, 'pages.json')
+        os.utime(path, (0, 0))
+        # Overwriting a file doesn't change the mtime of the directory
+        index.mtime = os.stat(self.fixture_dir).st_mtime
+        index.listed = index.mtime + 60
+        entries = index.search()
+        index.count_models(entries)
+        self.assertEqual(1, entries[0].object_count)
+        self.assertEqual(0, entries[0].mtime)
+
+    def test_failures_are_cached(self):
+        with open(os.path.join(self.fixture_dir, 'broken.json'), 'w') as fp:
+            fp.write('[{"model": ')
+        with open(os.path.join(self.fixture_dir, 'pages.xml'), 'w') as fp:
+            fp.write('<django-objects version="1.0"></django-objects>')
+        index = FixtureIndex(self.fixture_dir)
+        index.count_models(index.search())
+        with open(index.get_index_path()) as fp:
+            saved = json.load(fp)
+        self.assertEqual(None, saved['broken.json']['models'])
+        self.assertEqual(None, saved['pages.xml']['models'])
+        entries = FixtureIndex(self.fixture_dir).search()
+        self.assertEqual(['broken.json', 'pages.json', 'pages.xml'],
+                         [entry.name for entry in entries])
+        self.assertTrue(all(entry.counted for entry in entries))
+        self.assertEqual(None, entries[0].object_count)
+
+    def test_count_models_in_background(self):
+        index = FixtureIndex(self.fixture_dir)
+        entries = index.search()
+        index.count_models_in_background(entries)
+        for i in range(100):
+            if not index.counting:
+                break
+            time.sleep(0.05)
+        self.assertEqual(3, entries[0].object_count)
+
+    def test_count_models_from_manifest(self):
+        path = os.path.join(self.fixture_dir, 'pages.json')
+        write_manifest(path, {
+            'size': os.path.getsize(path),
+            'models': [{'model': 'test_app.page', 'count': 42,
+                        'offset': 1}]})
+        index = FixtureIndex(self.fixture_dir)
+        entries = index.search()
+        index.count_models(entries)
+        self.assertEqual(42, entries[0].object_count)
+
+    def test_get_fixture_index(self):
+        self.assertTrue(get_fixture_index(self.fixture_dir) is
+                        get_fixture_index(self.fixture_dir))
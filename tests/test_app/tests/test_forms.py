@@ -1,18 +1,49 @@
 import os.path
+import shutil
+import tempfile
+import time
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.forms import BooleanField, FilePathField
+from django.forms import BooleanField
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils.datastructures import MultiValueDict
 from django.utils.six.moves import reload_module
 from smuggler import settings
-from smuggler.forms import ImportForm
+from smuggler.fixture_index import get_fixture_index
+from smuggler.forms import FixtureIndexField, ImportForm
 
 
 p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
                                                *args))
 
 
+class FixtureDirTestCase(object):
+    """Points SMUGGLER_FIXTURE_DIR to a copy of the test fixtures, the
+    index and stored uploads are written next to them.
+    """
+    def setUp(self):
+        super(FixtureDirTestCase, self).setUp()
+        self.fixture_dir = os.path.join(tempfile.mkdtemp(),
+                                        'smuggler_fixtures')
+        shutil.copytree(p('..', 'smuggler_fixtures'), self.fixture_dir)
+        self.override = override_settings(
+            SMUGGLER_FIXTURE_DIR=self.fixture_dir)
+        self.override.enable()
+        reload_module(settings)
+
+    def tearDown(self):
+        # Waits for the objects to be counted in the background
+        index = get_fixture_index(self.fixture_dir)
+        for i in range(100):
+            if not index.counting:
+                break
+            time.sleep(0.05)
+        self.override.disable()
+        reload_module(settings)
+        shutil.rmtree(os.path.dirname(self.fixture_dir))
+        super(FixtureDirTestCase, self).tearDown()
+
+
 class TestForm(TestCase):
     def test_requires_file(self):
         form = ImportForm({}, {})
@@ -20,6 +51,19 @@ class TestForm(TestCase):
         self.assertEqual({'uploads': ["This field is required."]},
                          form.errors)
 
+    def test_model_choices(self):
+        form = ImportForm({'include_models': ['test_app'],
+                           'exclude_models': ['test_app.page']}, {
+            'uploads': SimpleUploadedFile('valid.json', b'[]')
+        })
+        self.assertTrue(form.is_valid())
+        self.assertIn(('sites.site', 'sites.site'),
+                      form.fields['include_models'].choices)
+        form = ImportForm({'include_models': ['unknown']}, {
+            'uploads': SimpleUploadedFile('valid.json', b'[]')
+        })
+        self.assertFalse(form.is_valid())
+
     def test_invalid_file_extension(self):
         f = SimpleUploadedFile('invalid.txt', b'invalid')
         form = ImportForm({}, {
@@ -29,6 +73,12 @@ class TestForm(TestCase):
         self.assertEqual({'uploads': ["Invalid file extension: .txt."]},
                          form.errors)
 
+    def test_archive_file_extension(self):
+        form = ImportForm({}, {
+            'uploads': SimpleUploadedFile('dump.smuggler.gz', b'data')
+        })
+        self.assertTrue(form.is_valid())
+
     def test_valid_file_extension(self):
         f = SimpleUploadedFile('valid.json', b'[]')
         form = ImportForm({}, {
@@ -43,6 +93,23 @@ class TestForm(TestCase):
         })
         self.assertTrue(form.is_valid())
 
+    def test_valid_compressed_file_extension(self):
+        for name in ('valid.json.gz', 'valid.json.bz2', 'valid.json.zip',
+                     'valid.JSON.GZ', 'valid.jsonl', 'valid.jsonl.gz'):
+            form = ImportForm({}, {
+                'uploads': SimpleUploadedFile(name, b'data')
+            })
+            self.assertTrue(form.is_valid())
+
+    def test_invalid_compressed_file_extension(self):
+        f = SimpleUploadedFile('invalid.txt.gz', b'data')
+        form = ImportForm({}, {
+            'uploads': f
+        })
+        self.assertFalse(form.is_valid())
+        self.assertEqual({'uploads': ["Invalid file extension: .txt."]},
+                         form.errors)
+
     def test_mix_valid_and_invalid(self):
         form = ImportForm({}, MultiValueDict({
             'uploads': [
@@ -54,27 +121,64 @@ class TestForm(TestCase):
         self.assertEqual({'uploads': ["Invalid file extension: .txt."]},
                          form.errors)
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
-    def test_store_checkbox(self):
+    def tearDown(self):
         reload_module(settings)
+
+
+class TestFixtureDirForm(FixtureDirTestCase, TestCase):
+    def test_store_checkbox(self):
         form = ImportForm()
         self.assertIsInstance(form['store'].field, BooleanField)
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
-    def test_picked_files(self):
+    @override_settings(SMUGGLER_BACKGROUND_LOADS=True)
+    def test_background_checkbox(self):
         reload_module(settings)
         form = ImportForm()
-        self.assertIsInstance(form['picked_files'].field, FilePathField)
+        self.assertIsInstance(form['background'].field, BooleanField)
+        self.assertTrue(form['background'].field.initial)
+
+    def test_picked_files(self):
+        form = ImportForm()
+        self.assertIsInstance(form['picked_files'].field, FixtureIndexField)
+
+    def test_picked_files_include_compressed_files(self):
+        form = ImportForm()
+        choices = [os.path.basename(choice[0])
+                   for choice in form['picked_files'].field.choices]
+        self.assertIn('page_dump.json', choices)
+        self.assertIn('page_dump.json.gz', choices)
+        self.assertIn('page_dump.json.zip', choices)
+        self.assertIn('page_dump.jsonl', choices)
+
+    def test_search_picked_files(self):
+        form = ImportForm(query='page json')
+        choices = [os.path.basename(choice[0])
+                   for choice in form['picked_files'].field.choices]
+        self.assertEqual(['page_dump.json', 'page_dump.json.bz2',
+                          'page_dump.json.gz', 'page_dump.json.zip',
+                          'page_dump.jsonl'], choices)
+
+    def test_paginate_picked_files(self):
+        ImportForm.fixtures_per_page = 2
+        try:
+            form = ImportForm(query='page', page=2)
+        finally:
+            ImportForm.fixtures_per_page = 50
+        choices = [os.path.basename(choice[0])
+                   for choice in form['picked_files'].field.choices]
+        self.assertEqual(['page_dump.json.gz', 'page_dump.json.zip'],
+                         choices)
+
+    def test_picked_file_from_other_page(self):
+        form = ImportForm({
+            'picked_files': [os.path.join(self.fixture_dir, 'site_dump.json')]
+        }, {}, query='page')
+        self.assertTrue(form.is_valid())
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
     def test_requires_at_least_one_field(self):
-        reload_module(settings)
         form = ImportForm({}, {})
         self.assertFalse(form.is_valid())
         self.assertEqual(form.errors, {
             '__all__': [
                 'At least one fixture file needs to be uploaded or selected.'
             ]})
-
-    def tearDown(self):
-        reload_module(settings)
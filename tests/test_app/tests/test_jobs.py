@@ -0,0 +1,254 @@
+import json
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from django.contrib.sites.models import Site
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django.utils.six.moves import reload_module
+from freezegun import freeze_time
+from smuggler import jobs, settings
+from smuggler.manifest import read_manifest
+from tests.test_app.models import Page
+
+
+p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               *args))
+
+
+class JobDirTestCase(object):
+    def setUp(self):
+        super(JobDirTestCase, self).setUp()
+        self.fixture_dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            SMUGGLER_FIXTURE_DIR=self.fixture_dir,
+            SMUGGLER_JOB_RUNNER='command')
+        self.override.enable()
+        reload_module(settings)
+
+    def tearDown(self):
+        self.override.disable()
+        reload_module(settings)
+        shutil.rmtree(self.fixture_dir)
+        super(JobDirTestCase, self).tearDown()
+
+
+class TestJobs(JobDirTestCase, TestCase):
+    def test_save_and_get(self):
+        job = jobs.Job('dump', {'app_labels': ['sites']})
+        job.save()
+        loaded = jobs.Job.get(job.id)
+        self.assertEqual(job.id, loaded.id)
+        self.assertEqual('dump', loaded.kind)
+        self.assertEqual(jobs.PENDING, loaded.status)
+        self.assertEqual({'app_labels': ['sites']}, loaded.params)
+
+    def test_get_unknown_job(self):
+        self.assertRaises(jobs.Job.DoesNotExist, jobs.Job.get, '0' * 32)
+
+    def test_get_invalid_job_id(self):
+        self.assertRaises(jobs.Job.DoesNotExist, jobs.Job.get, '../jobs')
+
+    def test_requires_fixture_dir(self):
+        with self.settings(SMUGGLER_FIXTURE_DIR=None):
+            reload_module(settings)
+            self.assertRaises(ImproperlyConfigured,
+                              jobs.Job('dump').save)
+
+    def test_claim_once(self):
+        job = jobs.enqueue(jobs.Job('dump'))
+        self.assertTrue(job.claim())
+        self.assertFalse(job.claim())
+
+    def test_abandoned_jobs_fail(self):
+        dead = subprocess.Popen([sys.executable, '-c', ''])
+        dead.wait()
+        job = jobs.enqueue(jobs.Job('dump'))
+        job.claim()
+        job.status = jobs.RUNNING
+        job.save()
+        self.assertFalse(job.is_abandoned())
+        lock_path = job.get_path(job.id, 'lock')
+        with open(lock_path) as fp:
+            owner = json.load(fp)
+        with open(lock_path, 'w') as fp:
+            json.dump(dict(owner, pid=dead.pid), fp)
+        self.assertTrue(job.is_abandoned())
+        self.assertEqual([job.id],
+                         [run.id for run in jobs.run_pending_jobs()])
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.FAILED, job.status)
+        self.assertEqual('The worker running the job stopped.', job.error)
+        self.assertEqual([], jobs.run_pending_jobs())
+
+    def test_jobs_without_heartbeat_are_abandoned(self):
+        job = jobs.enqueue(jobs.Job('dump'))
+        job.claim()
+        self.assertFalse(job.is_abandoned())
+        lock_path = job.get_path(job.id, 'lock')
+        os.utime(lock_path, (0, 0))
+        self.assertTrue(job.is_abandoned())
+        # Running jobs touch their lock file
+        jobs.HEARTBEAT_INTERVAL = 0.01
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=job.beat, args=(stopped,))
+        try:
+            heartbeat.start()
+            time.sleep(0.1)
+        finally:
+            stopped.set()
+            heartbeat.join()
+            jobs.HEARTBEAT_INTERVAL = 10
+        self.assertFalse(job.is_abandoned())
+
+    def test_pending(self):
+        first = jobs.enqueue(jobs.Job('dump', created=1))
+        second = jobs.enqueue(jobs.Job('dump', created=2))
+        jobs.Job('dump', status=jobs.DONE).save()
+        self.assertEqual([first.id, second.id],
+                         [job.id for job in jobs.Job.pending()])
+
+    def test_run_dump(self):
+        Page.objects.create(title='test', path='', body='test body')
+        job = jobs.start_dump(['test_app'], [], 'pages.json')
+        self.assertEqual(jobs.PENDING, jobs.Job.get(job.id).status)
+        self.assertEqual([job.id],
+                         [run.id for run in jobs.run_pending_jobs()])
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.DONE, job.status)
+        path = os.path.join(self.fixture_dir, 'pages.json')
+        with open(path, 'rb') as fp:
+            content = json.loads(fp.read().decode('utf-8'))
+        self.assertEqual(['test_app.page'], [o['model'] for o in content])
+        self.assertEqual(os.path.getsize(path), job.result['size'])
+        self.assertFalse(os.path.exists(path + '.part'))
+        self.assertEqual([], jobs.run_pending_jobs())
+
+    def test_run_compressed_dump(self):
+        job = jobs.start_dump(['sites'], [], 'sites.json.gz', 'gzip')
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        self.assertEqual('application/gzip', job.result['content_type'])
+        with open(os.path.join(self.fixture_dir, 'sites.json.gz'),
+                  'rb') as fp:
+            self.assertEqual(b'\x1f\x8b', fp.read(2))
+
+    def test_dump_manifest(self):
+        Page.objects.create(title='test', path='', body='test body')
+        job = jobs.start_dump(['test_app'], [], 'pages.json.gz', 'gzip')
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        manifest = read_manifest(os.path.join(self.fixture_dir,
+                                              'pages.json.gz'))
+        self.assertEqual([{'model': 'test_app.page', 'count': 1,
+                           'offset': 1}], manifest['models'])
+        self.assertEqual('json', manifest['format'])
+        self.assertEqual('gzip', manifest['compression'])
+        self.assertEqual(job.result['size'], manifest['size'])
+        self.assertEqual(job.result['sha1'], manifest['sha1'])
+        self.assertTrue(manifest['duration'] >= 0)
+
+    def test_start_dump_validates_apps(self):
+        self.assertRaises(Exception, jobs.start_dump, ['flatpages'], [],
+                          'flatpages.json')
+        self.assertEqual([], jobs.Job.pending())
+
+    def test_failed_job(self):
+        job = jobs.enqueue(jobs.Job('dump', {
+            'app_labels': ['sites'], 'exclude': [], 'filename': 'sites.json',
+            'format': 'json', 'indent': None, 'compression': 'rar'}))
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.FAILED, job.status)
+        self.assertEqual('Unknown compression: rar', job.error)
+
+    def test_run_load(self):
+        with open(p('..', 'smuggler_fixtures', 'page_dump.json'),
+                  'rb') as fp:
+            upload = SimpleUploadedFile('uploaded.json', fp.read())
+        job = jobs.start_load([
+            upload, p('..', 'smuggler_fixtures', 'site_dump.json')])
+        staging_dir = job.params['staging_dir']
+        self.assertTrue(os.path.exists(
+            os.path.join(staging_dir, 'uploaded.json')))
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.DONE, job.status)
+        self.assertEqual({'object_count': 2, 'fixture_count': 2},
+                         job.result)
+        self.assertEqual(2, job.progress['objects'])
+        self.assertEqual({'test_app.page': 1, 'sites.site': 1},
+                         job.progress['models'])
+        self.assertEqual(job.progress['bytes_total'],
+                         job.progress['bytes_read'])
+        self.assertFalse(os.path.exists(staging_dir))
+        self.assertEqual('test', Page.objects.get(pk=1).title)
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+
+    def test_run_dry_run(self):
+        job = jobs.start_load([
+            p('..', 'smuggler_fixtures', 'garbage', 'invalid_page_dump.json')
+        ], dry_run='rollback')
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.DONE, job.status)
+        self.assertEqual('rollback', job.result['dry_run'])
+        self.assertEqual({'test_app.page': 2}, job.result['models'])
+        self.assertEqual(1, job.result['error_count'])
+        self.assertEqual(2, job.result['errors'][0]['position'])
+        self.assertEqual(0, Page.objects.count())
+
+    def test_failed_load(self):
+        job = jobs.start_load([
+            p('..', 'smuggler_fixtures', 'garbage', 'garbage.json')])
+        jobs.run_pending_jobs()
+        job = jobs.Job.get(job.id)
+        self.assertEqual(jobs.FAILED, job.status)
+        self.assertTrue(job.error)
+
+    def test_throughput_and_eta(self):
+        job = jobs.Job('load', status=jobs.RUNNING, started=100,
+                       progress={'objects': 500, 'bytes_read': 1000,
+                                 'bytes_total': 4000})
+        with freeze_time('1970-01-01 00:01:50'):
+            self.assertEqual(10, job.elapsed)
+            self.assertEqual(50, job.objects_per_second)
+            self.assertEqual(100, job.bytes_per_second)
+            self.assertEqual(25, job.percent_done)
+            self.assertEqual(timedelta(seconds=30), job.eta)
+            self.assertEqual(30, job.as_dict()['eta'])
+        job.status = jobs.DONE
+        job.finished = 120
+        self.assertEqual(None, job.eta)
+        self.assertEqual(25, job.objects_per_second)
+
+    def test_thread_runner(self):
+        jobs.JOB_HANDLERS['test'] = lambda job: {'answer': 42}
+        try:
+            with self.settings(SMUGGLER_JOB_RUNNER='thread'):
+                reload_module(settings)
+                job = jobs.enqueue(jobs.Job('test'))
+            for i in range(100):
+                job = jobs.Job.get(job.id)
+                if job.is_finished:
+                    break
+                time.sleep(0.05)
+        finally:
+            del jobs.JOB_HANDLERS['test']
+        self.assertEqual(jobs.DONE, job.status)
+        self.assertEqual({'answer': 42}, job.result)
+
+    def test_management_command(self):
+        job = jobs.start_dump(['sites'], [], 'sites.json')
+        stdout = StringIO()
+        call_command('smuggler_jobs', stdout=stdout)
+        self.assertEqual('dump job %s: done\n' % job.id, stdout.getvalue())
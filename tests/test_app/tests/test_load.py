@@ -1,8 +1,28 @@
+import json
 import os.path
+import shutil
+import tempfile
+from multiprocessing.pool import ThreadPool
+from django.contrib.auth.models import Group, User
 from django.contrib.sites.models import Site
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.serializers.base import DeserializationError
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.test import TestCase, TransactionTestCase
-from smuggler.utils import load_fixtures
+from django.test.utils import override_settings
+from django.utils.encoding import force_bytes
+from django.utils.six.moves import reload_module
+from smuggler import settings
+from smuggler.manifest import DumpManifest, write_manifest
+from smuggler.utils import (bulk_save_objects, get_fixture_hash,
+                            get_fixture_models, get_model_dependencies,
+                            group_fixtures, load_checkpoint, load_fixtures,
+                            load_fixtures_in_parallel, ModelFilter,
+                            serialize_chunks)
 from tests.test_app.models import Page
+from tests.test_app.tests.test_dump import share_connection
 
 
 p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
@@ -28,6 +48,37 @@ class SimpleLoadTestCase(TestCase):
         self.assertEqual('test', Page.objects.get(pk=1).title)
         self.assertEqual('test.com', Site.objects.get(pk=1).name)
 
+    def test_load_compressed(self):
+        for compression in ('gz', 'bz2', 'zip'):
+            count = load_fixtures([
+                p('..', 'smuggler_fixtures', 'page_dump.json.%s' % compression)
+            ])
+            self.assertEqual(count, 1)
+            self.assertEqual('test', Page.objects.get(pk=1).title)
+            Page.objects.all().delete()
+
+    def test_load_jsonl(self):
+        count = load_fixtures([
+            p('..', 'smuggler_fixtures', 'page_dump.jsonl')])
+        self.assertEqual(count, 1)
+        self.assertEqual('test', Page.objects.get(pk=1).title)
+
+    def test_load_uploaded_file(self):
+        with open(p('..', 'smuggler_fixtures', 'page_dump.json.gz'),
+                  'rb') as fp:
+            upload = SimpleUploadedFile('page_dump.json.gz', fp.read())
+        count = load_fixtures([upload])
+        self.assertEqual(count, 1)
+        self.assertEqual('test', Page.objects.get(pk=1).title)
+
+    def test_load_progress(self):
+        calls = []
+        paths = [p('..', 'smuggler_fixtures', 'page_dump.json.gz'),
+                 p('..', 'smuggler_fixtures', 'site_dump.json')]
+        load_fixtures(paths, progress=lambda *args: calls.append(args))
+        self.assertEqual([(0, Page, os.path.getsize(paths[0])),
+                          (1, Site, os.path.getsize(paths[1]))], calls)
+
     def test_load_all(self):
         self.assertEqual(0, Page.objects.count())
         self.assertEqual(Site.objects.get(pk=1).name, 'example.com')
@@ -39,6 +90,57 @@ class SimpleLoadTestCase(TestCase):
         self.assertEqual('test.com', Site.objects.get(pk=1).name)
 
 
+class FilteredLoadTestCase(TestCase):
+    def test_include(self):
+        count = load_fixtures([p('..', 'smuggler_fixtures', 'all_dump.json')],
+                              model_filter=ModelFilter(include=['sites']))
+        self.assertEqual(1, count)
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+        self.assertEqual(0, Page.objects.count())
+
+    def test_exclude(self):
+        count = load_fixtures(
+            [p('..', 'smuggler_fixtures', 'all_dump.json')],
+            model_filter=ModelFilter(exclude=['sites.site']))
+        self.assertEqual(1, count)
+        self.assertEqual('example.com', Site.objects.get(pk=1).name)
+        self.assertEqual(1, Page.objects.count())
+
+    def test_filter_jsonl(self):
+        count = load_fixtures(
+            [p('..', 'smuggler_fixtures', 'page_dump.jsonl')],
+            model_filter=ModelFilter(exclude=['test_app']))
+        self.assertEqual(0, count)
+
+    def test_filter_compressed(self):
+        count = load_fixtures(
+            [p('..', 'smuggler_fixtures', 'page_dump.json.gz')],
+            model_filter=ModelFilter(include=['test_app.Page']))
+        self.assertEqual(1, count)
+
+    def test_seeks_to_models_in_manifest(self):
+        for i in range(3):
+            Page.objects.create(title='test %d' % i, path='/%d/' % i)
+        manifest = DumpManifest()
+        data = b''.join(force_bytes(chunk) for chunk in serialize_chunks(
+            ['sites', 'test_app'], indent=2, manifest=manifest))
+        Page.objects.all().delete()
+        # The sites are not valid anymore, they must not be read
+        page_offset = manifest.models_by_label['test_app.page']['offset']
+        data = b'[' + b'x' * (page_offset - 1) + data[page_offset:]
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'dump.json')
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        write_manifest(path, manifest.as_dict(size=len(data)))
+        count = load_fixtures([path],
+                              model_filter=ModelFilter(include=['test_app']))
+        self.assertEqual(3, count)
+        self.assertEqual(['test 0', 'test 1', 'test 2'], list(
+            Page.objects.order_by('pk').values_list('title', flat=True)))
+
+
 class TestInvalidLoad(TransactionTestCase):
     def test_load_invalid_data(self):
         # Would test for IntegrityError but we need to support Django 1.4
@@ -46,3 +148,224 @@ class TestInvalidLoad(TransactionTestCase):
                           [p('..', 'smuggler_fixtures',
                              'garbage', 'invalid_page_dump.json')])
         self.assertEqual(0, Page.objects.count())
+
+
+class BulkLoadTestCase(TestCase):
+    def pages_fixture(self, count, title='test'):
+        return SimpleUploadedFile('pages.json', json.dumps([{
+            'pk': i,
+            'model': 'test_app.page',
+            'fields': {'title': title, 'path': 'page-%d' % i, 'body': ''}
+        } for i in range(1, count + 1)]).encode('utf-8'))
+
+    def test_bulk_load_all(self):
+        count = load_fixtures([
+            p('..', 'smuggler_fixtures', 'all_dump.json')
+        ], bulk=True)
+        self.assertEqual(count, 2)
+        self.assertEqual('test', Page.objects.get(pk=1).title)
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+
+    def test_bulk_save_inserts_batches(self):
+        objects = list(serializers.deserialize(
+            'json', self.pages_fixture(50).read()))
+        with self.assertNumQueries(4):  # A lookup and insert per batch
+            saved = list(bulk_save_objects(objects, batch_size=25))
+        self.assertEqual(len(saved), 50)
+        self.assertEqual(Page.objects.count(), 50)
+
+    def test_bulk_load_updates_existing(self):
+        Page(pk=1, title='old', path='page-1', body='').save()
+        count = load_fixtures([self.pages_fixture(3, 'new')], bulk=True)
+        self.assertEqual(count, 3)
+        self.assertEqual('new', Page.objects.get(pk=1).title)
+        self.assertEqual(Page.objects.count(), 3)
+
+    def test_bulk_load_skips_existing(self):
+        Page(pk=1, title='old', path='page-1', body='').save()
+        count = load_fixtures([self.pages_fixture(3, 'new')], bulk=True,
+                              on_conflict='skip')
+        self.assertEqual(count, 2)
+        self.assertEqual('old', Page.objects.get(pk=1).title)
+        self.assertEqual(Page.objects.count(), 3)
+
+    def natural_key_fixture(self, format='json'):
+        """Dumps groups and users that refer to them by natural key, and
+        deletes them.
+        """
+        for name in ('editors', 'readers', 'writers'):
+            group = Group.objects.create(name=name)
+            User.objects.create(username=name).groups.add(group)
+        data = b''.join(force_bytes(chunk) for chunk in serialize_chunks(
+            ['auth.group', 'auth.user'], format=format))
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        return SimpleUploadedFile('auth.%s' % format, data)
+
+    def test_bulk_load_natural_keys(self):
+        for format in ('json', 'jsonl', 'xml'):
+            fixture = self.natural_key_fixture(format)
+            self.assertEqual(6, load_fixtures([fixture], bulk=True))
+            self.assertEqual(['writers'], list(User.objects.get(
+                username='writers').groups.values_list('name', flat=True)))
+            User.objects.all().delete()
+            Group.objects.all().delete()
+
+
+USER_FIXTURE = (b'[{"model": "auth.user", "pk": 5, "fields": {'
+                b'"username": "loaded", "password": "", "groups": [3],'
+                b' "user_permissions": []}}]')
+GROUP_FIXTURE = (b'[{"model": "auth.group", "pk": 3, "fields": {'
+                 b'"name": "loaded", "permissions": []}}]')
+
+
+class ParallelLoadTestCase(TestCase):
+    def setUp(self):
+        self.pool = ThreadPool(1, share_connection,
+                               (connections[DEFAULT_DB_ALIAS],))
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def test_fixture_models(self):
+        self.assertEqual(set([Site, Page]), get_fixture_models(
+            p('..', 'smuggler_fixtures', 'all_dump.json')))
+        self.assertEqual(set([Page]), get_fixture_models(
+            p('..', 'smuggler_fixtures', 'page_dump.json.gz')))
+
+    def test_fixture_models_of_invalid_fixture(self):
+        self.assertRaises(DeserializationError, get_fixture_models,
+                          SimpleUploadedFile('invalid.json',
+                                             b'[{"model": "foo.bar"}]'))
+
+    def test_model_dependencies(self):
+        self.assertIn(Group, get_model_dependencies(User))
+        self.assertEqual(set(), get_model_dependencies(Page))
+
+    def test_group_fixtures(self):
+        fixtures = [SimpleUploadedFile('users.json', USER_FIXTURE),
+                    SimpleUploadedFile('groups.json', GROUP_FIXTURE),
+                    p('..', 'smuggler_fixtures', 'page_dump.json'),
+                    p('..', 'smuggler_fixtures', 'page_dump.jsonl')]
+        self.assertEqual([[1, 0], [2, 3]], group_fixtures(fixtures))
+
+    def test_load_in_parallel(self):
+        fixtures = [SimpleUploadedFile('users.json', USER_FIXTURE),
+                    p('..', 'smuggler_fixtures', 'page_dump.json'),
+                    SimpleUploadedFile('groups.json', GROUP_FIXTURE)]
+        results = load_fixtures_in_parallel(fixtures, pool=self.pool)
+        self.assertEqual([
+            {'name': 'users.json', 'status': 'loaded', 'object_count': 1,
+             'error': None},
+            {'name': 'page_dump.json', 'status': 'loaded',
+             'object_count': 1, 'error': None},
+            {'name': 'groups.json', 'status': 'loaded', 'object_count': 1,
+             'error': None}], results)
+        self.assertEqual(['loaded'], [
+            group.name for group in User.objects.get(pk=5).groups.all()])
+        self.assertEqual('test', Page.objects.get(pk=1).title)
+
+    def test_load_in_parallel_without_pool(self):
+        results = load_fixtures_in_parallel([
+            p('..', 'smuggler_fixtures', 'page_dump.json'),
+            p('..', 'smuggler_fixtures', 'site_dump.json')], workers=4)
+        self.assertEqual(['loaded', 'loaded'],
+                         [result['status'] for result in results])
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+
+    def test_failed_group_is_rolled_back(self):
+        results = load_fixtures_in_parallel([
+            p('..', 'smuggler_fixtures', 'site_dump.json'),
+            p('..', 'smuggler_fixtures', 'page_dump.json'),
+            p('..', 'smuggler_fixtures', 'garbage',
+              'invalid_page_dump.json')], pool=self.pool)
+        self.assertEqual(['loaded', 'rolled back', 'failed'],
+                         [result['status'] for result in results])
+        self.assertEqual([1, 0, 0],
+                         [result['object_count'] for result in results])
+        self.assertTrue(results[2]['error'])
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+        self.assertEqual(0, Page.objects.count())
+
+
+class Crash(Exception):
+    pass
+
+
+class ResumableLoadTestCase(TestCase):
+    def setUp(self):
+        self.fixture_dir = tempfile.mkdtemp()
+        self.override = override_settings(
+            SMUGGLER_FIXTURE_DIR=self.fixture_dir, SMUGGLER_CHUNK_SIZE=2)
+        self.override.enable()
+        reload_module(settings)
+        self.pages = self.write_fixture('pages.json', [
+            {'model': 'test_app.page', 'pk': i,
+             'fields': {'title': 'page %d' % i, 'path': '/%d/' % i,
+                        'body': 'body'}} for i in range(1, 6)])
+        self.sites = p('..', 'smuggler_fixtures', 'site_dump.json')
+
+    def tearDown(self):
+        self.override.disable()
+        reload_module(settings)
+        shutil.rmtree(self.fixture_dir)
+
+    def write_fixture(self, name, objects):
+        path = os.path.join(self.fixture_dir, name)
+        with open(path, 'w') as fp:
+            json.dump(objects, fp)
+        return path
+
+    def crash_after(self, count):
+        calls = []
+
+        def progress(index, model, position):
+            calls.append(index)
+            if len(calls) == count:
+                raise Crash()
+        return progress
+
+    def test_load_resumable(self):
+        count = load_fixtures([self.sites, self.pages], resumable=True)
+        self.assertEqual(6, count)
+        self.assertEqual(5, Page.objects.count())
+        self.assertFalse(os.listdir(os.path.join(self.fixture_dir,
+                                                 '.smuggler_checkpoints')))
+
+    def test_resume_after_crash(self):
+        self.assertRaises(Crash, load_fixtures, [self.sites, self.pages],
+                          progress=self.crash_after(4), resumable=True)
+        # The first batch of pages was committed, the second rolled back
+        self.assertEqual(2, Page.objects.count())
+        self.assertEqual('test.com', Site.objects.get(pk=1).name)
+        checkpoint = load_checkpoint(get_fixture_hash(self.pages))
+        self.assertEqual(2, checkpoint['records'])
+        self.assertFalse(checkpoint['done'])
+        self.assertEqual(['test_app.Page'], checkpoint['models'])
+        self.assertTrue(load_checkpoint(get_fixture_hash(self.sites))['done'])
+
+        calls = []
+        count = load_fixtures([self.sites, self.pages],
+                              progress=lambda *args: calls.append(args[0]),
+                              resumable=True)
+        self.assertEqual(6, count)
+        self.assertEqual([1, 1, 1], calls)
+        self.assertEqual(list(range(1, 6)), list(
+            Page.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual(0, load_checkpoint(
+            get_fixture_hash(self.pages))['records'])
+
+    def test_changed_fixture_starts_over(self):
+        self.assertRaises(Crash, load_fixtures, [self.pages],
+                          progress=self.crash_after(3), resumable=True)
+        pages = self.write_fixture('pages.json', [
+            {'model': 'test_app.page', 'pk': 1,
+             'fields': {'title': 'changed', 'path': '/1/', 'body': ''}}])
+        self.assertEqual(1, load_fixtures([pages], resumable=True))
+        self.assertEqual('changed', Page.objects.get(pk=1).title)
+
+    def test_resumable_load_requires_fixture_dir(self):
+        with self.settings(SMUGGLER_FIXTURE_DIR=None):
+            reload_module(settings)
+            self.assertRaises(ImproperlyConfigured, load_fixtures,
+                              [self.sites], resumable=True)
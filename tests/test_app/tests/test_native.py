@@ -0,0 +1,130 @@
+import datetime
+import json
+import os.path
+import shutil
+import tarfile
+import tempfile
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.encoding import force_bytes, force_text
+from django.utils.six import BytesIO
+from django.utils.six.moves import reload_module
+from smuggler import settings
+from smuggler.native import PostgresEngine, get_copy_models, get_copy_tables
+from smuggler.utils import ModelFilter, load_fixtures, serialize_chunks
+from tests.test_app.models import Page
+
+
+class TestNativeCopy(TestCase):
+    def setUp(self):
+        with self.settings(SMUGGLER_COPY_MODELS=['test_app.Page']):
+            reload_module(settings)
+        self.tmp_dir = tempfile.mkdtemp()
+        Page.objects.create(title='Home', path='home', body='Welcome')
+        Page.objects.create(title='About', path='about', body='Tab\tand\n')
+
+    def tearDown(self):
+        reload_module(settings)
+        shutil.rmtree(self.tmp_dir)
+
+    def dump(self, name='dump.smuggler', app_labels=['sites', 'test_app'],
+             **kwargs):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            for chunk in serialize_chunks(app_labels, format='smuggler',
+                                          **kwargs):
+                fp.write(force_bytes(chunk))
+        return path
+
+    def read_members(self, path):
+        with tarfile.open(path) as archive:
+            return [(member.name, archive.extractfile(member).read())
+                    for member in archive]
+
+    def test_get_copy_models(self):
+        self.assertEqual(set([Page]), get_copy_models([Site, Page]))
+
+    def test_get_copy_tables(self):
+        self.assertEqual([User, User.groups.through,
+                          User.user_permissions.through],
+                         get_copy_tables(User))
+
+    def test_dump_archive(self):
+        members = self.read_members(self.dump())
+        self.assertEqual(['archive.json', '0001.objects.jsonl',
+                          '0002.test_app.page.json',
+                          '0002.test_app.page.jsonl'],
+                         [name for name, data in members])
+        self.assertEqual('sites.site', json.loads(force_text(
+            members[1][1]))['model'])
+        table = json.loads(force_text(members[2][1]))
+        self.assertEqual({
+            'model': 'test_app.page',
+            'copied_with': 'test_app.page',
+            'table': 'test_app_page',
+            'columns': ['id', 'title', 'path', 'body'],
+            'rows': 2,
+            'vendor': 'sqlite',
+        }, table)
+        self.assertEqual(2, len(members[3][1].splitlines()))
+
+    def test_load_archive(self):
+        path = self.dump('dump.smuggler.gz', compression='gzip')
+        Page.objects.all().delete()
+        Site.objects.filter(pk=1).update(name='changed')
+        self.assertEqual(3, load_fixtures([path]))
+        self.assertEqual(['about', 'home'],
+                         sorted(Page.objects.values_list('path', flat=True)))
+        self.assertEqual('Tab\tand\n', Page.objects.get(path='about').body)
+        self.assertEqual('example.com', Site.objects.get(pk=1).name)
+
+    def test_load_archive_keeps_datetimes(self):
+        with self.settings(SMUGGLER_COPY_MODELS=['auth.User']):
+            reload_module(settings)
+        for use_tz in (False, True):
+            joined = datetime.datetime(2020, 1, 2, 3, 4, 5, 123456)
+            if use_tz:
+                joined = joined.replace(tzinfo=timezone.utc)
+            with self.settings(USE_TZ=use_tz):
+                User.objects.create(username='user', date_joined=joined,
+                                    last_login=joined)
+                path = self.dump(app_labels=['auth'])
+                User.objects.all().delete()
+                load_fixtures([path])
+                self.assertEqual(joined, User.objects.get().date_joined)
+                self.assertEqual(1, User.objects.filter(
+                    date_joined=joined).count())
+                User.objects.all().delete()
+
+    def test_load_archive_model_filter(self):
+        path = self.dump()
+        Page.objects.all().delete()
+        self.assertEqual(1, load_fixtures(
+            [path], model_filter=ModelFilter(exclude=['test_app'])))
+        self.assertEqual(0, Page.objects.count())
+
+    def test_load_archive_from_other_vendor(self):
+        path = self.dump()
+        members = self.read_members(path)
+        table = json.loads(force_text(members[2][1]))
+        table['vendor'] = 'postgresql'
+        members[2] = (members[2][0], force_bytes(json.dumps(table)))
+        with tarfile.open(path, 'w') as archive:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, BytesIO(data))
+        Page.objects.all().delete()
+        self.assertRaisesRegexp(
+            CommandError, 'copied from a postgresql database',
+            load_fixtures, [path])
+
+    def test_copy_sql(self):
+        engine = PostgresEngine(connection)
+        self.assertEqual('COPY "test_app_page" ("id", "title") TO STDOUT',
+                         engine.get_sql('test_app_page', ['id', 'title'],
+                                        'TO STDOUT'))
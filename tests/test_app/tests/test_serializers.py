@@ -0,0 +1,270 @@
+import json
+import os.path
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import django
+from django.contrib.auth.models import Group, User
+from django.core import serializers
+from django.core.serializers.base import DeserializationError
+from django.test import TestCase
+from django.utils.encoding import force_text
+from django.utils.six import BytesIO
+from unittest import skipIf
+from smuggler.serializers import columnar, json as json_serializer
+from smuggler.serializers import msgpack_version
+from smuggler.serializers import jsonl
+from smuggler.utils import ModelFilter, load_fixtures, serialize_chunks
+from smuggler.serializers.json import JSONArrayReader
+from tests.test_app.models import Page
+
+# Dumps the sites of a new database in a fresh interpreter that loads the
+# apps, without anything importing smuggler's modules first.
+DUMPDATA_SCRIPT = '''
+import os, sys
+os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.test_settings'
+from django.conf import settings
+settings.DATABASES['default']['NAME'] = ':memory:'
+import django
+django.setup()
+assert 'smuggler.utils' not in sys.modules
+from django.core.management import call_command
+call_command('migrate', verbosity=0)
+call_command('dumpdata', 'sites', format='jsonl')
+'''
+
+
+class TestJSONArrayReader(TestCase):
+    def setUp(self):
+        self.read_chunk_size = json_serializer.READ_CHUNK_SIZE
+        json_serializer.READ_CHUNK_SIZE = 3
+
+    def tearDown(self):
+        json_serializer.READ_CHUNK_SIZE = self.read_chunk_size
+
+    def test_reads_across_chunks(self):
+        data = [{'pk': 12345, 'fields': {'title': u'\xe9t\xe9'}},
+                12345678, 'string', [1, 2.5, None], True]
+        stream = BytesIO(json.dumps(data, indent=2,
+                                    ensure_ascii=False).encode('utf-8'))
+        self.assertEqual(list(JSONArrayReader(stream)), data)
+
+    def test_empty_array(self):
+        self.assertEqual(list(JSONArrayReader(BytesIO(b' [ ] '))), [])
+
+    def test_reads_lazily(self):
+        stream = BytesIO(b'[{"pk": 1}, {"pk": 2}, {"pk": 3}' + b' ' * 100)
+        reader = iter(JSONArrayReader(stream))
+        self.assertEqual(next(reader), {'pk': 1})
+        self.assertTrue(stream.tell() < 20)
+
+    def test_not_an_array(self):
+        self.assertRaises(ValueError, list,
+                          JSONArrayReader(BytesIO(b'{"pk": 1}')))
+
+    def test_missing_delimiter(self):
+        self.assertRaises(ValueError, list,
+                          JSONArrayReader(BytesIO(b'[{"pk": 1} {"pk": 2}]')))
+
+    def test_truncated(self):
+        self.assertRaises(ValueError, list,
+                          JSONArrayReader(BytesIO(b'[{"pk": 1}, {"pk"')))
+
+    def test_values_cut_off_by_chunks(self):
+        data = [-2.5e+10, float('-inf'), u'\xe9\\"', [True, False, None],
+                {'a': {}}]
+        for size in range(1, 12):
+            json_serializer.READ_CHUNK_SIZE = size
+            stream = BytesIO(json.dumps(data).encode('utf-8'))
+            self.assertEqual(list(JSONArrayReader(stream)), data)
+
+    def test_invalid_fails_early(self):
+        stream = BytesIO(b'[{"pk": 1}, {"pk": x}' + b', {"pk": 2}' * 10000 +
+                         b']')
+        self.assertRaises(DeserializationError, list,
+                          json_serializer.Deserializer(stream))
+        self.assertTrue(stream.tell() < 100)
+
+
+class TestJSONDeserializer(TestCase):
+    def test_deserialize(self):
+        Page(title='test', path='test', body='test body').save()
+        Page(title='test 2', path='test-2', body='test body').save()
+        data = serializers.serialize('json', Page.objects.all())
+        objects = list(json_serializer.Deserializer(data))
+        self.assertEqual([obj.object for obj in objects],
+                         list(Page.objects.all()))
+
+    def test_deserialize_garbage(self):
+        self.assertRaises(DeserializationError, list,
+                          json_serializer.Deserializer(b'not json'))
+
+
+class TestJSONLinesSerializer(TestCase):
+    def setUp(self):
+        Page(title='test', path='test', body='test body').save()
+        Page(title='test 2', path='test-2', body='line\nbreak').save()
+
+    def test_is_registered(self):
+        self.assertIn('jsonl', serializers.get_public_serializer_formats())
+
+    def test_serialize(self):
+        data = serializers.serialize('jsonl', Page.objects.all())
+        lines = data.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])['fields']['body'],
+                         'line\nbreak')
+
+    def test_round_trip(self):
+        data = serializers.serialize('jsonl', Page.objects.all())
+        objects = list(serializers.deserialize('jsonl', data))
+        self.assertEqual([obj.object for obj in objects],
+                         list(Page.objects.all()))
+
+    def test_skips_blank_lines(self):
+        data = b'\n{"pk": 1, "model": "test_app.page", "fields": {}}\n\n'
+        self.assertEqual(len(list(jsonl.Deserializer(data))), 1)
+
+    def test_deserialize_garbage(self):
+        self.assertRaises(DeserializationError, list,
+                          jsonl.Deserializer(b'not json'))
+
+
+@skipIf(django.VERSION < (1, 7), 'django.setup() requires django 1.7')
+class TestSerializerRegistration(TestCase):
+    def test_dumpdata(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))))
+        output = subprocess.check_output(
+            [sys.executable, '-c', DUMPDATA_SCRIPT], cwd=root)
+        self.assertEqual('sites.site',
+                         json.loads(force_text(output))['model'])
+
+
+class TestColumnarSerializer(TestCase):
+    def setUp(self):
+        group = Group.objects.create(name='editors')
+        for i in range(4):
+            user = User.objects.create(username='user%d' % i,
+                                       is_staff=i % 2 == 0)
+            user.groups.add(group)
+        Page(title='test', path='test', body=u'line\nbreak \xe9').save()
+
+    def serialize(self, queryset):
+        return serializers.serialize('columnar', queryset)
+
+    def test_is_registered(self):
+        self.assertIn('columnar',
+                      serializers.get_public_serializer_formats())
+
+    def test_round_trip(self):
+        for queryset in (User.objects.all(), Page.objects.all()):
+            objects = list(serializers.deserialize(
+                'columnar', self.serialize(queryset)))
+            self.assertEqual([obj.object for obj in objects],
+                             list(queryset))
+        user = list(serializers.deserialize(
+            'columnar', self.serialize(User.objects.all())))[0]
+        self.assertEqual([force_text(Group.objects.get().pk)],
+                         user.m2m_data['groups'])
+
+    def test_column_encodings(self):
+        data = serializers.serialize('python', User.objects.all())
+        block = columnar.dump_block('auth.user', data)
+        size = struct.unpack('<I', block[:4])[0]
+        header = json.loads(block[4:4 + size].decode('utf-8'))
+        encodings = dict((column['name'], column['encoding'])
+                         for column in header['columns'])
+        self.assertEqual('int', encodings['pk'])
+        self.assertEqual('bool', encodings['is_staff'])
+        self.assertEqual('text', encodings['username'])
+        self.assertEqual('dict', encodings['email'])
+        self.assertEqual('json', encodings['groups'])
+
+    def test_nulls(self):
+        for values in ([None, 1, None], [None, 'a', 'a', 'a'],
+                       [None, 'a', 'b'], [None, 1.5], [None, True],
+                       [None, [1]], [None, None]):
+            column, data = columnar.encode_column('name', values)
+            self.assertEqual(values, columnar.decode_column(
+                column, data, len(values)))
+
+    def test_smaller_than_indented_json(self):
+        self.assertTrue(
+            len(self.serialize(User.objects.all())) <
+            len(serializers.serialize('json', User.objects.all(), indent=2)))
+
+    def test_model_filter_skips_blocks(self):
+        data = b''.join(serialize_chunks(['auth', 'test_app'],
+                                         format='columnar'))
+        objects = list(columnar.Deserializer(
+            data, model_filter=ModelFilter(include=['test_app'])))
+        self.assertEqual(['test'], [obj.object.path for obj in objects])
+
+    def test_load_fixtures(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'dump.columnar')
+            with open(path, 'wb') as fp:
+                for chunk in serialize_chunks(['test_app'],
+                                              format='columnar'):
+                    fp.write(chunk)
+            Page.objects.all().delete()
+            self.assertEqual(1, load_fixtures([path]))
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(u'line\nbreak \xe9', Page.objects.get().body)
+
+    def test_deserialize_garbage(self):
+        self.assertRaises(DeserializationError, list,
+                          columnar.Deserializer(b'not columnar'))
+        data = self.serialize(Page.objects.all())
+        self.assertRaises(DeserializationError, list,
+                          columnar.Deserializer(data[:-1]))
+
+
+@skipIf(msgpack_version is None, 'msgpack is not installed')
+class TestMessagePackSerializer(TestCase):
+    def setUp(self):
+        for i in range(3):
+            Page(title='test %d' % i, path='test-%d' % i,
+                 body=u'line\nbreak \xe9').save()
+
+    def test_is_registered(self):
+        self.assertIn('msgpack', serializers.get_public_serializer_formats())
+
+    def test_round_trip(self):
+        data = serializers.serialize('msgpack', Page.objects.all())
+        objects = list(serializers.deserialize('msgpack', data))
+        self.assertEqual([obj.object for obj in objects],
+                         list(Page.objects.all()))
+        self.assertEqual(u'line\nbreak \xe9', objects[0].object.body)
+
+    def test_smaller_than_indented_json(self):
+        self.assertTrue(
+            len(serializers.serialize('msgpack', Page.objects.all())) <
+            len(serializers.serialize('json', Page.objects.all(), indent=2)))
+
+    def test_load_fixtures(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'dump.msgpack.gz')
+            with open(path, 'wb') as fp:
+                for chunk in serialize_chunks(['test_app'], format='msgpack',
+                                              compression='gzip'):
+                    fp.write(chunk)
+            Page.objects.all().delete()
+            self.assertEqual(3, load_fixtures([path]))
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(3, Page.objects.count())
+
+    def test_deserialize_garbage(self):
+        from smuggler.serializers import msgpack
+        self.assertRaises(DeserializationError, list,
+                          msgpack.Deserializer(b'not msgpack'))
+        data = serializers.serialize('msgpack', Page.objects.all())
+        self.assertRaises(DeserializationError, list,
+                          msgpack.Deserializer(data[:-1]))
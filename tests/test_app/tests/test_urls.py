@@ -19,3 +19,11 @@ class TestSmugglerUrls(TestCase):
 
     def test_can_reverse_load_data(self):
         self.assertEqual(reverse('load-data'), '/admin/load/')
+
+    def test_can_reverse_job_status(self):
+        url = reverse('job-status', kwargs={'job_id': '0' * 32})
+        self.assertEqual(url, '/admin/jobs/%s/' % ('0' * 32))
+
+    def test_can_reverse_job_download(self):
+        url = reverse('job-download', kwargs={'job_id': '0' * 32})
+        self.assertEqual(url, '/admin/jobs/%s/download/' % ('0' * 32))
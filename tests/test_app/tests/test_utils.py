@@ -1,7 +1,8 @@
 import os
 from unittest import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
-from smuggler.utils import save_uploaded_file_on_disk
+from smuggler.utils import (get_model_filter, ModelFilter, parse_range,
+                            save_uploaded_file_on_disk)
 
 p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
                                                *args))
@@ -14,3 +15,45 @@ class TestSaveUploadedFileOnDisk(TestCase):
             SimpleUploadedFile('test.json', b'[]'), path)
         self.assertTrue(os.path.exists(path))
         os.unlink(path)
+
+
+class TestParseRange(TestCase):
+    def test_parse_range(self):
+        self.assertEqual((0, 9), parse_range('bytes=0-9', 100))
+        self.assertEqual((90, 99), parse_range('bytes=90-', 100))
+        self.assertEqual((90, 99), parse_range('bytes=-10', 100))
+        self.assertEqual((0, 99), parse_range('bytes=-1000', 100))
+        self.assertEqual((50, 99), parse_range('bytes=50-1000', 100))
+
+    def test_whole_file(self):
+        self.assertEqual(None, parse_range(None, 100))
+        self.assertEqual(None, parse_range('items=0-9', 100))
+        self.assertEqual(None, parse_range('bytes=0-9,20-29', 100))
+        self.assertEqual(None, parse_range('bytes=a-b', 100))
+        self.assertEqual(None, parse_range('bytes=9-0', 100))
+
+    def test_unsatisfiable_range(self):
+        self.assertRaises(ValueError, parse_range, 'bytes=100-', 100)
+
+
+class TestModelFilter(TestCase):
+    def test_include(self):
+        model_filter = ModelFilter(include=['sites', 'test_app.Page'])
+        self.assertTrue(model_filter('sites.site'))
+        self.assertTrue(model_filter('test_app.page'))
+        self.assertFalse(model_filter('auth.user'))
+
+    def test_exclude(self):
+        model_filter = ModelFilter(include=['auth'], exclude=['auth.group'])
+        self.assertTrue(model_filter('auth.user'))
+        self.assertFalse(model_filter('auth.group'))
+        self.assertFalse(ModelFilter(exclude=['auth'])('auth.user'))
+        self.assertTrue(ModelFilter(exclude=['auth'])('sites.site'))
+
+    def test_invalid_labels_pass(self):
+        self.assertTrue(ModelFilter(include=['auth'])(None))
+
+    def test_no_filter(self):
+        self.assertEqual(None, get_model_filter())
+        self.assertEqual(ModelFilter(['b', 'a']).key,
+                         get_model_filter(['a', 'b'], []).key)
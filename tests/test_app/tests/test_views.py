@@ -1,5 +1,7 @@
+import hashlib
 import json
 import os.path
+from datetime import datetime
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -11,7 +13,11 @@ from django.utils.six import assertRegex
 from freezegun import freeze_time
 from smuggler import settings
 from smuggler.forms import ImportForm
+from smuggler import jobs
+from smuggler.uploads import Upload
 from tests.test_app.models import Page
+from tests.test_app.tests.test_forms import FixtureDirTestCase
+from tests.test_app.tests.test_jobs import JobDirTestCase
 
 
 p = lambda *args: os.path.abspath(os.path.join(os.path.dirname(__file__),
@@ -57,6 +63,32 @@ class TestDumpViewsGenerateDownloadsWithSaneFilenames(SuperUserTestCase,
                          'attachment;'
                          ' filename=sites-site_2012-01-14T00:00:00.json')
 
+    @freeze_time('2012-01-14')
+    def test_dump_compressed(self):
+        url = reverse('dump-model-data', kwargs={
+            'app_label': 'sites',
+            'model_label': 'site'
+        })
+        response = self.c.get(url, {'compress': 'gzip'})
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment;'
+                         ' filename=sites-site_2012-01-14T00:00:00.json.gz')
+
+    @freeze_time('2012-01-14')
+    @override_settings(SMUGGLER_COMPRESSION='gzip')
+    def test_dump_compressed_by_default(self):
+        reload_module(settings)
+        url = reverse('dump-data')
+        response = self.c.get(url)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=2012-01-14T00:00:00.json.gz')
+        response = self.c.get(url, {'compress': 'none'})
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=2012-01-14T00:00:00.json')
+
+    def tearDown(self):
+        reload_module(settings)
+
 
 class TestDumpData(SuperUserTestCase, TestCase):
     def test_dump_data_parameters(self):
@@ -64,10 +96,33 @@ class TestDumpData(SuperUserTestCase, TestCase):
         response = self.c.get(url, {
             'app_label': 'auth.user,sites'
         })
-        content = json.loads(response.content.decode('utf-8'))
+        content = json.loads(b''.join(
+            response.streaming_content).decode('utf-8'))
         self.assertTrue([i for i in content if i['model'] == 'auth.user'])
         self.assertTrue([i for i in content if i['model'] == 'sites.site'])
 
+    def test_dump_data_since(self):
+        url = reverse('dump-model-data', kwargs={
+            'app_label': 'auth',
+            'model_label': 'user'
+        })
+        User.objects.create(username='old',
+                            date_joined=datetime(2015, 1, 1))
+        with self.settings(SMUGGLER_DELTA_FIELDS={'auth.user':
+                                                  'date_joined'}):
+            reload_module(settings)
+            response = self.c.get(url, {'since': '2015-02-01'})
+            content = json.loads(b''.join(
+                response.streaming_content).decode('utf-8'))
+        reload_module(settings)
+        self.assertEqual(['superuser'],
+                         [obj['fields']['username'] for obj in content])
+
+    def test_dump_data_is_streamed(self):
+        url = reverse('dump-data')
+        response = self.c.get(url)
+        self.assertTrue(response.streaming)
+
 
 class TestDumpHandlesErrorsGracefully(SuperUserTestCase, TestCase):
     def test_erroneous_dump_has_error_messages(self):
@@ -81,6 +136,25 @@ class TestDumpHandlesErrorsGracefully(SuperUserTestCase, TestCase):
             'Unknown application: flatpages',
             response_messages[0].message)
 
+    def test_unknown_compression_has_error_message(self):
+        url = reverse('dump-data')
+        response = self.c.get(url, {'compress': 'rar'}, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(1, len(response_messages))
+        self.assertEqual(
+            'An exception occurred while dumping data: '
+            'Unknown compression: rar',
+            response_messages[0].message)
+
+    def test_invalid_since_has_error_message(self):
+        url = reverse('dump-data')
+        response = self.c.get(url, {'since': 'yesterday'}, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(
+            'An exception occurred while dumping data: '
+            'Invalid date: yesterday',
+            response_messages[0].message)
+
     def test_erroneous_dump_redirects(self):
         url = reverse('dump-app-data', kwargs={'app_label': 'flatpages'})
         response = self.c.get(url)
@@ -88,6 +162,265 @@ class TestDumpHandlesErrorsGracefully(SuperUserTestCase, TestCase):
                              target_status_code=404)
 
 
+class TestDumpInBackground(SuperUserTestCase, JobDirTestCase, TestCase):
+    @freeze_time('2012-01-14')
+    def test_dump_redirects_to_job(self):
+        url = reverse('dump-app-data', kwargs={'app_label': 'sites'})
+        response = self.c.get(url, {'background': 1})
+        job = jobs.Job.pending()[0]
+        self.assertRedirects(response, reverse('job-status', kwargs={
+            'job_id': job.id}))
+        self.assertEqual('sites_2012-01-14T00:00:00.json',
+                         job.params['filename'])
+
+    def test_background_dumps_by_default(self):
+        with self.settings(SMUGGLER_BACKGROUND_DUMPS=True):
+            reload_module(settings)
+            response = self.c.get(reverse('dump-data'))
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(1, len(jobs.Job.pending()))
+
+    def test_job_status(self):
+        self.c.get(reverse('dump-data'), {'background': 1})
+        job = jobs.Job.pending()[0]
+        url = reverse('job-status', kwargs={'job_id': job.id})
+        response = self.c.get(url)
+        self.assertTemplateUsed(response, 'smuggler/job_status.html')
+        self.assertContains(response, 'http-equiv="refresh"')
+        self.assertNotContains(response, reverse('job-download', kwargs={
+            'job_id': job.id}))
+        jobs.run_pending_jobs()
+        response = self.c.get(url)
+        self.assertNotContains(response, 'http-equiv="refresh"')
+        self.assertContains(response, reverse('job-download', kwargs={
+            'job_id': job.id}))
+
+    def test_job_download(self):
+        self.c.get(reverse('dump-app-data', kwargs={'app_label': 'sites'}),
+                   {'background': 1, 'compress': 'gzip'})
+        job = jobs.Job.pending()[0]
+        url = reverse('job-download', kwargs={'job_id': job.id})
+        self.assertEqual(404, self.c.get(url).status_code)
+        jobs.run_pending_jobs()
+        response = self.c.get(url)
+        self.assertEqual('application/gzip', response['Content-Type'])
+        self.assertEqual(
+            'attachment; filename=%s' % job.params['filename'],
+            response['Content-Disposition'])
+        with open(os.path.join(self.fixture_dir, job.params['filename']),
+                  'rb') as fp:
+            self.assertEqual(fp.read(),
+                             b''.join(response.streaming_content))
+
+    def get_finished_download(self):
+        self.c.get(reverse('dump-app-data', kwargs={'app_label': 'sites'}),
+                   {'background': 1})
+        job = jobs.Job.pending()[0]
+        jobs.run_pending_jobs()
+        with open(os.path.join(self.fixture_dir, job.params['filename']),
+                  'rb') as fp:
+            content = fp.read()
+        return reverse('job-download', kwargs={'job_id': job.id}), content
+
+    def test_job_manifest(self):
+        url, content = self.get_finished_download()
+        response = self.c.get(url.replace('/download/', '/manifest/'))
+        manifest = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(hashlib.sha1(content).hexdigest(), manifest['sha1'])
+        self.assertEqual('sites.site', manifest['models'][0]['model'])
+
+    def test_job_download_etag(self):
+        url, content = self.get_finished_download()
+        response = self.c.get(url)
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        self.assertEqual(etag, response['ETag'])
+        self.assertEqual('bytes', response['Accept-Ranges'])
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        response = self.c.get(url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(200, response.status_code)
+
+    def test_job_download_range(self):
+        url, content = self.get_finished_download()
+        response = self.c.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(206, response.status_code)
+        self.assertEqual('bytes 10-%d/%d' % (len(content) - 1, len(content)),
+                         response['Content-Range'])
+        self.assertEqual(str(len(content) - 10), response['Content-Length'])
+        self.assertEqual(content[10:], b''.join(response.streaming_content))
+        response = self.c.get(url, HTTP_RANGE='bytes=0-4')
+        self.assertEqual(content[:5], b''.join(response.streaming_content))
+
+    def test_job_download_unsatisfiable_range(self):
+        url, content = self.get_finished_download()
+        response = self.c.get(url, HTTP_RANGE='bytes=%d-' % len(content))
+        self.assertEqual(416, response.status_code)
+        self.assertEqual('bytes */%d' % len(content),
+                         response['Content-Range'])
+
+    def test_job_download_if_range(self):
+        url, content = self.get_finished_download()
+        response = self.c.get(url, HTTP_RANGE='bytes=10-',
+                              HTTP_IF_RANGE='"changed"')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(content, b''.join(response.streaming_content))
+
+    def test_job_status_json(self):
+        self.c.get(reverse('dump-data'), {'background': 1})
+        job = jobs.Job.pending()[0]
+        url = reverse('job-status', kwargs={'job_id': job.id})
+        response = self.c.get(url, {'format': 'json'})
+        self.assertEqual('application/json', response['Content-Type'])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(job.id, data['id'])
+        self.assertEqual('pending', data['status'])
+
+    def test_load_in_background(self):
+        f = open(p('..', 'smuggler_fixtures', 'page_dump.json'), mode='rb')
+        response = self.c.post(reverse('load-data'), {
+            'uploads': f,
+            'background': True
+        })
+        job = jobs.Job.pending()[0]
+        self.assertRedirects(response, reverse('job-status', kwargs={
+            'job_id': job.id}))
+        self.assertEqual(0, Page.objects.count())
+        jobs.run_pending_jobs()
+        self.assertEqual(1, Page.objects.count())
+        response = self.c.get(reverse('job-status', kwargs={
+            'job_id': job.id}))
+        self.assertContains(response, 'Loaded 1 object.')
+        self.assertContains(response, 'test_app.page')
+
+    def test_unknown_job(self):
+        url = reverse('job-status', kwargs={'job_id': '0' * 32})
+        self.assertEqual(404, self.c.get(url).status_code)
+
+    def test_background_dump_requires_fixture_dir(self):
+        with self.settings(SMUGGLER_FIXTURE_DIR=None):
+            reload_module(settings)
+            url = reverse('dump-app-data', kwargs={'app_label': 'sites'})
+            response = self.c.get(url, {'background': 1}, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(
+            'An exception occurred while dumping data: '
+            'Background jobs require SMUGGLER_FIXTURE_DIR to be set.',
+            response_messages[0].message)
+
+
+class TestChunkedUpload(SuperUserTestCase, JobDirTestCase, TestCase):
+    def setUp(self):
+        super(TestChunkedUpload, self).setUp()
+        with open(p('..', 'smuggler_fixtures', 'page_dump.json'), 'rb') as fp:
+            self.content = fp.read()
+        with self.settings(SMUGGLER_UPLOAD_PART_SIZE=32):
+            reload_module(settings)
+
+    def start(self, filename='page_dump.json'):
+        response = self.c.post(reverse('start-upload'), {
+            'filename': filename, 'size': len(self.content)})
+        self.assertEqual(201, response.status_code)
+        return json.loads(response.content.decode('utf-8'))
+
+    def send_part(self, upload, offset, data=None, checksum=None):
+        if data is None:
+            data = self.content[offset:offset + 32]
+        if checksum is None:
+            checksum = hashlib.sha1(data).hexdigest()
+        return self.c.post('%s?offset=%d&sha1=%s' % (
+            upload['url'], offset, checksum), data,
+            content_type='application/octet-stream')
+
+    def upload(self, filename='page_dump.json'):
+        upload = self.start(filename)
+        while not upload['complete']:
+            response = self.send_part(upload, upload['offset'])
+            self.assertEqual(200, response.status_code)
+            upload = json.loads(response.content.decode('utf-8'))
+        return upload
+
+    def test_upload_in_parts(self):
+        upload = self.upload()
+        self.assertEqual(len(self.content), upload['offset'])
+        upload = Upload.get(upload['id'])
+        with open(upload.path, 'rb') as fp:
+            self.assertEqual(self.content, fp.read())
+
+    def test_upload_state(self):
+        upload = self.start()
+        self.send_part(upload, 0)
+        response = self.c.get(upload['url'])
+        self.assertEqual(32, json.loads(response.content.decode('utf-8'))[
+            'offset'])
+
+    def test_invalid_checksum(self):
+        upload = self.start()
+        response = self.send_part(upload, 0, checksum='0' * 40)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(0, Upload.get(upload['id']).offset)
+        self.assertEqual(0, os.path.getsize(
+            Upload.get(upload['id']).part_path))
+        self.assertEqual(200, self.send_part(upload, 0).status_code)
+
+    def test_invalid_part_size(self):
+        upload = self.start()
+        response = self.send_part(upload, 0, data=self.content[:10])
+        self.assertEqual(400, response.status_code)
+
+    def test_resume_from_offset(self):
+        upload = self.start()
+        self.send_part(upload, 0)
+        response = self.send_part(upload, 0)
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(32, json.loads(response.content.decode('utf-8'))[
+            'offset'])
+
+    def test_invalid_file_name(self):
+        response = self.c.post(reverse('start-upload'), {
+            'filename': 'page_dump.txt', 'size': 10})
+        self.assertEqual(400, response.status_code)
+
+    def test_cancel_upload(self):
+        upload = self.start()
+        response = self.c.delete(upload['url'])
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(404, self.c.get(upload['url']).status_code)
+
+    def test_load_chunked_upload(self):
+        upload = self.upload()
+        response = self.c.post(reverse('load-data'), {
+            'chunked_uploads': upload['id']}, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual('Successfully imported 1 file. Loaded 1 object.',
+                         response_messages[0].message)
+        self.assertEqual(1, Page.objects.count())
+        self.assertRaises(Upload.DoesNotExist, Upload.get,
+                          upload['id'])
+
+    def test_load_incomplete_upload(self):
+        upload = self.start()
+        response = self.c.post(reverse('load-data'), {
+            'chunked_uploads': upload['id']})
+        self.assertFormError(response, 'form', 'chunked_uploads',
+                             'The upload of page_dump.json is not complete.')
+
+    def test_store_chunked_upload(self):
+        upload = self.upload()
+        self.c.post(reverse('load-data'), {
+            'chunked_uploads': upload['id'], 'store': True})
+        self.assertTrue(os.path.exists(
+            os.path.join(self.fixture_dir, 'page_dump.json')))
+
+    def test_load_chunked_upload_in_background(self):
+        upload = self.upload()
+        self.c.post(reverse('load-data'), {
+            'chunked_uploads': upload['id'], 'background': True})
+        jobs.run_pending_jobs()
+        self.assertEqual(1, Page.objects.count())
+        self.assertRaises(Upload.DoesNotExist, Upload.get,
+                          upload['id'])
+
+
 class TestLoadDataGet(SuperUserTestCase, TestCase):
     def setUp(self):
         super(TestLoadDataGet, self).setUp()
@@ -102,6 +435,9 @@ class TestLoadDataGet(SuperUserTestCase, TestCase):
         self.assertIsInstance(response.context['form'],
                               ImportForm)
 
+    def tearDown(self):
+        reload_module(settings)
+
 
 class TestLoadDataPost(SuperUserTestCase, TransactionTestCase):
     def setUp(self):
@@ -127,6 +463,65 @@ class TestLoadDataPost(SuperUserTestCase, TransactionTestCase):
         self.assertEqual(response_messages[0].message,
                          'Successfully imported 1 file. Loaded 1 object.')
 
+    def test_load_compressed_fixture(self):
+        f = open(p('..', 'smuggler_fixtures', 'page_dump.json.gz'), mode='rb')
+        response = self.c.post(self.url, {
+            'uploads': f
+        }, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(response_messages[0].message,
+                         'Successfully imported 1 file. Loaded 1 object.')
+        self.assertEqual(1, Page.objects.count())
+
+    def test_load_selected_models(self):
+        f = open(p('..', 'smuggler_fixtures', 'all_dump.json'), mode='rb')
+        response = self.c.post(self.url, {
+            'uploads': f,
+            'exclude_models': ['sites'],
+        }, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(response_messages[0].message,
+                         'Successfully imported 1 file. Loaded 1 object.')
+        self.assertEqual(1, Page.objects.count())
+
+    def test_dry_run(self):
+        f = open(p('..', 'smuggler_fixtures', 'garbage',
+                   'invalid_page_dump.json'), mode='rb')
+        response = self.c.post(self.url, {
+            'uploads': f,
+            'dry_run': 'rollback',
+        }, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(messages.ERROR, response_messages[0].level)
+        self.assertEqual('Dry run of 1 file. Read 2 objects. Found 1 error.',
+                         response_messages[0].message)
+        self.assertEqual('Objects per model: test_app.page: 2',
+                         response_messages[1].message)
+        assertRegex(self, response_messages[-1].message,
+                    r'(?i)^invalid_page_dump.json, object 2: .*unique.*')
+        self.assertEqual(0, Page.objects.count())
+
+    @override_settings(SMUGGLER_LOAD_WORKERS=2)
+    def test_load_fixtures_in_parallel(self):
+        reload_module(settings)
+        response = self.c.post(self.url, {
+            'uploads': [
+                open(p('..', 'smuggler_fixtures', 'site_dump.json'),
+                     mode='rb'),
+                open(p('..', 'smuggler_fixtures', 'garbage',
+                       'invalid_page_dump.json'), mode='rb')]
+        }, follow=True)
+        response_messages = list(response.context['messages'])
+        self.assertEqual(2, len(response_messages))
+        self.assertEqual(messages.INFO, response_messages[0].level)
+        self.assertEqual('Successfully imported 1 file. Loaded 1 object.',
+                         response_messages[0].message)
+        self.assertEqual(messages.ERROR, response_messages[1].level)
+        assertRegex(self, response_messages[1].message,
+                    r'(?i)An exception occurred while loading '
+                    r'invalid_page_dump.json:.*unique.*')
+        self.assertEqual(0, Page.objects.count())
+
     @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
     def test_load_fixture_with_chunks(self):
         self.assertEqual(0, Page.objects.count())
@@ -160,22 +555,34 @@ class TestLoadDataPost(SuperUserTestCase, TransactionTestCase):
         assertRegex(self, response_messages[0].message,
                     r'(?i)An exception occurred while loading data:.*unique.*')
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
-    def test_load_from_disk(self):
+    def tearDown(self):
         reload_module(settings)
+
+
+class TestLoadDataFromFixtureDir(SuperUserTestCase, FixtureDirTestCase,
+                                 TransactionTestCase):
+    def setUp(self):
+        super(TestLoadDataFromFixtureDir, self).setUp()
+        self.url = reverse('load-data')
+
+    def test_search_fixture_directory(self):
+        response = self.c.get(self.url, {'q': 'site'})
+        self.assertContains(response, 'site_dump.json')
+        self.assertNotContains(response, 'page_dump.json')
+        self.assertContains(response, 'id="fixture-search"')
+
+    def test_load_from_disk(self):
         self.assertEqual(0, Page.objects.count())
         self.c.post(self.url, {
-            'picked_files': p('..', 'smuggler_fixtures', 'page_dump.json')
+            'picked_files': os.path.join(self.fixture_dir, 'page_dump.json')
         }, follow=True)
         self.assertEqual(1, Page.objects.count())
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
     def test_load_from_disk_and_upload(self):
-        reload_module(settings)
         f = open(p('..', 'smuggler_fixtures', 'page_dump.json'), mode='rb')
         response = self.c.post(self.url, {
             'uploads': f,
-            'picked_files': p('..', 'smuggler_fixtures', 'page_dump.json')
+            'picked_files': os.path.join(self.fixture_dir, 'page_dump.json')
         }, follow=True)
         response_messages = list(response.context['messages'])
         self.assertEqual(1, len(response_messages))
@@ -183,9 +590,7 @@ class TestLoadDataPost(SuperUserTestCase, TransactionTestCase):
         self.assertEqual(response_messages[0].message,
                          'Successfully imported 2 files. Loaded 2 objects.')
 
-    @override_settings(SMUGGLER_FIXTURE_DIR=p('..', 'smuggler_fixtures'))
     def test_load_and_save(self):
-        reload_module(settings)
         f = SimpleUploadedFile('uploaded.json',
                                b'[{"pk": 1, "model": "test_app.page",'
                                b' "fields": {"title": "test",'
@@ -195,8 +600,4 @@ class TestLoadDataPost(SuperUserTestCase, TransactionTestCase):
             'uploads': f
         }, follow=True)
         self.assertTrue(os.path.exists(
-            p('..', 'smuggler_fixtures', 'uploaded.json')))
-        os.unlink(p('..', 'smuggler_fixtures', 'uploaded.json'))
-
-    def tearDown(self):
-        reload_module(settings)
+            os.path.join(self.fixture_dir, 'uploaded.json')))